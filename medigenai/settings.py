@@ -63,6 +63,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Wait for concurrent writers instead of failing with "database is locked"
+            'timeout': 20,
+        },
+        'TEST': {
+            # File-backed so threaded tests get real locking instead of shared-cache table locks
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -82,6 +90,57 @@ DATABASES = {
 #     }
 # }
 
+# Cache
+# Local memory is per process; with several workers point this at a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache or FileBasedCache)
+# so a write in one worker invalidates cached pages in all of them.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='medigenai'),
+    }
+}
+
+# Seconds a cached dashboard / AI analysis context may live for one data version
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=300, cast=int)
+
+# Seconds a rendered report body may live for one report revision
+REPORT_CACHE_TIMEOUT = config('REPORT_CACHE_TIMEOUT', default=86400, cast=int)
+
+# Worker processes converting report PDFs, and seconds a download waits for
+# a conversion before answering 202 Accepted
+PDF_WORKERS = config('PDF_WORKERS', default=2, cast=int)
+PDF_WAIT_TIMEOUT = config('PDF_WAIT_TIMEOUT', default=20, cast=int)
+
+# AI report generation runs in `manage.py run_ai_worker`: default worker
+# threads, and tries per job before it is marked failed
+AI_WORKER_THREADS = config('AI_WORKER_THREADS', default=4, cast=int)
+AI_JOB_MAX_ATTEMPTS = config('AI_JOB_MAX_ATTEMPTS', default=3, cast=int)
+
+# Cached AI analyses of identical panels: seconds an answer is reused, and
+# the number kept before the least recently used ones are evicted
+AI_CACHE_TTL = config('AI_CACHE_TTL', default=30 * 24 * 3600, cast=int)
+AI_CACHE_MAX_ENTRIES = config('AI_CACHE_MAX_ENTRIES', default=10000, cast=int)
+
+# Chat model behind AI analyses: 'openai', 'openai_compatible' (a server
+# speaking the OpenAI API at AI_BASE_URL, e.g. a local stand-in) or 'local'
+# (deterministic in-process answers for load tests, after AI_LOCAL_LATENCY
+# seconds plus AI_LOCAL_CHUNK_DELAY per streamed chunk)
+AI_BACKEND = config('AI_BACKEND', default='openai')
+AI_MODEL = config('AI_MODEL', default='gpt-4o')
+AI_BASE_URL = config('AI_BASE_URL', default='')
+AI_API_KEY = config('AI_API_KEY', default='')
+AI_TIMEOUT = config('AI_TIMEOUT', default=60, cast=float)
+AI_LOCAL_LATENCY = config('AI_LOCAL_LATENCY', default=1.0, cast=float)
+AI_LOCAL_CHUNK_DELAY = config('AI_LOCAL_CHUNK_DELAY', default=0.02, cast=float)
+
+# Rule-based summaries (reports.summary): used instead of the model for
+# all-normal panels, and in place of the model when it fails or sends
+# nothing within AI_FIRST_TOKEN_TIMEOUT seconds on the streaming page
+AI_RULES_FOR_NORMAL = config('AI_RULES_FOR_NORMAL', default=True, cast=bool)
+AI_RULES_FALLBACK = config('AI_RULES_FALLBACK', default=True, cast=bool)
+AI_FIRST_TOKEN_TIMEOUT = config('AI_FIRST_TOKEN_TIMEOUT', default=10, cast=float)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
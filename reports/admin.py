@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Patient, MedicalReport, TestCategory, TestType, PatientTest, LabSettings
+from . import groups, jobs
+from .models import Patient, MedicalReport, TestCategory, TestType, PatientTest, TestGroup, LabSettings, AIJob, AIAnalysisCache
 
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
@@ -12,6 +13,13 @@ class MedicalReportAdmin(admin.ModelAdmin):
     list_display = ('report_id', 'patient', 'status', 'date_created', 'ai_generated')
     search_fields = ('report_id', 'patient__name')
     list_filter = ('status', 'ai_generated', 'date_created')
+    actions = ['queue_ai_generation']
+    
+    @admin.action(description='Generate AI analysis for selected reports')
+    def queue_ai_generation(self, request, queryset):
+        # Runs on the AI worker pool, like the per-report button
+        count = jobs.enqueue_many(queryset, created_by=request.user)
+        self.message_user(request, f'Queued AI generation for {count} report(s).')
 
 @admin.register(TestCategory)
 class TestCategoryAdmin(admin.ModelAdmin):
@@ -29,6 +37,25 @@ class PatientTestAdmin(admin.ModelAdmin):
     list_display = ('test_id', 'patient', 'test_type', 'result_value', 'status', 'test_date')
     search_fields = ('test_id', 'patient__name', 'test_type__name')
     list_filter = ('status', 'test_date', 'test_type__category')
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        groups.refresh([obj.test_group])
+        MedicalReport.touch([obj.report_id])
+    
+    def delete_queryset(self, request, queryset):
+        affected = list(queryset.values_list('test_group', 'report_id'))
+        super().delete_queryset(request, queryset)
+        groups.refresh(code for code, _ in affected)
+        MedicalReport.touch(report_id for _, report_id in affected)
+
+@admin.register(TestGroup)
+class TestGroupAdmin(admin.ModelAdmin):
+    list_display = ('code', 'patient', 'report', 'analyte_count', 'worst_status', 'is_published', 'test_date')
+    search_fields = ('code', 'patient__name')
+    list_filter = ('is_published', 'worst_status')
+    readonly_fields = ('patient', 'report', 'test_date', 'is_published', 'published_date',
+                       'worst_status', 'analyte_count', 'abnormal_count', 'critical_count')
 
 
 @admin.register(LabSettings)
@@ -43,3 +70,18 @@ class LabSettingsAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         # Prevent deletion of settings
         return False
+
+
+@admin.register(AIJob)
+class AIJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'report', 'status', 'attempts', 'run_after', 'created_at', 'finished_at')
+    search_fields = ('report__report_id',)
+    list_filter = ('status',)
+    readonly_fields = ('locked_by', 'started_at', 'finished_at', 'created_at')
+
+
+@admin.register(AIAnalysisCache)
+class AIAnalysisCacheAdmin(admin.ModelAdmin):
+    list_display = ('key', 'model', 'hits', 'created_at', 'last_used_at')
+    search_fields = ('key',)
+    readonly_fields = ('key', 'model', 'hits', 'created_at', 'last_used_at')
@@ -0,0 +1,221 @@
+"""
+AI-generated clinical assessments for medical reports.
+
+Builds the prompt from a report's published tests, calls the chat model and
+splits its answer into the report's diagnosis and recommendations. Staff
+requests either queue a job (reports.jobs) that a worker process runs, or
+stream the answer to the page as it is generated (`stream_answer`).
+The model is called through the backend chosen in the settings
+(reports.llm). Answers are cached by prompt and model (reports.ai_cache),
+so identical panels cost one model call. All-normal panels are summarised
+by the rule engine (reports.summary) without calling the model, and a
+report without published results is not analysed at all (NoResultsError).
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import ai_cache, classification, llm, summary
+
+TEMPERATURE = 0.3
+MAX_TOKENS = 2000
+
+NO_RESULTS = 'The report has no published test results to analyse'
+
+
+class NoResultsError(ValueError):
+    """The report has no published tests, so there is nothing to assess"""
+
+
+SYSTEM_PROMPT = (
+    "You are a professional medical AI assistant that analyzes laboratory test results "
+    "and provides clinical assessments and recommendations."
+)
+
+
+def report_tests(report):
+    """Published tests of a report with their types and categories"""
+    from .models import PatientTest
+
+    return list(
+        PatientTest.objects.filter(report=report, is_published=True).select_related('test_type', 'test_type__category')
+    )
+
+
+def check_tests(tests):
+    """Raise NoResultsError for an empty panel, which neither the model nor the rules can assess"""
+    if not tests:
+        raise NoResultsError(NO_RESULTS)
+    return tests
+
+
+def build_prompt(report, tests):
+    """Prompt for a report, built only from the patient's age and gender and the test results.
+
+    Tests are listed in a canonical order, so identical panels give identical
+    prompts and share a cached answer.
+    """
+    tests = sorted(tests, key=lambda test: (test.test_type.category.name, test.test_type.name, test.result_value))
+
+    # Build test results data for AI
+    test_data = [
+        {
+            'category': test.test_type.category.name,
+            'name': test.test_type.name,
+            'value': test.result_value,
+            'unit': test.test_type.unit,
+            'normal_min': test.test_type.normal_range_min,
+            'normal_max': test.test_type.normal_range_max,
+            'status': test.status
+        }
+        for test in tests
+    ]
+
+    # Prepare patient context
+    patient = report.patient
+    patient_context = f"""Patient Information:
+- Age: {patient.age}
+- Gender: {patient.gender}"""
+
+    # Format test results for AI
+    test_results_text = "\n".join([
+        f"- {t['category']} - {t['name']}: {t['value']} {t['unit']} "
+        f"(Normal: {t['normal_min']}-{t['normal_max']}, Status: {t['status'].upper()}"
+        for t in test_data
+    ])
+
+    return f"""You are a medical AI assistant analyzing laboratory test results.
+Provide a professional medical report in HTML format.
+
+{patient_context}
+
+Laboratory Test Results:
+{test_results_text}
+
+Please provide:
+1. **Clinical Assessment** (diagnosis section): Analyze the test results, identify critical, abnormal, and normal findings. Provide medical interpretation.
+2. **Medical Recommendations**: Specific recommendations based on the findings, including urgency of follow-up, lifestyle changes, and further tests if needed.
+
+Format your response in clean HTML with <h4>, <p>, <strong>, <ol>, <li> tags. Be professional and medically accurate.
+
+Separate the two sections clearly with the headers "Clinical Assessment" and "Medical Recommendations"."""
+
+
+def messages_for(prompt):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def complete(prompt):
+    """Answer of the chat model to `prompt`"""
+    return llm.backend().complete(messages_for(prompt), TEMPERATURE, MAX_TOKENS)
+
+
+def prompt_key(prompt, backend=None):
+    """Analysis cache key of `prompt` with the model parameters"""
+    model = (backend or llm.backend()).identity
+    return ai_cache.cache_key(messages_for(prompt), model=model, temperature=TEMPERATURE, max_tokens=MAX_TOKENS)
+
+
+def answer(prompt):
+    """Answer to `prompt`, from the analysis cache when the same prompt was answered before"""
+    key = prompt_key(prompt)
+    cached = ai_cache.get(key)
+    if cached is not None:
+        return cached
+    result = complete(prompt)
+    ai_cache.put(key, result, llm.backend().identity)
+    return result
+
+
+async def stream_complete(prompt):
+    """Chunks of the chat model's answer to `prompt` as they are generated"""
+    async for chunk in llm.backend().astream(messages_for(prompt), TEMPERATURE, MAX_TOKENS):
+        yield chunk
+
+
+async def stream_answer(prompt):
+    """Chunks of the answer to `prompt`: a cached answer in one piece, else the model's stream, cached once complete"""
+    key = prompt_key(prompt)
+    cached = await sync_to_async(ai_cache.get)(key)
+    if cached is not None:
+        yield cached
+        return
+    chunks = []
+    async for chunk in stream_complete(prompt):
+        chunks.append(chunk)
+        yield chunk
+    await sync_to_async(ai_cache.put)(key, ''.join(chunks), llm.backend().identity)
+
+
+def split_response(ai_response):
+    """(diagnosis, recommendations) HTML from the model's answer"""
+    # Try to split by common patterns
+    if "Medical Recommendations" in ai_response:
+        parts = ai_response.split("Medical Recommendations")
+        diagnosis = parts[0].replace("Clinical Assessment", "").strip()
+        recommendations = "<h4>Medical Recommendations</h4>" + parts[1].strip()
+    elif "**Medical Recommendations**" in ai_response:
+        parts = ai_response.split("**Medical Recommendations**")
+        diagnosis = parts[0].replace("**Clinical Assessment**", "").replace("Clinical Assessment", "").strip()
+        recommendations = "<h4>Medical Recommendations</h4>" + parts[1].strip()
+    else:
+        # Fallback if AI doesn't split properly
+        diagnosis = ai_response
+        recommendations = "<p>Please consult with your healthcare provider for personalized recommendations.</p>"
+    return diagnosis, recommendations
+
+
+def uses_rules(tests):
+    """Whether the rule engine summarises `tests` instead of the model: there are results and all are normal"""
+    return bool(tests) and getattr(settings, 'AI_RULES_FOR_NORMAL', True) and all(
+        test.status == classification.NORMAL for test in tests
+    )
+
+
+def rules_fallback():
+    """Whether the rule summary stands in when the model fails or is too slow"""
+    return getattr(settings, 'AI_RULES_FALLBACK', True)
+
+
+def assign_sections(report, tests, diagnosis, recommendations):
+    """Set the analysis and the status its tests call for on the report, without saving"""
+    from .services import overall_status
+
+    report.diagnosis, report.recommendations = diagnosis, recommendations
+    report.status = overall_status(test.status for test in tests)
+    report.ai_generated = True
+    return report
+
+
+def assign(report, tests, ai_response):
+    """Set the model's answer and the status its tests call for on the report, without saving"""
+    return assign_sections(report, tests, *split_response(ai_response))
+
+
+def assign_summary(report, tests):
+    """Set the rule-based summary and the status its tests call for on the report, without saving"""
+    return assign_sections(report, tests, *summary.build(tests))
+
+
+def apply_summary(report, tests):
+    """Store the rule-based summary of the report's tests"""
+    assign_summary(report, tests)
+    report.save()
+    return report
+
+
+def apply(report, tests, ai_response):
+    """Store the model's answer on the report together with the status its tests call for"""
+    assign(report, tests, ai_response)
+    report.save()
+    return report
+
+
+def generate(report):
+    """Generate and save the assessment of a report, from the rules for a normal panel and the model otherwise"""
+    tests = check_tests(report_tests(report))
+    if uses_rules(tests):
+        return apply_summary(report, tests)
+    return apply(report, tests, answer(build_prompt(report, tests)))
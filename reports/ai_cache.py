@@ -0,0 +1,87 @@
+"""
+Content-addressed cache of AI analyses.
+
+The prompt is built only from the patient's age and gender and the test
+values, ranges and statuses, so identical panels produce identical
+prompts. Answers are stored in the AIAnalysisCache table under a SHA-256
+of the prompt and the model parameters, shared by every worker process.
+Entries expire after AI_CACHE_TTL seconds and the least recently used
+ones are evicted beyond AI_CACHE_MAX_ENTRIES. Hits and misses are counted
+with the page cache statistics (`manage.py cache_stats`).
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import caching
+
+# Name of the hit/miss counters in reports.caching
+STATS_NAME = 'ai_analysis_answers'
+
+
+def ttl():
+    return timedelta(seconds=getattr(settings, 'AI_CACHE_TTL', 30 * 24 * 3600))
+
+
+def max_entries():
+    return getattr(settings, 'AI_CACHE_MAX_ENTRIES', 10000)
+
+
+def cache_key(messages, **params):
+    """Canonical hash of the chat messages and model parameters"""
+    payload = json.dumps({'messages': messages, 'params': params}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get(key):
+    """Cached answer for `key`, or None if missing or expired; a hit refreshes the entry's LRU position"""
+    from .models import AIAnalysisCache
+
+    now = timezone.now()
+    entry = AIAnalysisCache.objects.filter(key=key, created_at__gt=now - ttl()).values_list('answer', flat=True).first()
+    caching.record(STATS_NAME, entry is not None)
+    if entry is not None:
+        AIAnalysisCache.objects.filter(key=key).update(hits=F('hits') + 1, last_used_at=now)
+    return entry
+
+
+def put(key, answer, model):
+    """Store an answer, replacing an expired entry, then evict beyond the size bound"""
+    from .models import AIAnalysisCache
+
+    now = timezone.now()
+    # The identity only labels the entry, a long endpoint URL must not fail the insert after a paid answer
+    model = model[:AIAnalysisCache._meta.get_field('model').max_length]
+    try:
+        with transaction.atomic():
+            AIAnalysisCache.objects.create(key=key, answer=answer, model=model, created_at=now, last_used_at=now)
+    except IntegrityError:
+        # Expired entry, or another worker answered the same prompt first
+        AIAnalysisCache.objects.filter(key=key).update(answer=answer, model=model, created_at=now, last_used_at=now)
+    evict()
+
+
+def evict():
+    """Delete expired entries and the least recently used ones beyond max_entries(), returns the number deleted"""
+    from .models import AIAnalysisCache
+
+    deleted, _ = AIAnalysisCache.objects.filter(created_at__lte=timezone.now() - ttl()).delete()
+    excess = AIAnalysisCache.objects.count() - max_entries()
+    if excess > 0:
+        oldest = list(AIAnalysisCache.objects.order_by('last_used_at', 'id').values_list('id', flat=True)[:excess])
+        deleted += AIAnalysisCache.objects.filter(id__in=oldest).delete()[0]
+    return deleted
+
+
+def stats():
+    """Hit/miss counters and the number of stored answers"""
+    from .models import AIAnalysisCache
+
+    counts = caching.stats([STATS_NAME])[STATS_NAME]
+    counts['entries'] = AIAnalysisCache.objects.count()
+    return counts
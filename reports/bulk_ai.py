@@ -0,0 +1,247 @@
+"""
+Concurrent AI generation for a backlog of reports.
+
+Reports are processed in batches: each batch is loaded with its tests in
+two queries, all-normal panels get the rule-based summary, the rest is
+answered from the analysis cache where possible or sent to the model
+backend (reports.llm) concurrently, and the
+results are written with a single bulk_update. A token-bucket limiter
+keeps the requests and tokens per minute under the account's limits, and
+a checkpoint file records the last finished batch so an interrupted run
+can resume where it stopped. Used by `manage.py bulk_generate_ai`.
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.utils import timezone
+
+from . import ai, ai_cache, caching, counters, llm
+
+# Rough characters per token of the prompt, for the tokens-per-minute limit
+CHARS_PER_TOKEN = 4
+
+RESULT_FIELDS = ['diagnosis', 'recommendations', 'status', 'ai_generated', 'revision', 'updated_at']
+
+
+class TokenBucket:
+    """Bucket holding up to `per_minute` tokens, refilled continuously at `per_minute` per minute"""
+
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` tokens are available"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits shared by all concurrent calls; 0 disables a limit"""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, clock=time.monotonic):
+        self.requests = TokenBucket(requests_per_minute, clock) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, clock) if tokens_per_minute else None
+        self._lock = None
+
+    async def acquire(self, tokens):
+        """Wait until one request using `tokens` tokens fits in both limits, then take it"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                wait = max(
+                    self.requests.wait_time(1) if self.requests else 0,
+                    self.tokens.wait_time(tokens) if self.tokens else 0,
+                )
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+
+
+def estimate_tokens(prompt):
+    """Upper bound of the tokens a call uses: the messages plus the longest answer"""
+    return (len(ai.SYSTEM_PROMPT) + len(prompt)) // CHARS_PER_TOKEN + ai.MAX_TOKENS
+
+
+async def _complete_all(prompts, concurrency, limiter, backend):
+    """{key: answer or exception} for {key: prompt}, with at most `concurrency` calls in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def complete(prompt):
+        async with semaphore:
+            await limiter.acquire(estimate_tokens(prompt))
+            return await backend.acomplete(ai.messages_for(prompt), ai.TEMPERATURE, ai.MAX_TOKENS)
+
+    try:
+        keys = list(prompts)
+        results = await asyncio.gather(*(complete(prompts[key]) for key in keys), return_exceptions=True)
+        return dict(zip(keys, results))
+    finally:
+        # The batch's event loop ends here, and its connections with it
+        await backend.aclose()
+
+
+def load_batch(report_ids):
+    """Reports with their published tests, in two queries"""
+    from .models import MedicalReport, PatientTest
+
+    published = PatientTest.objects.filter(is_published=True).select_related('test_type', 'test_type__category')
+    return list(
+        MedicalReport.objects.filter(id__in=report_ids).select_related('patient')
+        .prefetch_related(Prefetch('tests', queryset=published, to_attr='published_tests'))
+        .order_by('id')
+    )
+
+
+def save_batch(reports, previous):
+    """Write generated reports with one bulk_update and move them between the dashboard counters.
+
+    `previous` holds each report's (status, ai_generated) before generation.
+    """
+    from .models import MedicalReport
+
+    now = timezone.now()
+    for report in reports:
+        # New revision, so the cached report page and PDF are rendered again
+        report.revision = F('revision') + 1
+        report.updated_at = now
+
+    deltas = counters.report_deltas((report.status, report.ai_generated) for report in reports)
+    deltas.subtract(counters.report_deltas(previous))
+    with transaction.atomic():
+        MedicalReport.objects.bulk_update(reports, RESULT_FIELDS)
+        counters.adjust(deltas)
+        caching.invalidate()
+
+
+def generate_batch(report_ids, concurrency, limiter, backend):
+    """Generate and save the AI analyses of one batch; returns (stats Counter, {report_id: error})"""
+    stats = Counter()
+    reports = load_batch(report_ids)
+    keys = {}
+    prompts = {}
+    answers = {}
+    ruled = set()
+    empty = set()
+    for report in reports:
+        if not report.published_tests:
+            empty.add(report.report_id)
+            continue
+        if ai.uses_rules(report.published_tests):
+            ruled.add(report.pk)
+            continue
+        prompt = ai.build_prompt(report, report.published_tests)
+        key = keys[report.pk] = ai.prompt_key(prompt, backend)
+        if key in answers or key in prompts:
+            # Same panel as an earlier report of the batch
+            continue
+        cached = ai_cache.get(key)
+        if cached is not None:
+            answers[key] = cached
+            stats['cached'] += 1
+        else:
+            prompts[key] = prompt
+
+    errors = {}
+    if prompts:
+        results = asyncio.run(_complete_all(prompts, concurrency, limiter, backend))
+        for key, result in results.items():
+            if isinstance(result, Exception):
+                errors[key] = str(result)
+            else:
+                answers[key] = result
+                ai_cache.put(key, result, backend.identity)
+                stats['requested'] += 1
+
+    done = [report for report in reports if report.pk in ruled or keys.get(report.pk) in answers]
+    previous = [(report.status, report.ai_generated) for report in done]
+    for report in done:
+        if report.pk in ruled:
+            ai.assign_summary(report, report.published_tests)
+        else:
+            ai.assign(report, report.published_tests, answers[keys[report.pk]])
+    save_batch(done, previous)
+
+    failed = {report.report_id: errors[keys[report.pk]] for report in reports if keys.get(report.pk) in errors}
+    failed.update(dict.fromkeys(empty, ai.NO_RESULTS))
+    stats['rules'] += len(ruled)
+    stats['generated'] += len(done)
+    stats['failed'] += len(failed)
+    return stats, failed
+
+
+class Checkpoint:
+    """Progress of a bulk run in a JSON file: the filter, the last finished report pk and the failures"""
+
+    def __init__(self, path, filters):
+        self.path = Path(path) if path else None
+        self.filters = filters
+        self.last_id = 0
+        self.generated = 0
+        self.failed = {}
+
+    def load(self):
+        if not self.path or not self.path.exists():
+            return False
+        data = json.loads(self.path.read_text())
+        if data['filters'] != self.filters:
+            raise ValueError(f'{self.path} was written for filters {data["filters"]}, not {self.filters}')
+        self.last_id = data['last_id']
+        self.generated = data['generated']
+        self.failed = data['failed']
+        return True
+
+    def save(self):
+        if not self.path:
+            return
+        partial = self.path.with_name(self.path.name + '.part')
+        partial.write_text(json.dumps({
+            'filters': self.filters,
+            'last_id': self.last_id,
+            'generated': self.generated,
+            'failed': self.failed,
+        }, indent=2))
+        partial.replace(self.path)
+
+
+def run(queryset, checkpoint, batch_size=50, concurrency=8, limiter=None, backend=None, on_batch=None):
+    """Generate the AI analyses of every report in `queryset` after the checkpoint, batch by batch"""
+    limiter = limiter or RateLimiter()
+    backend = backend or llm.backend()
+    totals = Counter()
+    ids = queryset.order_by('id').values_list('id', flat=True).distinct()
+    while True:
+        batch = list(ids.filter(id__gt=checkpoint.last_id)[:batch_size])
+        if not batch:
+            return totals
+        stats, errors = generate_batch(batch, concurrency, limiter, backend)
+        totals.update(stats)
+
+        checkpoint.last_id = batch[-1]
+        checkpoint.generated += stats['generated']
+        checkpoint.failed.update(errors)
+        checkpoint.save()
+        if on_batch:
+            on_batch(stats, errors)
@@ -0,0 +1,153 @@
+"""
+Versioned caching for expensive page contexts.
+
+Cached entries are keyed by a global data-version stamp that is bumped after
+every committed write to patients, reports or tests, so a write invalidates
+everything derived from the data without tracking individual keys. Lab
+settings have their own version stamp, which tells every worker process to
+drop its in-process copy; it also covers the test catalogue, which shows up
+in every rendered report. Works with any Django cache backend; use a shared
+one (file, Redis, Memcached) when running several worker processes.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Page contexts cached by cached_context(), reported by `manage.py cache_stats`
+PAGE_CACHES = ('dashboard', 'ai_analysis')
+
+# Rendered report bodies cached by cached_report_body()
+REPORT_BODY = 'report_body'
+
+# Backends that keep entries in one process, so other processes (e.g. `manage.py cache_stats`) can't read them
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+VERSION_KEY = 'reports:data-version'
+SETTINGS_VERSION_KEY = 'reports:settings-version'
+STATS_KEY = 'reports:cache-stats:{name}:{outcome}'
+
+_local = threading.local()
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so an evicted stamp never reuses an old version
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        _version(key)
+        cache.incr(key)
+
+
+def data_version():
+    """Current data-version stamp"""
+    return _version(VERSION_KEY)
+
+
+def bump_data_version():
+    _bump(VERSION_KEY)
+
+
+def settings_version():
+    """Current lab settings version stamp"""
+    return _version(SETTINGS_VERSION_KEY)
+
+
+def bump_settings_version():
+    _bump(SETTINGS_VERSION_KEY)
+
+
+def invalidate_settings():
+    """Bump the lab settings version once the current transaction commits"""
+    transaction.on_commit(bump_settings_version)
+
+
+def invalidate():
+    """Bump the data version once the current transaction commits"""
+    if getattr(_local, 'deferred', None) is not None:
+        _local.deferred = True
+        return
+    transaction.on_commit(bump_data_version)
+
+
+@contextmanager
+def batch():
+    """Collapse the invalidations of a bulk write into a single version bump"""
+    if getattr(_local, 'deferred', None) is not None:
+        yield
+        return
+
+    _local.deferred = False
+    try:
+        yield
+        changed = _local.deferred
+    finally:
+        _local.deferred = None
+    if changed:
+        invalidate()
+
+
+def record(name, hit):
+    """Count a cache hit or miss for `name`"""
+    key = STATS_KEY.format(name=name, outcome='hits' if hit else 'misses')
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, timeout=None)
+
+
+def is_shared():
+    """Whether the default cache is visible to other processes"""
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+
+
+def stats(names):
+    """{name: {'hits': n, 'misses': n}} for the given cache names"""
+    result = {}
+    for name in names:
+        result[name] = {
+            outcome: cache.get(STATS_KEY.format(name=name, outcome=outcome), 0)
+            for outcome in ('hits', 'misses')
+        }
+    return result
+
+
+def cached_context(name, build):
+    """Return the context built by `build()` for the current data version, building it on a miss"""
+    key = f'reports:context:{name}:v{data_version()}'
+    context = cache.get(key)
+    record(name, context is not None)
+    if context is None:
+        context = build()
+        cache.set(key, context, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+    return context
+
+
+def report_body_key(report, settings_version):
+    return f'reports:report-body:{report.pk}:r{report.revision}:s{settings_version}'
+
+
+def cached_report_body(report, settings_version, build):
+    """Return the report body HTML built by `build()` for this report revision and settings version"""
+    key = report_body_key(report, settings_version)
+    body = cache.get(key)
+    record(REPORT_BODY, body is not None)
+    if body is None:
+        body = build()
+        cache.set(key, body, getattr(settings, 'REPORT_CACHE_TIMEOUT', 86400))
+    return body
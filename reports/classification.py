@@ -0,0 +1,50 @@
+"""
+Result-status classification for patient tests.
+
+A result is normal inside [normal_range_min, normal_range_max], abnormal
+outside it, and critical below half the minimum or above 1.5x the maximum.
+A missing bound is simply not checked, while a bound of 0 is a real bound
+(cholesterol and triglycerides have a minimum of 0). Values are classified
+as whole batches so write paths never need a per-row save() to get statuses.
+"""
+NORMAL = 'normal'
+ABNORMAL = 'abnormal'
+CRITICAL = 'critical'
+
+CRITICAL_LOW_FACTOR = 0.5
+CRITICAL_HIGH_FACTOR = 1.5
+
+
+def classify(values, mins, maxs):
+    """Classify parallel sequences of values and range bounds in one pass.
+
+    Returns a list of statuses, with None where the test type has no range
+    at all so the caller can keep whatever status the row already has.
+    """
+    statuses = []
+    append = statuses.append
+    for value, low, high in zip(values, mins, maxs):
+        if low is None and high is None:
+            append(None)
+        elif (low is not None and value < low * CRITICAL_LOW_FACTOR) or \
+                (high is not None and value > high * CRITICAL_HIGH_FACTOR):
+            append(CRITICAL)
+        elif (low is not None and value < low) or (high is not None and value > high):
+            append(ABNORMAL)
+        else:
+            append(NORMAL)
+    return statuses
+
+
+def classify_tests(tests):
+    """Set the status of PatientTest instances (with test_type loaded) in one batch"""
+    tests = list(tests)
+    statuses = classify(
+        [test.result_value for test in tests],
+        [test.test_type.normal_range_min for test in tests],
+        [test.test_type.normal_range_max for test in tests],
+    )
+    for test, status in zip(tests, statuses):
+        if status is not None:
+            test.status = status
+    return tests
@@ -0,0 +1,118 @@
+"""
+Materialized dashboard counters.
+
+The dashboard and AI analysis pages read patient and report totals from the
+DashboardCounter table instead of aggregating MedicalReport on every load.
+Signal handlers (reports.signals) and the bulk write paths in
+reports.services adjust the counters in the same transaction as the write;
+`manage.py reconcile_counters` recomputes them from the tables.
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db.models import BigIntegerField, Case, Count, F, Q, Value, When
+
+PATIENTS = 'patients'
+REPORTS = 'reports'
+AI_GENERATED = 'reports_ai_generated'
+STATUSES = ('normal', 'at_risk', 'critical')
+
+
+def status_counter(status):
+    return f'reports_{status}'
+
+
+NAMES = (PATIENTS, REPORTS, AI_GENERATED) + tuple(status_counter(status) for status in STATUSES)
+
+_local = threading.local()
+
+
+def adjust(deltas):
+    """Add `deltas` ({counter name: change}) to the counters in one UPDATE"""
+    from .models import DashboardCounter
+
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.update(deltas)
+        return
+
+    DashboardCounter.objects.filter(name__in=deltas).update(
+        value=F('value') + Case(
+            *[When(name=name, then=Value(delta)) for name, delta in deltas.items()],
+            output_field=BigIntegerField()
+        )
+    )
+
+
+@contextmanager
+def batch():
+    """Collect counter changes made inside the block and apply them in one UPDATE at the end.
+
+    Use inside the transaction doing the writes so bulk deletes don't issue
+    one counter UPDATE per deleted row.
+    """
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+
+    _local.pending = Counter()
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+    adjust(pending)
+
+
+def report_deltas(reports, sign=1):
+    """Counter changes for adding (sign=1) or removing (sign=-1) (status, ai_generated) pairs"""
+    deltas = Counter()
+    for status, ai_generated in reports:
+        deltas[REPORTS] += sign
+        deltas[status_counter(status)] += sign
+        if ai_generated:
+            deltas[AI_GENERATED] += sign
+    return deltas
+
+
+def snapshot():
+    """All counters in one query, missing ones read as 0"""
+    from .models import DashboardCounter
+
+    values = dict.fromkeys(NAMES, 0)
+    values.update(DashboardCounter.objects.values_list('name', 'value'))
+    return values
+
+
+def compute():
+    """Counter values recomputed from the tables"""
+    from .models import Patient, MedicalReport
+
+    values = dict.fromkeys(NAMES, 0)
+    values[PATIENTS] = Patient.objects.count()
+    totals = MedicalReport.objects.aggregate(
+        total=Count('id'),
+        ai_generated=Count('id', filter=Q(ai_generated=True)),
+        **{status: Count('id', filter=Q(status=status)) for status in STATUSES}
+    )
+    values[REPORTS] = totals['total']
+    values[AI_GENERATED] = totals['ai_generated']
+    for status in STATUSES:
+        values[status_counter(status)] = totals[status]
+    return values
+
+
+def reconcile():
+    """Overwrite the counters with freshly computed values and return {name: (stored, actual)} for drifted ones"""
+    from .models import DashboardCounter
+
+    stored = snapshot()
+    actual = compute()
+    for name, value in actual.items():
+        DashboardCounter.objects.update_or_create(name=name, defaults={'value': value})
+    return {name: (stored[name], actual[name]) for name in NAMES if stored[name] != actual[name]}
@@ -0,0 +1,142 @@
+"""
+Streaming CSV and JSON Lines exports of reports and test results.
+
+Rows are read with values_list(...).iterator(chunk_size=CHUNK_SIZE), joined
+with the patient and test type in the same query, and written out as they
+arrive, so an export of millions of rows starts sending at once and only
+ever holds one chunk in memory. The filters are the list pages' query
+string parameters (reports.filters). CSV text cells that a spreadsheet
+would run as a formula are written with a leading quote.
+"""
+import csv
+import json
+from datetime import date, datetime
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+
+from . import filters
+
+CSV = 'csv'
+JSONL = 'jsonl'
+FORMATS = {CSV: 'text/csv', JSONL: 'application/x-ndjson'}
+
+# Rows fetched per database round trip, and written per chunk of output
+CHUNK_SIZE = 2000
+
+REPORT_COLUMNS = [
+    ('report_id', 'report_id'),
+    ('date_created', 'date_created'),
+    ('status', 'status'),
+    ('ai_generated', 'ai_generated'),
+    ('patient_name', 'patient__name'),
+    ('patient_age', 'patient__age'),
+    ('patient_gender', 'patient__gender'),
+    ('contact_number', 'patient__contact_number'),
+    ('diagnosis', 'diagnosis'),
+    ('recommendations', 'recommendations'),
+]
+
+TEST_COLUMNS = [
+    ('test_id', 'test_id'),
+    ('test_group', 'test_group'),
+    ('report_id', 'report__report_id'),
+    ('test_date', 'test_date'),
+    ('patient_name', 'patient__name'),
+    ('contact_number', 'patient__contact_number'),
+    ('category', 'test_type__category__name'),
+    ('test', 'test_type__name'),
+    ('result_value', 'result_value'),
+    ('unit', 'test_type__unit'),
+    ('normal_range_min', 'test_type__normal_range_min'),
+    ('normal_range_max', 'test_type__normal_range_max'),
+    ('status', 'status'),
+    ('is_published', 'is_published'),
+    ('published_date', 'published_date'),
+    ('notes', 'notes'),
+]
+
+
+def report_rows(params):
+    from .models import MedicalReport
+
+    queryset = filters.reports(MedicalReport.objects.all(), params)
+    return REPORT_COLUMNS, queryset
+
+
+def test_rows(params):
+    from .models import PatientTest
+
+    queryset = filters.tests(PatientTest.objects.all(), params)
+    return TEST_COLUMNS, queryset
+
+
+DATASETS = {'reports': report_rows, 'tests': test_rows}
+
+
+def filename(dataset, fmt):
+    return f'{dataset}-{timezone.localdate():%Y%m%d}.{fmt}'
+
+
+# Leading characters that make spreadsheets read a CSV cell as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def cell(value, quote_formulas=False):
+    """JSON/CSV value of a column; with `quote_formulas` text that would be a formula gets a leading quote"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if quote_formulas and isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class Echo:
+    """File-like object handing back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def batches(rows, size=CHUNK_SIZE):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def stream(dataset, params, fmt=CSV, chunk_size=CHUNK_SIZE):
+    """Text chunks of an export: the CSV header (if any) at once, then one chunk per `chunk_size` rows"""
+    columns, queryset = DATASETS[dataset](params)
+    names = [name for name, _ in columns]
+    rows = queryset.order_by('id').values_list(*[lookup for _, lookup in columns]).iterator(chunk_size=chunk_size)
+
+    if fmt == CSV:
+        writer = csv.writer(Echo())
+        yield writer.writerow(names)
+        for batch in batches(rows, chunk_size):
+            yield ''.join(writer.writerow([cell(value, quote_formulas=True) for value in row]) for row in batch)
+    else:
+        for batch in batches(rows, chunk_size):
+            yield ''.join(
+                json.dumps(dict(zip(names, map(cell, row))), ensure_ascii=False) + '\n' for row in batch
+            )
+
+
+async def aiterate(chunks):
+    """Async iterator over a sync one, for streaming responses under ASGI.
+
+    Django 4.2 reads a sync iterator to the end before an ASGI response
+    starts; pulling each chunk from a thread keeps the export streaming.
+    The database cursor stays on the one thread sync_to_async uses.
+    """
+    done = object()
+    pull = sync_to_async(next)
+    while True:
+        chunk = await pull(chunks, done)
+        if chunk is done:
+            return
+        yield chunk
@@ -0,0 +1,37 @@
+"""
+Query string filters shared by the list pages and the exports.
+"""
+from django.db.models import Q
+
+from . import search
+
+
+def reports(queryset, params):
+    """MedicalReport rows matching the reports page filters: `status` and `search`"""
+    status = params.get('status', '')
+    if status:
+        queryset = queryset.filter(status=status)
+    query = params.get('search', '')
+    if query:
+        queryset = search.filter_reports(queryset, query)
+    return queryset
+
+
+def tests(queryset, params):
+    """PatientTest rows matching `status`, `published` ('true'/'false'), `group` and `search` (test or patient)"""
+    from .models import Patient
+
+    status = params.get('status', '')
+    if status:
+        queryset = queryset.filter(status=status)
+    published = params.get('published', '')
+    if published in ('true', 'false'):
+        queryset = queryset.filter(is_published=published == 'true')
+    group = params.get('group', '')
+    if group:
+        queryset = queryset.filter(test_group=group)
+    query = params.get('search', '')
+    if query:
+        patients = search.filter_patients(Patient.objects.all(), query).values('id')
+        queryset = queryset.filter(Q(test_id=query) | Q(test_group=query) | Q(patient__in=patients))
+    return queryset
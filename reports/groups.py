@@ -0,0 +1,108 @@
+"""
+Denormalized test group summaries.
+
+PatientTest rows sharing a test_group code form one group. The TestGroup
+table keeps one row per group with its patient, report, dates, published
+flag, worst status and analyte counts, so listings and statistics read one
+row per group instead of one row per analyte. The write paths in
+reports.services call refresh() with the codes they touched.
+"""
+from django.db.models import Case, Count, IntegerField, Max, Min, Q, Value, When
+
+STATUS_RANK = {'normal': 0, 'abnormal': 1, 'critical': 2}
+RANKED_STATUS = {rank: status for status, rank in STATUS_RANK.items()}
+
+# Groups summarized per query
+REFRESH_CHUNK_SIZE = 500
+
+SUMMARY_FIELDS = [
+    'patient_id', 'report_id', 'test_date', 'is_published', 'published_date',
+    'worst_status', 'analyte_count', 'abnormal_count', 'critical_count',
+]
+
+
+def summaries(tests):
+    """One summary dict per test_group of a PatientTest queryset"""
+    status_rank = Case(
+        *[When(status=status, then=Value(rank)) for status, rank in STATUS_RANK.items()],
+        default=Value(0), output_field=IntegerField()
+    )
+    rows = tests.order_by().values('test_group').annotate(
+        summary_patient=Min('patient'),
+        summary_report=Max('report'),
+        summary_test_date=Max('test_date'),
+        summary_published_date=Max('published_date'),
+        summary_count=Count('id'),
+        summary_published=Count('id', filter=Q(is_published=True)),
+        summary_abnormal=Count('id', filter=Q(status='abnormal')),
+        summary_critical=Count('id', filter=Q(status='critical')),
+        summary_rank=Max(status_rank),
+    )
+    for row in rows:
+        yield row['test_group'], {
+            'patient_id': row['summary_patient'],
+            'report_id': row['summary_report'],
+            'test_date': row['summary_test_date'],
+            'is_published': row['summary_published'] == row['summary_count'],
+            'published_date': row['summary_published_date'],
+            'worst_status': RANKED_STATUS[row['summary_rank']],
+            'analyte_count': row['summary_count'],
+            'abnormal_count': row['summary_abnormal'],
+            'critical_count': row['summary_critical'],
+        }
+
+
+def summary(tests):
+    """Summary dict (SUMMARY_FIELDS) of the in-memory tests of a new group"""
+    statuses = [test.status for test in tests]
+    return {
+        'patient_id': min(test.patient_id for test in tests),
+        'report_id': max((test.report_id for test in tests if test.report_id), default=None),
+        'test_date': max(test.test_date for test in tests),
+        'is_published': all(test.is_published for test in tests),
+        'published_date': max((test.published_date for test in tests if test.published_date), default=None),
+        'worst_status': RANKED_STATUS[max(STATUS_RANK.get(status, 0) for status in statuses)],
+        'analyte_count': len(tests),
+        'abnormal_count': statuses.count('abnormal'),
+        'critical_count': statuses.count('critical'),
+    }
+
+
+def build(code, tests):
+    """Unsaved TestGroup summarizing in-memory tests of a new group"""
+    from .models import TestGroup
+
+    return TestGroup(code=code, **summary(tests))
+
+
+def refresh(codes):
+    """Recompute the TestGroup rows of the given codes, deleting groups that have no tests left"""
+    from .models import PatientTest, TestGroup
+
+    codes = sorted(set(codes))
+    for start in range(0, len(codes), REFRESH_CHUNK_SIZE):
+        chunk = codes[start:start + REFRESH_CHUNK_SIZE]
+        rows = dict(summaries(PatientTest.objects.filter(test_group__in=chunk)))
+        existing = {group.code: group for group in TestGroup.objects.filter(code__in=chunk)}
+
+        stale = set(existing) - set(rows)
+        if stale:
+            TestGroup.objects.filter(code__in=stale).delete()
+
+        created, updated = [], []
+        for code, values in rows.items():
+            group = existing.get(code) or TestGroup(code=code)
+            for field, value in values.items():
+                setattr(group, field, value)
+            (updated if group.pk else created).append(group)
+
+        TestGroup.objects.bulk_create(created)
+        TestGroup.objects.bulk_update(updated, SUMMARY_FIELDS)
+
+
+def rebuild():
+    """Recreate every TestGroup row from the patient tests"""
+    from .models import PatientTest, TestGroup
+
+    TestGroup.objects.all().delete()
+    refresh(list(PatientTest.objects.order_by().values_list('test_group', flat=True).distinct()))
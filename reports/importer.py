@@ -0,0 +1,321 @@
+"""
+Streaming import of analyzer results from CSV and HL7 v2 files.
+
+The file is read as a pipeline of generators: lines are parsed into rows,
+consecutive rows of the same patient and sample become one test group,
+and the groups are collected into chunks of about CHUNK_SIZE rows. Each
+chunk resolves its patients by contact_number with one query (test types
+are mapped by name once), is classified in one batch and is written with
+bulk_create in its own transaction, so memory stays constant however big
+the file is. Imported groups are drafts unless `publish` is set.
+
+CSV files need the columns contact_number, test and value, and may have
+test_date, sample and notes. HL7 files are ORU^R01 messages: PID-13 holds
+the contact number, each OBR a sample, and each numeric OBX a result
+named by the text (or the code) of OBX-3.
+"""
+import codecs
+import csv
+import re
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import groupby
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import caching, classification, groups, sequences, services
+
+CSV = 'csv'
+HL7 = 'hl7'
+FORMATS = (CSV, HL7)
+
+# Bytes read from the file at a time
+READ_SIZE = 64 * 1024
+
+# Rows written per transaction
+CHUNK_SIZE = 5000
+
+# Contact numbers kept in the patient lookup map before it is emptied
+PATIENT_CACHE_SIZE = 100000
+
+# Row errors kept for the summary; the rest are only counted
+MAX_ERRORS = 20
+
+# HL7 TS: YYYYMMDD[HH[MM[SS[.S...]]]][+/-ZZZZ]
+HL7_TIMESTAMP = re.compile(r'(?P<digits>\d{8,})(?:\.\d+)?(?:(?P<sign>[+-])(?P<hours>\d\d)(?P<minutes>\d\d))?')
+
+Row = namedtuple('Row', 'line contact_number test_name value test_date sample notes')
+
+
+class ResultsFileError(ValueError):
+    """The file can't be read as the given format"""
+
+
+def detect_format(filename):
+    return HL7 if filename.lower().endswith(('.hl7', '.txt')) else CSV
+
+
+def read_blocks(file, size=READ_SIZE):
+    """Fixed-size blocks of a binary file"""
+    return iter(lambda: file.read(size), b'')
+
+
+def read_lines(blocks, encoding='utf-8-sig'):
+    """Text lines, with their endings, of a stream of byte blocks"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for block in blocks:
+        pending += decoder.decode(block)
+        lines = pending.splitlines(keepends=True)
+        # The last line may be incomplete, or a CR whose LF is in the next block
+        pending = lines.pop() if lines else ''
+        yield from lines
+    pending += decoder.decode(b'', final=True)
+    yield from pending.splitlines(keepends=True)
+
+
+def parse_timestamp(value):
+    """Aware datetime of an ISO date/datetime or HL7 TS value, or None"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    # Before parse_datetime, which on Python 3.11+ misreads some HL7 values as ISO basic format
+    hl7 = HL7_TIMESTAMP.fullmatch(value)
+    if hl7:
+        parsed = datetime.strptime(hl7['digits'][:14].ljust(14, '0'), '%Y%m%d%H%M%S')
+        if hl7['sign']:
+            offset = timedelta(hours=int(hl7['hours']), minutes=int(hl7['minutes']))
+            parsed = parsed.replace(tzinfo=dt_timezone(-offset if hl7['sign'] == '-' else offset))
+    else:
+        parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date {value!r}')
+        parsed = datetime(day.year, day.month, day.day)
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def read_csv(lines):
+    """Rows of a CSV export"""
+    reader = csv.DictReader(lines)
+    try:
+        missing = {'contact_number', 'test', 'value'} - set(reader.fieldnames or [])
+        if missing:
+            raise ResultsFileError(f"CSV is missing the column(s): {', '.join(sorted(missing))}")
+        for record in reader:
+            yield Row(
+                line=reader.line_num,
+                contact_number=(record['contact_number'] or '').strip(),
+                test_name=(record['test'] or '').strip(),
+                value=record['value'],
+                test_date=record.get('test_date'),
+                sample=(record.get('sample') or '').strip(),
+                notes=record.get('notes') or '',
+            )
+    except csv.Error as e:
+        # Malformed quoting, NUL bytes, fields over csv.field_size_limit()
+        raise ResultsFileError(f'Invalid CSV after line {reader.line_num}: {e}')
+
+
+def segments(lines):
+    """HL7 segments, which may end with CR, LF or CRLF"""
+    for line in lines:
+        for segment in line.split('\r'):
+            segment = segment.strip('\n')
+            if segment:
+                yield segment
+
+
+def read_hl7(lines):
+    """Rows of the OBX segments of HL7 ORU messages"""
+    contact_number, sample, sample_date, message = '', '', None, ''
+    for number, segment in enumerate(segments(lines), 1):
+        fields = segment.split('|')
+        kind = fields[0]
+        if kind == 'MSH':
+            # MSH-10, the message control ID, shifted by one as MSH-1 is the separator itself
+            message = fields[9] if len(fields) > 9 else str(number)
+            contact_number, sample, sample_date = '', '', None
+        elif kind == 'PID':
+            phone = fields[13] if len(fields) > 13 else ''
+            contact_number = phone.split('~')[0].split('^')[0].strip()
+        elif kind == 'OBR':
+            sample = f"{message}/{fields[1] if len(fields) > 1 else ''}"
+            sample_date = fields[7] if len(fields) > 7 else None
+        elif kind == 'OBX':
+            if len(fields) < 6 or fields[2] not in ('NM', 'SN', ''):
+                continue
+            code = fields[3].split('^')
+            yield Row(
+                line=number,
+                contact_number=contact_number,
+                test_name=(code[1] if len(code) > 1 and code[1] else code[0]).strip(),
+                value=fields[5],
+                test_date=(fields[14] if len(fields) > 14 and fields[14] else sample_date),
+                sample=sample,
+                notes='',
+            )
+
+
+def samples(rows):
+    """Consecutive rows of one patient and sample"""
+    for _, sample_rows in groupby(rows, key=lambda row: (row.contact_number, row.sample)):
+        yield list(sample_rows)
+
+
+def chunks(sample_groups, size=CHUNK_SIZE):
+    """Lists of whole samples of about `size` rows"""
+    chunk, count = [], 0
+    for sample_rows in sample_groups:
+        chunk.append(sample_rows)
+        count += len(sample_rows)
+        if count >= size:
+            yield chunk
+            chunk, count = [], 0
+    if chunk:
+        yield chunk
+
+
+class ImportStats:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.groups = 0
+        self.published = 0
+        self.skipped = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0
+
+    def error(self, row, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f'Line {row.line}: {message}')
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'groups': self.groups,
+            'published': self.published,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second),
+        }
+
+
+class Importer:
+    """Writes chunks of rows as test groups, resolving patients and test types through lookup maps"""
+
+    def __init__(self, created_by=None, publish=False):
+        from .models import TestType
+
+        self.created_by = created_by
+        self.publish = publish
+        self.test_types = {test_type.name.casefold(): test_type for test_type in TestType.objects.all()}
+        self.patients = {}
+
+    def resolve_patients(self, contact_numbers):
+        from .models import Patient
+
+        missing = set(contact_numbers) - self.patients.keys()
+        if not missing:
+            return
+        if len(self.patients) + len(missing) > PATIENT_CACHE_SIZE:
+            self.patients.clear()
+        # Unknown contact numbers are remembered too, so later chunks don't look them up again
+        self.patients.update(dict.fromkeys(missing))
+        self.patients.update(
+            Patient.objects.filter(contact_number__in=missing).values_list('contact_number', 'id')
+        )
+
+    def build(self, sample_rows, stats):
+        """Unsaved tests of one sample, skipping rows that can't be resolved"""
+        from .models import PatientTest
+
+        now = timezone.now()
+        tests = []
+        for row in sample_rows:
+            patient_id = self.patients.get(row.contact_number)
+            test_type = self.test_types.get(row.test_name.casefold())
+            if patient_id is None:
+                stats.error(row, f'No patient with contact number {row.contact_number!r}')
+                continue
+            if test_type is None:
+                stats.error(row, f'Unknown test {row.test_name!r}')
+                continue
+            try:
+                value = float(row.value)
+            except (TypeError, ValueError):
+                stats.error(row, f'Invalid value {row.value!r}')
+                continue
+            try:
+                test_date = parse_timestamp(row.test_date) or now
+            except ValueError as e:
+                stats.error(row, str(e))
+                continue
+            tests.append(PatientTest(
+                patient_id=patient_id,
+                test_type=test_type,
+                test_date=test_date,
+                result_value=value,
+                notes=row.notes,
+                is_published=False,
+                created_by=self.created_by,
+            ))
+        return tests
+
+    def write(self, chunk, stats):
+        """Classify and insert one chunk of samples in a single transaction"""
+        from .models import PatientTest, TestGroup
+
+        self.resolve_patients({row.contact_number for sample_rows in chunk for row in sample_rows})
+        built = [tests for tests in (self.build(sample_rows, stats) for sample_rows in chunk) if tests]
+        stats.rows += sum(len(sample_rows) for sample_rows in chunk)
+        if not built:
+            return
+
+        all_tests = [test for tests in built for test in tests]
+        classification.classify_tests(all_tests)
+        with transaction.atomic():
+            test_ids = iter(sequences.next_ids(sequences.TEST, len(all_tests)))
+            codes = sequences.next_ids(sequences.TEST_GROUP, len(built))
+            for code, tests in zip(codes, built):
+                for test in tests:
+                    test.test_id = next(test_ids)
+                    test.test_group = code
+            PatientTest.objects.bulk_create(all_tests)
+            TestGroup.objects.bulk_create([groups.build(code, tests) for code, tests in zip(codes, built)])
+            if self.publish:
+                stats.published += len(services.publish_test_groups(codes, created_by=self.created_by))
+            caching.invalidate()
+        stats.imported += len(all_tests)
+        stats.groups += len(built)
+
+    def run(self, rows, chunk_size=CHUNK_SIZE, on_chunk=None):
+        stats = ImportStats()
+        for chunk in chunks(samples(rows), chunk_size):
+            self.write(chunk, stats)
+            if on_chunk:
+                on_chunk(stats)
+        return stats
+
+
+def import_results(lines, fmt=CSV, created_by=None, publish=False, chunk_size=CHUNK_SIZE, on_chunk=None):
+    """Import the results in `lines` (an iterable of text lines, see read_lines) and return the ImportStats"""
+    if fmt not in FORMATS:
+        raise ResultsFileError(f'Unknown format {fmt!r}, expected one of {", ".join(FORMATS)}')
+    rows = read_hl7(lines) if fmt == HL7 else read_csv(lines)
+    return Importer(created_by=created_by, publish=publish).run(rows, chunk_size, on_chunk)
@@ -0,0 +1,219 @@
+"""
+Database-backed queue for AI report generation.
+
+A staff request only inserts an AIJob row and returns; `manage.py
+run_ai_worker` runs the jobs on a pool of worker threads. Workers claim a
+job with a conditional UPDATE, so several threads and processes can share
+the queue on any database backend. A failed job is retried with
+exponential backoff until it runs out of attempts, then gets the rule-based
+summary instead (unless AI_RULES_FALLBACK is off). Every worker sweeps the
+queue each RECOVER_INTERVAL seconds and puts a job whose worker died back
+on it once it has been running for STALE_AFTER.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import ai
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the first retry, doubled for every further attempt
+RETRY_DELAY = 5
+RETRY_MAX_DELAY = 300
+
+# Seconds a job may stay running before it is considered abandoned
+STALE_AFTER = 600
+
+# Seconds between a worker's sweeps for abandoned jobs
+RECOVER_INTERVAL = 60
+
+# Queued jobs looked at per claim attempt
+CLAIM_CANDIDATES = 10
+
+# Tries of saving a generated answer while another writer holds the database lock
+SAVE_ATTEMPTS = 5
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def enqueue(report, created_by=None):
+    """Queue AI generation for a report, or return its job that is still queued or running"""
+    from .models import AIJob
+
+    with transaction.atomic():
+        job = AIJob.objects.filter(report=report, status__in=[AIJob.QUEUED, AIJob.RUNNING]).first()
+        if job is None:
+            job = AIJob.objects.create(
+                report=report,
+                created_by=created_by,
+                max_attempts=getattr(settings, 'AI_JOB_MAX_ATTEMPTS', 3)
+            )
+    return job
+
+
+def enqueue_many(reports, created_by=None):
+    """Queue AI generation for many reports with one insert.
+
+    Reports whose job is still pending and reports without published tests are skipped.
+    """
+    from .models import AIJob
+
+    report_ids = list(reports.filter(tests__is_published=True).order_by().values_list('id', flat=True).distinct())
+    pending = set(
+        AIJob.objects.filter(report_id__in=report_ids, status__in=[AIJob.QUEUED, AIJob.RUNNING])
+        .values_list('report_id', flat=True)
+    )
+    max_attempts = getattr(settings, 'AI_JOB_MAX_ATTEMPTS', 3)
+    created = AIJob.objects.bulk_create([
+        AIJob(report_id=pk, created_by=created_by, max_attempts=max_attempts)
+        for pk in report_ids if pk not in pending
+    ])
+    return len(created)
+
+
+def retry_delay(attempts):
+    """Backoff before the next try of a job that has failed `attempts` times"""
+    return timedelta(seconds=min(RETRY_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY))
+
+
+def claim(worker=None):
+    """Mark the next due job as running for `worker` and return it, or None if nothing is due"""
+    from .models import AIJob
+
+    now = timezone.now()
+    candidates = list(
+        AIJob.objects.filter(status=AIJob.QUEUED, run_after__lte=now)
+        .order_by('run_after', 'id').values_list('id', flat=True)[:CLAIM_CANDIDATES]
+    )
+    for pk in candidates:
+        # Only one worker's UPDATE matches while the job is still queued
+        claimed = AIJob.objects.filter(pk=pk, status=AIJob.QUEUED).update(
+            status=AIJob.RUNNING, locked_by=worker or worker_name(), started_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            return AIJob.objects.select_related('report', 'report__patient').get(pk=pk)
+    return None
+
+
+def run(job):
+    """Run a claimed job, recording success, a delayed retry or the final failure"""
+    from .models import AIJob
+
+    tests = None
+    try:
+        tests = ai.check_tests(ai.report_tests(job.report))
+        if ai.uses_rules(tests):
+            retry_locked(ai.apply_summary, job.report, tests)
+        else:
+            answer = ai.answer(ai.build_prompt(job.report, tests))
+            save_answer(job.report, tests, answer)
+    except ai.NoResultsError as e:
+        # Retrying can't help, and there is nothing for the rules to summarise
+        job.last_error = str(e)
+        job.status = AIJob.FAILED
+        job.finished_at = timezone.now()
+    except Exception as e:
+        logger.warning('AI job %s failed on attempt %s: %s', job.pk, job.attempts, e)
+        job.last_error = str(e)
+        if job.attempts < job.max_attempts:
+            job.status = AIJob.QUEUED
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+        elif tests is not None and ai.rules_fallback() and fall_back(job, tests):
+            job.status = AIJob.SUCCEEDED
+            job.last_error = f'Model unavailable, used the rule-based summary: {e}'
+            job.finished_at = timezone.now()
+        else:
+            job.status = AIJob.FAILED
+            job.finished_at = timezone.now()
+    else:
+        job.status = AIJob.SUCCEEDED
+        job.last_error = ''
+        job.finished_at = timezone.now()
+    job.locked_by = ''
+    job.save(update_fields=['status', 'last_error', 'run_after', 'finished_at', 'locked_by'])
+    return job
+
+
+def retry_locked(save, *args):
+    """Call `save(*args)`, retrying briefly on a locked database.
+
+    SQLite fails a transaction that has to wait for another writer instead
+    of blocking, which would otherwise throw away the model's answer.
+    """
+    for attempt in range(SAVE_ATTEMPTS):
+        try:
+            return save(*args)
+        except OperationalError as e:
+            if 'locked' not in str(e) or attempt == SAVE_ATTEMPTS - 1:
+                raise
+            time.sleep(0.1 * 2 ** attempt)
+
+
+def save_answer(report, tests, answer):
+    """Store a generated answer, retrying briefly on a locked database"""
+    return retry_locked(ai.apply, report, tests, answer)
+
+
+def fall_back(job, tests):
+    """Store the rule-based summary for a job the model couldn't answer; False if that fails too"""
+    try:
+        retry_locked(ai.apply_summary, job.report, tests)
+    except Exception:
+        logger.exception('Rule-based summary for AI job %s failed', job.pk)
+        return False
+    return True
+
+
+def recover_stale(stale_after=STALE_AFTER):
+    """Requeue jobs abandoned by a dead worker, failing those that used up their attempts"""
+    from .models import AIJob
+
+    now = timezone.now()
+    stale = AIJob.objects.filter(status=AIJob.RUNNING, started_at__lt=now - timedelta(seconds=stale_after))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=AIJob.FAILED, locked_by='', finished_at=now, last_error='Worker stopped responding'
+    )
+    requeued = stale.update(status=AIJob.QUEUED, locked_by='', run_after=now)
+    return requeued, failed
+
+
+def work(stop, once=False, poll_interval=1.0, on_done=None, stale_after=STALE_AFTER,
+         recover_interval=RECOVER_INTERVAL):
+    """Claim and run jobs until `stop` is set (or, with `once`, until no job is due).
+
+    Abandoned jobs are recovered every `recover_interval` seconds, so a
+    long-running worker also picks up the jobs of workers that died after
+    it started.
+    """
+    worker = worker_name()
+    next_recovery = time.monotonic() + recover_interval
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            if time.monotonic() >= next_recovery:
+                requeued, failed = recover_stale(stale_after)
+                if requeued or failed:
+                    logger.warning('Recovered abandoned AI jobs: %s requeued, %s failed', requeued, failed)
+                next_recovery = time.monotonic() + recover_interval
+            job = claim(worker)
+            if job is None:
+                if once:
+                    return
+                stop.wait(poll_interval)
+                continue
+            run(job)
+            if on_done:
+                on_done(job)
+    finally:
+        connection.close()
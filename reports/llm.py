@@ -0,0 +1,227 @@
+"""
+Chat model backends for AI report generation.
+
+AI_BACKEND selects one:
+
+- 'openai': the OpenAI API with OPENAI_API_KEY
+- 'openai_compatible': any server speaking the OpenAI chat completions API
+  at AI_BASE_URL, such as a local stand-in for load tests
+- 'local': an in-process, deterministic answer after AI_LOCAL_LATENCY
+  seconds, for benchmarks without a network or a key
+
+`backend()` returns one instance per process. The HTTP backends keep one
+pooled client for synchronous calls and one per event loop for async
+calls, so connections are reused across requests.
+"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from openai import AsyncOpenAI, OpenAI, OpenAIError
+
+OPENAI = 'openai'
+OPENAI_COMPATIBLE = 'openai_compatible'
+LOCAL = 'local'
+
+# Test lines of the report prompt, e.g. "- Blood Count - Hemoglobin: 12.0 g/dL (Normal: 13.5-17.5, Status: ABNORMAL"
+# What a failed model call raises: API and connection errors, or a backend missing its settings
+ERRORS = (OpenAIError, ImproperlyConfigured)
+
+PROMPT_TEST_LINE = re.compile(r'^- (?P<test>.+?): (?P<value>\S+) (?P<unit>.*?) \(Normal: .*Status: (?P<status>\w+)', re.M)
+
+
+class Backend(ABC):
+    """A chat model answering a list of messages, synchronously, asynchronously or as a stream of chunks"""
+
+    model = None
+
+    @property
+    def identity(self):
+        """Model and endpoint answering, so answers of different servers aren't mixed in the analysis cache"""
+        return self.model
+
+    @abstractmethod
+    def complete(self, messages, temperature, max_tokens):
+        """Answer text"""
+
+    @abstractmethod
+    async def acomplete(self, messages, temperature, max_tokens):
+        """Answer text, without blocking the event loop"""
+
+    @abstractmethod
+    def astream(self, messages, temperature, max_tokens):
+        """Async iterator of the answer's text chunks as they are generated"""
+
+    async def aclose(self):
+        """Close the async client of the running event loop, before the loop ends"""
+
+
+class OpenAIBackend(Backend):
+    """The OpenAI API, or another server speaking it at `base_url`"""
+
+    def __init__(self, api_key, model, base_url=None, timeout=60):
+        self.model = model
+        self.options = {'api_key': api_key, 'base_url': base_url, 'timeout': timeout}
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def identity(self):
+        base_url = self.options['base_url']
+        return f'{self.model}@{base_url}' if base_url else self.model
+
+    @property
+    def client(self):
+        """Pooled client shared by every thread of the process"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = OpenAI(**self.options)
+        return self._client
+
+    @property
+    def async_client(self):
+        """Pooled client of the running event loop, whose connections can't be used from another loop"""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = AsyncOpenAI(**self.options)
+        return client
+
+    def complete(self, messages, temperature, max_tokens):
+        response = self.client.chat.completions.create(
+            model=self.model, messages=messages, temperature=temperature, max_tokens=max_tokens
+        )
+        return response.choices[0].message.content
+
+    async def acomplete(self, messages, temperature, max_tokens):
+        response = await self.async_client.chat.completions.create(
+            model=self.model, messages=messages, temperature=temperature, max_tokens=max_tokens
+        )
+        return response.choices[0].message.content
+
+    async def astream(self, messages, temperature, max_tokens):
+        stream = await self.async_client.chat.completions.create(
+            model=self.model, messages=messages, temperature=temperature, max_tokens=max_tokens, stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def aclose(self):
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+
+class LocalBackend(Backend):
+    """Deterministic answers built from the prompt's test lines, after a simulated latency"""
+
+    model = 'local'
+
+    def __init__(self, latency=1.0, chunk_delay=0.0, chunk_size=40):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+
+    def answer(self, messages):
+        prompt = messages[-1]['content']
+        tests = list(PROMPT_TEST_LINE.finditer(prompt))
+        flagged = [test for test in tests if test['status'] != 'NORMAL']
+        critical = [test for test in flagged if test['status'] == 'CRITICAL']
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+
+        findings = ''.join(
+            f"<li><strong>{test['test']}</strong>: {test['value']} {test['unit']} ({test['status'].lower()})</li>"
+            for test in flagged
+        )
+        assessment = (
+            f"<h4>Clinical Assessment</h4><p>{len(tests)} result(s) reviewed, "
+            f"{len(flagged)} outside the normal range.</p>"
+            + (f"<ol>{findings}</ol>" if findings else "<p>All results are within normal limits.</p>")
+        )
+        if critical:
+            advice = "<p><strong>Urgent:</strong> contact the patient's physician today about the critical results.</p>"
+        elif flagged:
+            advice = "<p>Review the abnormal results with the patient and repeat them in 4-6 weeks.</p>"
+        else:
+            advice = "<p>No follow-up needed beyond routine screening.</p>"
+        return f"{assessment}<h4>Medical Recommendations</h4>{advice}<!-- local:{digest} -->"
+
+    def chunks(self, text):
+        return [text[start:start + self.chunk_size] for start in range(0, len(text), self.chunk_size)]
+
+    def complete(self, messages, temperature, max_tokens):
+        text = self.answer(messages)
+        time.sleep(self.latency + self.chunk_delay * len(self.chunks(text)))
+        return text
+
+    async def acomplete(self, messages, temperature, max_tokens):
+        text = self.answer(messages)
+        await asyncio.sleep(self.latency + self.chunk_delay * len(self.chunks(text)))
+        return text
+
+    async def astream(self, messages, temperature, max_tokens):
+        await asyncio.sleep(self.latency)
+        for chunk in self.chunks(self.answer(messages)):
+            yield chunk
+            await asyncio.sleep(self.chunk_delay)
+
+
+def create(name=None):
+    """Backend `name` (AI_BACKEND by default) configured from the settings"""
+    name = name or getattr(settings, 'AI_BACKEND', OPENAI)
+    model = getattr(settings, 'AI_MODEL', 'gpt-4o')
+    timeout = getattr(settings, 'AI_TIMEOUT', 60)
+    if name == OPENAI:
+        return OpenAIBackend(settings.OPENAI_API_KEY, model, timeout=timeout)
+    if name == OPENAI_COMPATIBLE:
+        base_url = getattr(settings, 'AI_BASE_URL', '')
+        if not base_url:
+            raise ImproperlyConfigured('AI_BACKEND = "openai_compatible" needs AI_BASE_URL')
+        return compatible(base_url)
+    if name == LOCAL:
+        return LocalBackend(
+            latency=getattr(settings, 'AI_LOCAL_LATENCY', 1.0),
+            chunk_delay=getattr(settings, 'AI_LOCAL_CHUNK_DELAY', 0.02),
+        )
+    raise ImproperlyConfigured(f'Unknown AI_BACKEND {name!r}, expected one of {OPENAI}, {OPENAI_COMPATIBLE}, {LOCAL}')
+
+
+def compatible(base_url):
+    """Backend for the OpenAI-compatible server at `base_url`, configured from the settings"""
+    # Local servers usually accept any key, but the client requires one
+    api_key = getattr(settings, 'AI_API_KEY', '') or settings.OPENAI_API_KEY or 'unused'
+    return OpenAIBackend(
+        api_key, getattr(settings, 'AI_MODEL', 'gpt-4o'), base_url=base_url, timeout=getattr(settings, 'AI_TIMEOUT', 60)
+    )
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    """The process-wide backend"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting.startswith('AI_') or setting == 'OPENAI_API_KEY':
+        _backend = None
@@ -0,0 +1,281 @@
+"""
+Synthetic patients, test groups and reports for benchmarks and load tests.
+
+`manage.py generate_load_data` writes production-sized tables quickly:
+each batch of patients is built in memory and written in its own
+transaction, patients and reports with one bulk_create each and the test
+results and group summaries, which are most of the rows, as plain tuples
+with one executemany each, skipping model instances and Django's insert
+compilation. Bulk writes skip the models' save(), so the batch does what
+save(), the signals and the publishing path would have done: IDs come from
+reserved sequence blocks, statuses from the shared classifier, reports
+from services.build_report, and the group summaries, dashboard counters,
+search index and page cache are updated with the rows.
+
+Every patient gets `groups` test groups of `analytes` results drawn from
+the catalog, dated up to `days` back. The first `reports` groups are
+published with a report each, the rest stay drafts. Results are sampled
+inside or outside the reference ranges according to `status_mix`, and the
+same `seed` on an empty database gives the same data.
+"""
+import random
+import time
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import caching, classification, counters, groups, search, sequences, services
+from .classification import ABNORMAL, CRITICAL, NORMAL
+
+# Test results written per transaction
+BATCH_SIZE = 10000
+
+# Generated patients get contact numbers LOAD-0000000001, LOAD-0000000002, ...
+CONTACT_PREFIX = 'LOAD-'
+CONTACT_WIDTH = 10
+
+# Columns of the tuples written for tests and groups
+TEST_FIELDS = [
+    'test_id', 'test_group', 'patient_id', 'report_id', 'test_type_id', 'test_date', 'result_value', 'status',
+    'is_published', 'published_date', 'created_at',
+]
+GROUP_FIELDS = ['code', *groups.SUMMARY_FIELDS]
+
+STATUSES = (NORMAL, ABNORMAL, CRITICAL)
+STATUS_MIX = {NORMAL: 70, ABNORMAL: 25, CRITICAL: 5}
+
+FIRST_NAMES = [
+    ('James', 'male'), ('Robert', 'male'), ('Michael', 'male'), ('David', 'male'), ('Daniel', 'male'),
+    ('Ahmed', 'male'), ('Raj', 'male'), ('Wei', 'male'), ('Carlos', 'male'), ('Ivan', 'male'),
+    ('Mary', 'female'), ('Sarah', 'female'), ('Emily', 'female'), ('Maria', 'female'), ('Aisha', 'female'),
+    ('Priya', 'female'), ('Mei', 'female'), ('Sofia', 'female'), ('Olga', 'female'), ('Grace', 'female'),
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Brown', 'Garcia', 'Khan', 'Patel', 'Chen', 'Kim', 'Nguyen', 'Silva',
+    'Müller', 'Rossi', 'Ivanova', 'Okafor', 'Haddad', 'Tanaka', 'Lopez', 'Wilson', 'Singh', 'Cohen',
+]
+
+
+def parse_status_mix(text):
+    """{status: weight} of a 'normal:abnormal:critical' mix such as '70:25:5'"""
+    parts = text.split(':')
+    try:
+        weights = [float(part) for part in parts]
+    except ValueError:
+        weights = []
+    if len(weights) != len(STATUSES) or min(weights) < 0 or not sum(weights):
+        raise ValueError(f'Invalid status mix {text!r}, expected normal:abnormal:critical weights such as 70:25:5')
+    return dict(zip(STATUSES, weights))
+
+
+def contact_number(number):
+    return f'{CONTACT_PREFIX}{str(number).zfill(CONTACT_WIDTH)}'
+
+
+def last_contact_number():
+    """Highest number of the generated patients already in the database"""
+    from .models import Patient
+
+    last = (
+        Patient.objects.filter(contact_number__startswith=CONTACT_PREFIX)
+        .order_by('-contact_number').values_list('contact_number', flat=True).first()
+    )
+    return int(last[len(CONTACT_PREFIX):]) if last else 0
+
+
+def sample_value(rng, test_type, status):
+    """A result of `test_type` that classifies as `status`, as far as its reference range allows"""
+    low, high = test_type.normal_range_min, test_type.normal_range_max
+    # A side whose bound is 0 or missing can't be left (cholesterol has no low results)
+    sides = [side for side, bound in (('low', low), ('high', high)) if bound]
+    if status == NORMAL or not sides:
+        floor = low if low is not None else 0
+        ceiling = high if high is not None else (floor * 2 or 100)
+        return round(rng.uniform(floor, ceiling), 2)
+
+    if rng.choice(sides) == 'low':
+        boundary = low * classification.CRITICAL_LOW_FACTOR
+        value = rng.uniform(boundary, low) if status == ABNORMAL else rng.uniform(0, boundary)
+    else:
+        boundary = high * classification.CRITICAL_HIGH_FACTOR
+        value = rng.uniform(high, boundary) if status == ABNORMAL else rng.uniform(boundary, boundary * 1.5)
+    return round(value, 2)
+
+
+def insert_rows(model, fields, rows):
+    """Write tuples of database-ready values of `fields` with one executemany"""
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(model._meta.get_field(field).column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {qn(model._meta.db_table)} ({columns}) VALUES ({placeholders})', rows)
+
+
+class Result:
+    """A generated test result, with the attributes the classifier, groups.summary and build_report read"""
+    __slots__ = ('test_id', 'patient_id', 'report_id', 'test_type', 'test_date', 'result_value', 'status',
+                 'is_published', 'published_date')
+
+    def __init__(self, patient_id, test_type, test_date, result_value):
+        self.test_id = None
+        self.patient_id = patient_id
+        self.report_id = None
+        self.test_type = test_type
+        self.test_date = test_date
+        self.result_value = result_value
+        self.status = NORMAL
+        self.is_published = False
+        self.published_date = None
+
+
+class LoadStats:
+    def __init__(self):
+        self.patients = 0
+        self.groups = 0
+        self.reports = 0
+        self.tests = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        rows = self.patients + self.groups + self.reports + self.tests
+        return rows / self.elapsed if self.elapsed else 0
+
+
+class Generator:
+    """Writes batches of synthetic patients with their test groups and reports"""
+
+    def __init__(self, reports=1, groups=2, analytes=5, days=365, status_mix=None, seed=None):
+        from .models import TestType
+
+        if analytes < 1:
+            raise ValueError('Test groups need at least one analyte')
+        if reports > groups:
+            raise ValueError(f'Reports per patient ({reports}) can be at most the test groups per patient ({groups})')
+        self.reports = reports
+        self.groups = groups
+        self.analytes = analytes
+        self.days = days
+        self.rng = random.Random(seed)
+        mix = status_mix or STATUS_MIX
+        self.statuses = list(mix)
+        self.weights = [mix[status] for status in self.statuses]
+
+        self.test_types = list(TestType.objects.order_by('id'))
+        if analytes > len(self.test_types):
+            raise ValueError(
+                f'{analytes} analytes per group needs as many test types, the catalog has {len(self.test_types)} '
+                '(run populate_tests first)'
+            )
+
+    def patient(self, number):
+        from .models import Patient
+
+        first_name, gender = self.rng.choice(FIRST_NAMES)
+        return Patient(
+            name=f'{first_name} {self.rng.choice(LAST_NAMES)}',
+            age=self.rng.randint(1, 95),
+            gender=gender,
+            contact_number=contact_number(number),
+        )
+
+    def group_tests(self, patient, now):
+        """Results of one group of `patient`, with a status aimed at by the mix"""
+        test_date = now - timedelta(seconds=self.rng.uniform(0, self.days * 86400))
+        test_types = self.rng.sample(self.test_types, self.analytes)
+        statuses = self.rng.choices(self.statuses, self.weights, k=self.analytes)
+        return [
+            Result(patient.pk, test_type, test_date, sample_value(self.rng, test_type, status))
+            for test_type, status in zip(test_types, statuses)
+        ]
+
+    def write(self, first, count, stats):
+        """Write patients `first` .. `first + count - 1` with their groups and reports in one transaction"""
+        from .models import Patient, MedicalReport, PatientTest, TestGroup
+
+        now = timezone.now()
+        patients = [self.patient(number) for number in range(first, first + count)]
+
+        with transaction.atomic():
+            Patient.objects.bulk_create(patients)
+            services.fill_pks(patients, 'contact_number')
+
+            built = [self.group_tests(patient, now) for patient in patients for _ in range(self.groups)]
+            all_tests = [test for tests in built for test in tests]
+            classification.classify_tests(all_tests)
+
+            codes = sequences.next_ids(sequences.TEST_GROUP, len(built))
+            test_ids = iter(sequences.next_ids(sequences.TEST, len(all_tests)))
+            report_ids = iter(sequences.next_ids(sequences.REPORT, count * self.reports))
+            published = []
+            for index, (code, tests) in enumerate(zip(codes, built)):
+                for test in tests:
+                    test.test_id = next(test_ids)
+                if index % self.groups < self.reports:
+                    report = services.build_report(next(report_ids), code, tests)
+                    # Published some time after the samples were taken, never in the future
+                    report.date_created = min(tests[0].test_date + timedelta(hours=self.rng.uniform(1, 48)), now)
+                    published.append((report, tests))
+
+            reports = [report for report, _ in published]
+            MedicalReport.objects.bulk_create(reports)
+            services.fill_pks(reports, 'report_id')
+            for report, tests in published:
+                for test in tests:
+                    test.report_id = report.pk
+                    test.is_published = True
+                    test.published_date = report.date_created
+
+            adapt = connection.ops.adapt_datetimefield_value
+            created_at = adapt(now)
+            test_rows = []
+            group_rows = []
+            for code, tests in zip(codes, built):
+                summary = groups.summary(tests)
+                # The tests of a group share their dates
+                test_date = summary['test_date'] = adapt(summary['test_date'])
+                published_date = summary['published_date'] = adapt(summary['published_date'])
+                test_rows.extend(
+                    (test.test_id, code, test.patient_id, test.report_id, test.test_type.pk, test_date,
+                     test.result_value, test.status, test.is_published, published_date, created_at)
+                    for test in tests
+                )
+                group_rows.append((code, *(summary[field] for field in groups.SUMMARY_FIELDS)))
+            insert_rows(PatientTest, TEST_FIELDS, test_rows)
+            insert_rows(TestGroup, GROUP_FIELDS, group_rows)
+
+            deltas = counters.report_deltas((report.status, report.ai_generated) for report in reports)
+            deltas[counters.PATIENTS] += count
+            counters.adjust(deltas)
+            search.index_patients(patients)
+            search.index_reports(reports)
+            caching.invalidate()
+
+        stats.patients += count
+        stats.groups += len(built)
+        stats.reports += len(reports)
+        stats.tests += len(all_tests)
+
+    def run(self, patients, batch_size=BATCH_SIZE, on_batch=None):
+        stats = LoadStats()
+        per_batch = max(1, batch_size // max(1, self.groups * self.analytes))
+        first = last_contact_number() + 1
+        for start in range(0, patients, per_batch):
+            self.write(first + start, min(per_batch, patients - start), stats)
+            if on_batch:
+                on_batch(stats)
+        return stats
+
+
+def generate(patients, reports=1, groups=2, analytes=5, days=365, status_mix=None, seed=None,
+             batch_size=BATCH_SIZE, on_batch=None):
+    """Generate `patients` synthetic patients with their tests and reports and return the LoadStats"""
+    generator = Generator(reports, groups, analytes, days, status_mix, seed)
+    return generator.run(patients, batch_size, on_batch)
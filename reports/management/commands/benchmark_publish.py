@@ -0,0 +1,76 @@
+# Management command to benchmark the batch publishing pipeline
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from reports import classification, sequences, services
+from reports.models import Patient, TestCategory, TestType, PatientTest
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Publish a batch of synthetic test groups and report query count and wall time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--groups', type=int, default=1000, help='Number of test groups to publish')
+        parser.add_argument('--analytes', type=int, default=10, help='Tests per group')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated data instead of rolling back')
+
+    def handle(self, *args, **options):
+        groups = options['groups']
+        analytes = options['analytes']
+
+        try:
+            with transaction.atomic():
+                test_groups = self.seed(groups, analytes)
+
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    reports = services.publish_test_groups(test_groups)
+                    elapsed = time.perf_counter() - start
+
+                self.stdout.write(self.style.SUCCESS(
+                    f'Published {len(reports)} groups ({groups * analytes} tests) '
+                    f'in {elapsed * 1000:.1f} ms using {len(context.captured_queries)} queries'
+                ))
+
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('Benchmark data rolled back')
+
+    def seed(self, groups, analytes):
+        """Create draft test groups for one benchmark patient"""
+        category, _ = TestCategory.objects.get_or_create(name='Benchmark')
+        test_types = [
+            TestType.objects.get_or_create(
+                name=f'Benchmark Analyte {i + 1}',
+                category=category,
+                defaults={'unit': 'mg/dL', 'normal_range_min': 10, 'normal_range_max': 20}
+            )[0]
+            for i in range(analytes)
+        ]
+        patient, _ = Patient.objects.get_or_create(
+            contact_number='0000000000',
+            defaults={'name': 'Benchmark Patient', 'age': 40, 'gender': 'male'}
+        )
+
+        test_groups = sequences.next_ids(sequences.TEST_GROUP, groups)
+        test_ids = iter(sequences.next_ids(sequences.TEST, groups * analytes))
+        tests = [
+            PatientTest(
+                test_id=next(test_ids),
+                test_group=test_group,
+                patient=patient,
+                test_type=test_type,
+                result_value=5 + (i % 20),
+            )
+            for test_group in test_groups
+            for i, test_type in enumerate(test_types)
+        ]
+        classification.classify_tests(tests)
+        PatientTest.objects.bulk_create(tests, batch_size=1000)
+        return test_groups
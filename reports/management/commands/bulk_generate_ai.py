@@ -0,0 +1,76 @@
+import time
+from django.core.exceptions import FieldError
+from django.core.management.base import BaseCommand, CommandError
+from reports import bulk_ai, llm
+from reports.models import MedicalReport
+
+
+def parse_filter(value):
+    """'field=value' to a queryset filter, with True/False/None converted"""
+    field, sep, raw = value.partition('=')
+    if not sep or not field:
+        raise CommandError(f'Filters look like field=value, got {value!r}')
+    return field, {'True': True, 'False': False, 'None': None}.get(raw, raw)
+
+
+class Command(BaseCommand):
+    help = 'Generate AI analyses for many reports concurrently, with rate limiting and a resumable checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filter', action='append', default=[], metavar='FIELD=VALUE',
+                            help='MedicalReport filter, repeatable (e.g. --filter ai_generated=False)')
+        parser.add_argument('--published', action='store_true', help='Only reports with published tests')
+        parser.add_argument('--batch-size', type=int, default=50, help='Reports loaded and saved together')
+        parser.add_argument('--concurrency', type=int, default=8, help='Model calls in flight at the same time')
+        parser.add_argument('--rpm', type=int, default=500, help='Requests per minute, 0 for no limit')
+        parser.add_argument('--tpm', type=int, default=30000, help='Tokens per minute, 0 for no limit')
+        parser.add_argument('--checkpoint', help='JSON file recording progress after every batch')
+        parser.add_argument('--resume', action='store_true', help='Continue after the last batch in --checkpoint')
+        parser.add_argument('--base-url', help='OpenAI-compatible API endpoint to use instead of AI_BACKEND')
+
+    def handle(self, *args, **options):
+        filters = dict(parse_filter(value) for value in options['filter'])
+        if options['published']:
+            filters['tests__is_published'] = True
+        try:
+            queryset = MedicalReport.objects.filter(**filters)
+            total = queryset.values('id').distinct().count()
+        except FieldError as e:
+            raise CommandError(str(e))
+
+        checkpoint = bulk_ai.Checkpoint(options['checkpoint'], {k: str(v) for k, v in filters.items()})
+        if options['resume']:
+            if not options['checkpoint']:
+                raise CommandError('--resume needs --checkpoint')
+            try:
+                if checkpoint.load():
+                    self.stdout.write(f'Resuming after report pk {checkpoint.last_id} '
+                                      f'({checkpoint.generated} generated so far)')
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        limiter = bulk_ai.RateLimiter(options['rpm'], options['tpm'])
+        backend = llm.compatible(options['base_url']) if options['base_url'] else llm.backend()
+        start = time.perf_counter()
+
+        def progress(stats, errors):
+            for report_id, error in errors.items():
+                self.stderr.write(f'{report_id}: {error}')
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"Batch: {stats['generated']} generated ({stats['cached']} from cache, {stats['rules']} by rules), "
+                f"{stats['failed']} failed "
+                f"- {checkpoint.generated} total in {elapsed:.1f}s"
+            )
+
+        self.stdout.write(f'{total} report(s) match')
+        totals = bulk_ai.run(
+            queryset, checkpoint, batch_size=options['batch_size'], concurrency=options['concurrency'],
+            limiter=limiter, backend=backend, on_batch=progress
+        )
+        elapsed = time.perf_counter() - start
+        rate = totals['requested'] / elapsed * 60 if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {totals['generated']} report(s) in {elapsed:.1f}s: {totals['requested']} model calls "
+            f"({rate:.0f}/min), {totals['cached']} from cache, {totals['rules']} by rules, {totals['failed']} failed"
+        ))
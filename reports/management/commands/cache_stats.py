@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from reports import ai_cache, caching
+
+
+class Command(BaseCommand):
+    help = (
+        'Show hit/miss counters of the page, report and AI analysis caches. The counters live in the cache, '
+        'so this needs a cache shared between processes (file, Redis, Memcached).'
+    )
+
+    def handle(self, *args, **kwargs):
+        if not caching.is_shared():
+            raise CommandError(
+                f"The cache backend {settings.CACHES['default']['BACKEND']} is private to each process, so the "
+                'web workers\' counters can\'t be read from here. Set CACHE_BACKEND to a shared cache '
+                '(file, Redis, Memcached) to collect them.'
+            )
+        self.stdout.write(f'Data version: {caching.data_version()}')
+        for name, counts in caching.stats(caching.PAGE_CACHES + (caching.REPORT_BODY,)).items():
+            total = counts['hits'] + counts['misses']
+            rate = counts['hits'] / total * 100 if total else 0
+            self.stdout.write(f"  - {name}: {counts['hits']} hits, {counts['misses']} misses ({rate:.1f}% hit rate)")
+
+        counts = ai_cache.stats()
+        total = counts['hits'] + counts['misses']
+        rate = counts['hits'] / total * 100 if total else 0
+        self.stdout.write(
+            f"  - AI analyses: {counts['hits']} hits, {counts['misses']} misses ({rate:.1f}% hit rate), "
+            f"{counts['entries']} stored"
+        )
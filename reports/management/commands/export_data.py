@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from reports import exports
+
+
+class Command(BaseCommand):
+    help = 'Stream reports or test results to a CSV or JSON Lines file, filtered like their list pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(exports.DATASETS))
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default=exports.CSV)
+        parser.add_argument('--output', help='File to write (default: standard output)')
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE, help='Rows fetched per query round trip')
+        parser.add_argument('--status', default='', help='Only rows with this status')
+        parser.add_argument('--search', default='', help='Same search as the list page')
+        parser.add_argument('--published', choices=['true', 'false'], default='', help='Tests only: published or drafts')
+        parser.add_argument('--group', default='', help='Tests only: one test group')
+
+    def handle(self, *args, **options):
+        params = {name: options[name] for name in ('status', 'search', 'published', 'group')}
+        chunks = exports.stream(options['dataset'], params, options['format'], options['chunk_size'])
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        start = time.perf_counter()
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']} in {time.perf_counter() - start:.1f}s"))
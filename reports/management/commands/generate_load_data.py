@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from reports import loadgen
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic patients, test groups and reports in bulk for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=1000, help='Patients to create')
+        parser.add_argument('--reports-per-patient', type=int, default=1,
+                            help='Test groups per patient published with a report')
+        parser.add_argument('--groups-per-patient', type=int, default=2,
+                            help='Test groups per patient, published or draft')
+        parser.add_argument('--analytes', type=int, default=5, help='Tests per group')
+        parser.add_argument('--days', type=int, default=365, help='Spread test dates over this many days back')
+        parser.add_argument('--status-mix', default='70:25:5',
+                            help='Relative weights of normal:abnormal:critical results')
+        parser.add_argument('--seed', type=int, help='Random seed, for the same data on an empty database')
+        parser.add_argument('--batch-size', type=int, default=loadgen.BATCH_SIZE, help='Tests written per transaction')
+
+    def handle(self, *args, **options):
+        def progress(stats):
+            self.stdout.write(f'{stats.patients} patients, {stats.tests} tests ({stats.rows_per_second:.0f} rows/s)')
+
+        try:
+            stats = loadgen.generate(
+                options['patients'],
+                reports=options['reports_per_patient'],
+                groups=options['groups_per_patient'],
+                analytes=options['analytes'],
+                days=options['days'],
+                status_mix=loadgen.parse_status_mix(options['status_mix']),
+                seed=options['seed'],
+                batch_size=options['batch_size'],
+                on_batch=progress,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {stats.patients} patients, {stats.groups} test groups, {stats.reports} reports and '
+            f'{stats.tests} tests in {stats.elapsed:.1f}s ({stats.rows_per_second:.0f} rows/s)'
+        ))
@@ -0,0 +1,45 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from reports import importer
+
+
+class Command(BaseCommand):
+    help = 'Import analyzer results from a CSV or HL7 file as test groups, streaming it in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for standard input")
+        parser.add_argument('--format', choices=importer.FORMATS, help='File format (default: from the extension)')
+        parser.add_argument('--chunk-size', type=int, default=importer.CHUNK_SIZE, help='Rows written per transaction')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Text encoding of the file')
+        parser.add_argument('--publish', action='store_true', help='Publish the imported groups as reports')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or importer.detect_format(path)
+
+        def progress(stats):
+            self.stdout.write(f'{stats.rows} rows, {stats.imported} imported ({stats.rows_per_second:.0f} rows/s)')
+
+        try:
+            file = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as e:
+            raise CommandError(str(e))
+        try:
+            lines = importer.read_lines(importer.read_blocks(file), options['encoding'])
+            stats = importer.import_results(lines, fmt, publish=options['publish'],
+                                            chunk_size=options['chunk_size'], on_chunk=progress)
+        except (importer.ResultsFileError, UnicodeDecodeError) as e:
+            raise CommandError(str(e))
+        finally:
+            if file is not sys.stdin.buffer:
+                file.close()
+
+        for error in stats.errors:
+            self.stderr.write(error)
+        if stats.skipped > len(stats.errors):
+            self.stderr.write(f'... and {stats.skipped - len(stats.errors)} more skipped row(s)')
+        published = f', {stats.published} published' if options['publish'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {stats.imported} of {stats.rows} rows into {stats.groups} test group(s){published} '
+            f'in {stats.elapsed:.1f}s ({stats.rows_per_second:.0f} rows/s), {stats.skipped} skipped'
+        ))
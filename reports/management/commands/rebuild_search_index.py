@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from reports import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the patient and report full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows inserted per statement batch')
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write(self.style.WARNING('This database backend has no search index, searches use icontains'))
+            return
+
+        start = time.perf_counter()
+        patients, reports = search.rebuild(chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {patients} patients and {reports} reports in {elapsed:.1f}s'
+        ))
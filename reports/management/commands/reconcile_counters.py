@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from reports import counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the dashboard counters from the patient and report tables'
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            drift = counters.reconcile()
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Dashboard counters are in sync'))
+            return
+
+        for name, (stored, actual) in drift.items():
+            self.stdout.write(f'  - {name}: {stored} -> {actual}')
+        self.stdout.write(self.style.SUCCESS(f'Reconciled {len(drift)} drifted counter(s)'))
@@ -0,0 +1,58 @@
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from reports import jobs
+from reports.models import AIJob
+
+
+class Command(BaseCommand):
+    help = 'Run queued AI report generation jobs on a pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=getattr(settings, 'AI_WORKER_THREADS', 4),
+                            help='Jobs run at the same time')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between checks of an empty queue')
+        parser.add_argument('--stale-after', type=int, default=jobs.STALE_AFTER,
+                            help='Seconds after which a running job is considered abandoned and requeued')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due instead of waiting for more')
+
+    def handle(self, *args, **options):
+        requeued, failed = jobs.recover_stale(options['stale_after'])
+        if requeued or failed:
+            self.stdout.write(f'Recovered abandoned jobs: {requeued} requeued, {failed} failed')
+
+        lock = threading.Lock()
+
+        def report(job):
+            with lock:
+                if job.status == AIJob.SUCCEEDED:
+                    self.stdout.write(self.style.SUCCESS(f'{job.report.report_id}: generated'))
+                elif job.status == AIJob.QUEUED:
+                    self.stdout.write(self.style.WARNING(
+                        f'{job.report.report_id}: attempt {job.attempts} failed, retrying at {job.run_after:%H:%M:%S}'
+                    ))
+                else:
+                    self.stdout.write(self.style.ERROR(f'{job.report.report_id}: failed ({job.last_error})'))
+
+        stop = threading.Event()
+        workers = [
+            threading.Thread(
+                target=jobs.work, args=(stop,),
+                kwargs={'once': options['once'], 'poll_interval': options['poll_interval'], 'on_done': report,
+                        'stale_after': options['stale_after']},
+                daemon=True
+            )
+            for _ in range(options['threads'])
+        ]
+        self.stdout.write(f"Started {len(workers)} AI worker thread(s)")
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(0.5)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after the running jobs finish...')
+            stop.set()
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:59
+
+import re
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    """Start each sequence after the highest ID already in use"""
+    MedicalReport = apps.get_model('reports', 'MedicalReport')
+    PatientTest = apps.get_model('reports', 'PatientTest')
+    IdSequence = apps.get_model('reports', 'IdSequence')
+
+    sources = [
+        ('report', 'REP', MedicalReport.objects.values_list('report_id', flat=True)),
+        ('test', 'TEST', PatientTest.objects.values_list('test_id', flat=True)),
+        ('test_group', 'GRP', PatientTest.objects.values_list('test_group', flat=True).distinct()),
+    ]
+    for name, prefix, values in sources:
+        pattern = re.compile(rf'^{prefix}-(\d+)$')
+        highest = 0
+        for value in values.iterator():
+            match = pattern.match(value or '')
+            if match:
+                highest = max(highest, int(match.group(1)))
+        IdSequence.objects.update_or_create(name=name, defaults={'last_value': highest})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0010_patient_password'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'ID Sequence',
+            },
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+def seed_counters(apps, schema_editor):
+    """Start the counters from the current table contents"""
+    Patient = apps.get_model('reports', 'Patient')
+    MedicalReport = apps.get_model('reports', 'MedicalReport')
+    DashboardCounter = apps.get_model('reports', 'DashboardCounter')
+
+    values = {
+        'patients': Patient.objects.count(),
+        'reports': MedicalReport.objects.count(),
+        'reports_ai_generated': MedicalReport.objects.filter(ai_generated=True).count(),
+    }
+    for status in ('normal', 'at_risk', 'critical'):
+        values[f'reports_{status}'] = MedicalReport.objects.filter(status=status).count()
+    for name, value in values.items():
+        DashboardCounter.objects.update_or_create(name=name, defaults={'value': value})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0011_idsequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
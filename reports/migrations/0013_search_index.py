@@ -0,0 +1,81 @@
+import re
+
+from django.db import migrations
+
+# A frozen copy of the index layout and documents of reports.search at the
+# time of this migration, so later changes to that module can't alter it.
+PATIENT_TABLE = 'reports_patient_search'
+REPORT_TABLE = 'reports_report_search'
+
+CHUNK_SIZE = 2000
+
+_word = re.compile(r'\w+')
+
+
+def tokens(*values):
+    result = []
+    for value in values:
+        for word in _word.findall(str(value or '').lower()):
+            if word.isdigit():
+                result.extend(word[i:] for i in range(len(word)))
+            else:
+                result.append(word)
+    return result
+
+
+def fill(schema_editor, table, documents):
+    id_column = 'rowid' if schema_editor.connection.vendor == 'sqlite' else 'id'
+    sql = f'INSERT INTO {table} ({id_column}, terms) VALUES (%s, %s)'
+    chunk = []
+    with schema_editor.connection.cursor() as cursor:
+        for document in documents:
+            chunk.append(document)
+            if len(chunk) >= CHUNK_SIZE:
+                cursor.executemany(sql, chunk)
+                chunk = []
+        if chunk:
+            cursor.executemany(sql, chunk)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in ('sqlite', 'mysql'):
+        return
+    for table in (PATIENT_TABLE, REPORT_TABLE):
+        if vendor == 'sqlite':
+            schema_editor.execute(f"CREATE VIRTUAL TABLE {table} USING fts5(terms, prefix='2 3')")
+        else:
+            schema_editor.execute(
+                f'CREATE TABLE {table} (id BIGINT PRIMARY KEY, terms LONGTEXT NOT NULL, '
+                f'FULLTEXT KEY {table}_terms (terms)) ENGINE=InnoDB'
+            )
+
+    Patient = apps.get_model('reports', 'Patient')
+    MedicalReport = apps.get_model('reports', 'MedicalReport')
+    fill(schema_editor, PATIENT_TABLE, (
+        (pk, ' '.join(tokens(name, contact_number)))
+        for pk, name, contact_number in Patient.objects.values_list('id', 'name', 'contact_number')
+        .order_by().iterator(chunk_size=CHUNK_SIZE)
+    ))
+    fill(schema_editor, REPORT_TABLE, (
+        (pk, ' '.join(tokens(report_id, name)))
+        for pk, report_id, name in MedicalReport.objects.values_list('id', 'report_id', 'patient__name')
+        .order_by().iterator(chunk_size=CHUNK_SIZE)
+    ))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'mysql'):
+        for table in (PATIENT_TABLE, REPORT_TABLE):
+            schema_editor.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0012_dashboardcounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:24
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Max, Min, Q, Value, When
+import django.db.models.deletion
+import django.utils.timezone
+
+# A frozen copy of the group summaries of reports.groups at the time of this
+# migration, so later changes to that module can't alter it.
+STATUS_RANK = {'normal': 0, 'abnormal': 1, 'critical': 2}
+RANKED_STATUS = {rank: status for status, rank in STATUS_RANK.items()}
+
+CHUNK_SIZE = 500
+
+
+def build_test_groups(apps, schema_editor):
+    PatientTest = apps.get_model('reports', 'PatientTest')
+    TestGroup = apps.get_model('reports', 'TestGroup')
+
+    status_rank = Case(
+        *[When(status=status, then=Value(rank)) for status, rank in STATUS_RANK.items()],
+        default=Value(0), output_field=IntegerField()
+    )
+    codes = sorted(PatientTest.objects.order_by().values_list('test_group', flat=True).distinct())
+    for start in range(0, len(codes), CHUNK_SIZE):
+        rows = PatientTest.objects.filter(test_group__in=codes[start:start + CHUNK_SIZE]).order_by() \
+            .values('test_group').annotate(
+                summary_patient=Min('patient'),
+                summary_report=Max('report'),
+                summary_test_date=Max('test_date'),
+                summary_published_date=Max('published_date'),
+                summary_count=Count('id'),
+                summary_published=Count('id', filter=Q(is_published=True)),
+                summary_abnormal=Count('id', filter=Q(status='abnormal')),
+                summary_critical=Count('id', filter=Q(status='critical')),
+                summary_rank=Max(status_rank),
+            )
+        TestGroup.objects.bulk_create([
+            TestGroup(
+                code=row['test_group'],
+                patient_id=row['summary_patient'],
+                report_id=row['summary_report'],
+                test_date=row['summary_test_date'],
+                is_published=row['summary_published'] == row['summary_count'],
+                published_date=row['summary_published_date'],
+                worst_status=RANKED_STATUS[row['summary_rank']],
+                analyte_count=row['summary_count'],
+                abnormal_count=row['summary_abnormal'],
+                critical_count=row['summary_critical'],
+            )
+            for row in rows
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0013_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=20, unique=True)),
+                ('test_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('is_published', models.BooleanField(default=False)),
+                ('published_date', models.DateTimeField(blank=True, null=True)),
+                ('worst_status', models.CharField(choices=[('normal', 'Normal'), ('abnormal', 'Abnormal'), ('critical', 'Critical')], default='normal', max_length=20)),
+                ('analyte_count', models.PositiveIntegerField(default=0)),
+                ('abnormal_count', models.PositiveIntegerField(default=0)),
+                ('critical_count', models.PositiveIntegerField(default=0)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='test_groups', to='reports.patient')),
+                ('report', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='test_groups', to='reports.medicalreport')),
+            ],
+            options={
+                'ordering': ['-test_date'],
+                'indexes': [models.Index(fields=['test_date', 'id'], name='reports_tes_test_da_8fe1dc_idx')],
+            },
+        ),
+        migrations.RunPython(build_test_groups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0014_testgroup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicalreport',
+            index=models.Index(fields=['date_created', 'id'], name='reports_med_date_cr_ba59c2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicalreport',
+            index=models.Index(fields=['status', 'date_created', 'id'], name='reports_med_status_58a07b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicalreport',
+            index=models.Index(fields=['patient', '-date_created', '-id'], name='reports_med_patient_102bcf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicalreport',
+            index=models.Index(fields=['ai_generated', 'date_created'], name='reports_med_ai_gene_db6db3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['created_at', 'id'], name='reports_pat_created_b28e29_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patienttest',
+            index=models.Index(fields=['test_group'], name='reports_pat_test_gr_e2d9ab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patienttest',
+            index=models.Index(fields=['report', 'is_published'], name='reports_pat_report__9176fb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patienttest',
+            index=models.Index(fields=['is_published', 'status'], name='reports_pat_is_publ_b3cadd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testgroup',
+            index=models.Index(fields=['is_published', 'abnormal_count', 'critical_count'], name='reports_tes_is_publ_9280be_idx'),
+        ),
+    ]
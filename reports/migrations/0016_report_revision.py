@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+def stamp_existing_reports(apps, schema_editor):
+    MedicalReport = apps.get_model('reports', 'MedicalReport')
+    MedicalReport.objects.update(updated_at=models.F('date_created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0015_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicalreport',
+            name='revision',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='medicalreport',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(stamp_existing_reports, migrations.RunPython.noop),
+    ]
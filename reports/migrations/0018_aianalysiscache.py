@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0017_aijob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIAnalysisCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('answer', models.TextField()),
+                ('model', models.CharField(max_length=50)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'AI Analysis Cache Entry',
+                'verbose_name_plural': 'AI Analysis Cache',
+                'indexes': [models.Index(fields=['last_used_at'], name='reports_aia_last_us_5817ca_idx'), models.Index(fields=['created_at'], name='reports_aia_created_3294f0_idx')],
+            },
+        ),
+    ]
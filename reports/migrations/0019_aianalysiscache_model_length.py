@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0018_aianalysiscache'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aianalysiscache',
+            name='model',
+            field=models.CharField(max_length=255),
+        ),
+    ]
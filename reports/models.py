@@ -1,6 +1,9 @@
-from django.db import models
+import copy
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
+from . import caching, classification, sequences
 
 class Patient(models.Model):
     GENDER_CHOICES = [
@@ -20,8 +23,16 @@ class Patient(models.Model):
     def __str__(self):
         return self.name
     
+    def save(self, *args, **kwargs):
+        # Keep the dashboard counters updated by signals in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
 
 class MedicalReport(models.Model):
     STATUS_CHOICES = [
@@ -39,23 +50,43 @@ class MedicalReport(models.Model):
     diagnosis = models.TextField(blank=True, null=True)
     recommendations = models.TextField(blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # Bumped on every change to the report or what it displays, keys the rendered report cache
+    revision = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.report_id} - {self.patient.name}"
     
     def save(self, *args, **kwargs):
-        if not self.report_id:
-            # Auto-generate report ID
-            last_report = MedicalReport.objects.all().order_by('id').last()
-            if last_report:
-                last_num = int(last_report.report_id.split('-')[1])
-                self.report_id = f'REP-{str(last_num + 1).zfill(3)}'
-            else:
-                self.report_id = 'REP-001'
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            if not self.report_id:
+                # Auto-generate report ID
+                self.report_id = sequences.next_id(sequences.REPORT)
+            if not self._state.adding:
+                self.revision = models.F('revision') + 1
+                if kwargs.get('update_fields') is not None:
+                    kwargs['update_fields'] = {*kwargs['update_fields'], 'revision', 'updated_at'}
+            super().save(*args, **kwargs)
+            if not isinstance(self.revision, int):
+                self.refresh_from_db(fields=['revision'])
+    
+    @classmethod
+    def touch(cls, report_ids):
+        """Start a new revision of the given reports after a change to their tests or patient"""
+        report_ids = {pk for pk in report_ids if pk is not None}
+        if report_ids:
+            cls.objects.filter(id__in=report_ids).update(
+                revision=models.F('revision') + 1, updated_at=timezone.now()
+            )
     
     class Meta:
         ordering = ['-date_created']
+        indexes = [
+            models.Index(fields=['date_created', 'id']),
+            models.Index(fields=['status', 'date_created', 'id']),
+            models.Index(fields=['patient', '-date_created', '-id']),
+            models.Index(fields=['ai_generated', 'date_created']),
+        ]
 
 
 class TestCategory(models.Model):
@@ -111,27 +142,47 @@ class PatientTest(models.Model):
     def save(self, *args, **kwargs):
         if not self.test_id:
             # Auto-generate test ID
-            last_test = PatientTest.objects.all().order_by('id').last()
-            if last_test:
-                last_num = int(last_test.test_id.split('-')[1])
-                self.test_id = f'TEST-{str(last_num + 1).zfill(4)}'
-            else:
-                self.test_id = 'TEST-0001'
-        
-        # Auto-determine status based on normal range
-        if self.test_type.normal_range_min and self.test_type.normal_range_max:
-            if self.result_value < self.test_type.normal_range_min or self.result_value > self.test_type.normal_range_max:
-                if self.result_value < self.test_type.normal_range_min * 0.5 or self.result_value > self.test_type.normal_range_max * 1.5:
-                    self.status = 'critical'
-                else:
-                    self.status = 'abnormal'
-            else:
-                self.status = 'normal'
+            self.test_id = sequences.next_id(sequences.TEST)
         
+        self.update_status()
         super().save(*args, **kwargs)
     
+    def update_status(self):
+        """Auto-determine status based on normal range"""
+        classification.classify_tests([self])
+    
     class Meta:
         ordering = ['-test_date']
+        indexes = [
+            models.Index(fields=['test_group']),
+            models.Index(fields=['report', 'is_published']),
+            models.Index(fields=['is_published', 'status']),
+        ]
+
+
+class TestGroup(models.Model):
+    """Summary of the patient tests sharing a test_group code, kept in sync by reports.groups"""
+    code = models.CharField(max_length=20, unique=True)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='test_groups')
+    report = models.ForeignKey(MedicalReport, on_delete=models.CASCADE, related_name='test_groups', null=True, blank=True)
+    test_date = models.DateTimeField(default=timezone.now)
+    is_published = models.BooleanField(default=False)
+    published_date = models.DateTimeField(blank=True, null=True)
+    worst_status = models.CharField(max_length=20, choices=PatientTest.STATUS_CHOICES, default='normal')
+    analyte_count = models.PositiveIntegerField(default=0)
+    abnormal_count = models.PositiveIntegerField(default=0)
+    critical_count = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.code} - {self.patient.name}"
+    
+    class Meta:
+        ordering = ['-test_date']
+        indexes = [
+            models.Index(fields=['test_date', 'id']),
+            # Covers the tests page statistics
+            models.Index(fields=['is_published', 'abnormal_count', 'critical_count']),
+        ]
 
 
 class LabSettings(models.Model):
@@ -150,8 +201,99 @@ class LabSettings(models.Model):
         verbose_name = 'Lab Settings'
         verbose_name_plural = 'Lab Settings'
     
+    # Process-local {settings version: instance}, see get_settings()
+    _cache = {}
+    
     @classmethod
     def get_settings(cls):
-        """Get or create singleton settings instance"""
-        settings, created = cls.objects.get_or_create(id=1)
-        return settings
+        """Get or create singleton settings instance.
+        
+        The instance is cached in-process until the settings version in the
+        shared cache changes, which every save triggers (see reports.signals).
+        Callers get their own copy, so changing it doesn't leak into the cache.
+        """
+        # Read the version before the row, so a save racing this load bumps past it
+        version = caching.settings_version()
+        settings = cls._cache.get(version)
+        if settings is None:
+            settings, created = cls.objects.get_or_create(id=1)
+            cls._cache = {version: settings}
+        return copy.copy(settings)
+
+
+class IdSequence(models.Model):
+    """Counter backing the human-readable report, test and group IDs"""
+    name = models.CharField(max_length=50, unique=True)
+    last_value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name}: {self.last_value}"
+    
+    class Meta:
+        verbose_name = 'ID Sequence'
+
+
+class DashboardCounter(models.Model):
+    """Precomputed dashboard number, kept in sync by reports.counters"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class AIJob(models.Model):
+    """Queued AI generation for a report, run by `manage.py run_ai_worker`"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    
+    report = models.ForeignKey(MedicalReport, on_delete=models.CASCADE, related_name='ai_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)  # Not picked up before this, delays retries
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return f"AI job {self.pk} for {self.report.report_id} ({self.status})"
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'AI Job'
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+
+class AIAnalysisCache(models.Model):
+    """Model answer for one canonical prompt, managed by reports.ai_cache"""
+    key = models.CharField(max_length=64, unique=True)  # SHA-256 of the prompt and model parameters
+    answer = models.TextField()
+    model = models.CharField(max_length=255)  # Backend identity, model@base_url for compatible servers
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    last_used_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.key[:12]} ({self.hits} hits)"
+    
+    class Meta:
+        verbose_name = 'AI Analysis Cache Entry'
+        verbose_name_plural = 'AI Analysis Cache'
+        indexes = [
+            models.Index(fields=['last_used_at']),
+            models.Index(fields=['created_at']),
+        ]
@@ -0,0 +1,104 @@
+"""
+Keyset (cursor) pagination for the list views.
+
+Pages are addressed by the sort key of the row on their edge instead of an
+OFFSET, so fetching page N costs the same as page 1 and a cursor keeps
+pointing at the same place while new rows are inserted at the top.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+PAGE_SIZE = 50
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, value, pk):
+    payload = json.dumps([direction, value.isoformat(), pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if direction not in (NEXT, PREVIOUS):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(value), int(pk)
+    except (ValueError, TypeError, json.JSONDecodeError) as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor}') from e
+
+
+class KeysetPage:
+    """One page of rows ordered by `-<field>, -id`"""
+
+    def __init__(self, items, field, has_next, has_previous):
+        self.items = items
+        self.field = field
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _cursor(self, direction, row):
+        return encode_cursor(direction, getattr(row, self.field), row.pk)
+
+    @property
+    def next_cursor(self):
+        return self._cursor(NEXT, self.items[-1]) if self.has_next and self.items else None
+
+    @property
+    def previous_cursor(self):
+        return self._cursor(PREVIOUS, self.items[0]) if self.has_previous and self.items else None
+
+
+def paginate(queryset, field, cursor=None, page_size=PAGE_SIZE):
+    """Return the KeysetPage of `queryset` (newest first by `field`) that `cursor` points at.
+
+    An invalid or missing cursor returns the first page.
+    """
+    direction, value, pk = NEXT, None, None
+    if cursor:
+        try:
+            direction, value, pk = decode_cursor(cursor)
+        except InvalidCursor:
+            pass
+
+    if value is None:
+        rows = list(queryset.order_by(f'-{field}', '-id')[:page_size + 1])
+        return KeysetPage(rows[:page_size], field, has_next=len(rows) > page_size, has_previous=False)
+
+    if direction == NEXT:
+        after = Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk})
+        rows = list(queryset.filter(after).order_by(f'-{field}', '-id')[:page_size + 1])
+        return KeysetPage(rows[:page_size], field, has_next=len(rows) > page_size, has_previous=True)
+
+    before = Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk})
+    rows = list(queryset.filter(before).order_by(field, 'id')[:page_size + 1])
+    if len(rows) <= page_size:
+        # Walked back to the top, show a full first page
+        return paginate(queryset, field, page_size=page_size)
+    return KeysetPage(list(reversed(rows[:page_size])), field, has_next=True, has_previous=True)
+
+
+def page_links(request, page):
+    """Query strings for the neighbouring pages, keeping the current search and status filters"""
+    links = {}
+    for name, cursor in (('previous_page_query', page.previous_cursor), ('next_page_query', page.next_cursor)):
+        if cursor:
+            params = request.GET.copy()
+            params['cursor'] = cursor
+            links[name] = params.urlencode()
+    return links
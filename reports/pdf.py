@@ -0,0 +1,147 @@
+"""
+Server-side PDF export of medical reports.
+
+Reports are rendered from templates/report_pdf.html and converted with
+xhtml2pdf, a pure-Python engine that needs no browser or network access.
+The conversion is CPU bound, so it runs in a process pool of PDF_WORKERS
+workers; the request thread only renders the HTML. Finished files are kept
+under MEDIA_ROOT/report_pdfs, named after the report revision and the lab
+settings version, so repeat downloads are served straight from disk and an
+edited report gets a new file. A pool broken by a dying worker (out of
+memory, a crash in the converter) is replaced on the next job.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from pathlib import Path
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+PDF_DIR = 'report_pdfs'
+
+_lock = threading.Lock()
+_executor = None
+_pending = {}
+
+
+class PdfError(Exception):
+    pass
+
+
+def pdf_path(report, settings_version):
+    return Path(settings.MEDIA_ROOT) / PDF_DIR / f'{report.report_id}-r{report.revision}-s{settings_version}.pdf'
+
+
+def render_html(report, lab_settings):
+    """report_pdf.html for a report, with its published tests grouped by category"""
+    from .models import PatientTest
+
+    tests = PatientTest.objects.filter(report=report, is_published=True).select_related(
+        'test_type', 'test_type__category'
+    ).order_by('test_type__category__name', 'test_type__name')
+
+    tests_by_category = OrderedDict()
+    for test in tests:
+        tests_by_category.setdefault(test.test_type.category.name, []).append(test)
+
+    return render_to_string('report_pdf.html', {
+        'report': report,
+        'lab_settings': lab_settings,
+        'tests_by_category': tests_by_category,
+        'media_root': settings.MEDIA_ROOT,
+        'now': timezone.now(),
+    })
+
+
+def write_pdf(html, path, report_id):
+    """Convert `html` to a PDF at `path` and remove the report's older files (runs in a worker process)"""
+    from xhtml2pdf import pisa
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f'{path.name}.{os.getpid()}.part')
+    with open(partial, 'wb') as output:
+        result = pisa.CreatePDF(html, dest=output, encoding='utf-8')
+    if result.err:
+        partial.unlink(missing_ok=True)
+        raise PdfError(f'Could not render {path.name}: {result.err} error(s)')
+    os.replace(partial, path)
+
+    for old in path.parent.glob(f'{report_id}-r*.pdf'):
+        if old != path:
+            old.unlink(missing_ok=True)
+    return str(path)
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=getattr(settings, 'PDF_WORKERS', 2), mp_context=get_context('spawn')
+        )
+    return _executor
+
+
+def _submit(html, path, report_id):
+    """Start a conversion (with _lock held), replacing the pool once if it is broken"""
+    global _executor
+    try:
+        return _pool().submit(write_pdf, html, str(path), report_id)
+    except BrokenProcessPool:
+        _executor.shutdown(wait=False)
+        _executor = None
+        return _pool().submit(write_pdf, html, str(path), report_id)
+
+
+def _discard(path):
+    with _lock:
+        _pending.pop(path, None)
+
+
+def request_pdf(report, lab_settings, settings_version):
+    """Path of the report's PDF file if it is on disk, else a future producing it.
+
+    Concurrent requests for the same revision share one conversion job.
+    """
+    path = pdf_path(report, settings_version)
+    if path.exists():
+        return path
+    future = _pending.get(path)
+    if future is not None and not future.done():
+        return future
+
+    # Rendered without the lock, so requests for other reports don't wait on the query and template
+    html = render_html(report, lab_settings)
+    with _lock:
+        future = _pending.get(path)
+        # Another request may have started the job meanwhile (its HTML is the same, ours is dropped).
+        # A finished job may not have run its callback yet, and a failed one must be started again.
+        if future is None or future.done():
+            future = _submit(html, path, report.report_id)
+            future.add_done_callback(lambda done: _discard(path))
+            _pending[path] = future
+    return future
+
+
+def get_pdf(report, lab_settings, settings_version, timeout=None):
+    """Path of the report's PDF file, waiting up to `timeout` seconds for a conversion.
+
+    Returns None if the file isn't ready in time; the job keeps running. A
+    job lost with a dying worker is retried once on a fresh pool.
+    """
+    for attempt in range(2):
+        result = request_pdf(report, lab_settings, settings_version)
+        if isinstance(result, Path):
+            return result
+        try:
+            return Path(result.result(timeout=timeout))
+        except TimeoutError:
+            return None
+        except BrokenProcessPool:
+            if attempt:
+                raise PdfError('The PDF worker stopped unexpectedly, please try again')
@@ -0,0 +1,262 @@
+"""
+Full-text search index for patients and reports.
+
+Each searchable row has a document of lower-cased word tokens in a side
+table: an FTS5 virtual table on SQLite, an InnoDB table with a FULLTEXT
+index on MySQL. Digit tokens are stored with all their suffixes, so a prefix
+query also finds fragments from the middle of a phone number or report ID
+("4321" finds 9876543210). Queries match every term as a prefix and can be
+ranked by relevance. Other database backends fall back to icontains.
+
+Documents are kept in sync by reports.signals and the bulk write paths in
+reports.services; `manage.py rebuild_search_index` rebuilds them from scratch.
+"""
+import re
+import threading
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+PATIENT_TABLE = 'reports_patient_search'
+REPORT_TABLE = 'reports_report_search'
+
+# Ranked search returns at most this many rows per kind
+RANKED_LIMIT = 10
+
+_local = threading.local()
+_word = re.compile(r'\w+')
+
+
+def is_supported():
+    return connection.vendor in ('sqlite', 'mysql')
+
+
+def tokens(*values):
+    """Searchable tokens of `values`, with every suffix of digit tokens"""
+    result = []
+    for value in values:
+        for word in _word.findall(str(value or '').lower()):
+            if word.isdigit():
+                result.extend(word[i:] for i in range(len(word)))
+            else:
+                result.append(word)
+    return result
+
+
+def patient_document(name, contact_number):
+    return ' '.join(tokens(name, contact_number))
+
+
+def report_document(report_id, patient_name):
+    return ' '.join(tokens(report_id, patient_name))
+
+
+def _match_expression(query):
+    """Backend query string requiring every term of `query` as a prefix, or None if it has no terms"""
+    terms = _word.findall(query.lower())
+    if not terms:
+        return None
+    if connection.vendor == 'sqlite':
+        return ' '.join(f'"{term}"*' for term in terms)
+    return ' '.join(f'+{term}*' for term in terms)
+
+
+def _id_column():
+    return 'rowid' if connection.vendor == 'sqlite' else 'id'
+
+
+def _match_sql(table, ranked=False):
+    """SELECT of matching row ids, with their relevance as `score` (lower is better) if ranked"""
+    if connection.vendor == 'sqlite':
+        score = f', bm25({table}) AS score' if ranked else ''
+        return f'SELECT rowid AS id{score} FROM {table} WHERE {table} MATCH %s'
+    score = ', -MATCH(terms) AGAINST (%s IN BOOLEAN MODE) AS score' if ranked else ''
+    return f'SELECT id{score} FROM {table} WHERE MATCH(terms) AGAINST (%s IN BOOLEAN MODE)'
+
+
+def _params(match, ranked=False):
+    return [match, match] if ranked and connection.vendor == 'mysql' else [match]
+
+
+def _filter(queryset, table, query, fallback):
+    if not is_supported():
+        return queryset.filter(fallback)
+    match = _match_expression(query)
+    if match is None:
+        # No terms, so no document can match
+        return queryset.none()
+    return queryset.filter(id__in=RawSQL(_match_sql(table), _params(match)))
+
+
+def filter_patients(queryset, query):
+    """Restrict a Patient queryset to rows matching `query`"""
+    fallback = Q(name__icontains=query) | Q(contact_number__icontains=query)
+    return _filter(queryset, PATIENT_TABLE, query, fallback)
+
+
+def filter_reports(queryset, query):
+    """Restrict a MedicalReport queryset to rows matching `query`"""
+    fallback = Q(report_id__icontains=query) | Q(patient__name__icontains=query)
+    return _filter(queryset, REPORT_TABLE, query, fallback)
+
+
+def _ranked_ids(table, query, limit):
+    match = _match_expression(query)
+    if match is None:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{_match_sql(table, ranked=True)} ORDER BY score, id LIMIT %s',
+            _params(match, ranked=True) + [limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def rank_patients(query, limit=RANKED_LIMIT):
+    """Best matching patients, most relevant first"""
+    from .models import Patient
+
+    if not is_supported():
+        return list(filter_patients(Patient.objects.all(), query)[:limit])
+    ids = _ranked_ids(PATIENT_TABLE, query, limit)
+    patients = Patient.objects.in_bulk(ids)
+    return [patients[pk] for pk in ids if pk in patients]
+
+
+def rank_reports(query, limit=RANKED_LIMIT):
+    """Best matching reports, most relevant first"""
+    from .models import MedicalReport
+
+    if not is_supported():
+        return list(filter_reports(MedicalReport.objects.select_related('patient'), query)[:limit])
+    ids = _ranked_ids(REPORT_TABLE, query, limit)
+    reports = MedicalReport.objects.select_related('patient').in_bulk(ids)
+    return [reports[pk] for pk in ids if pk in reports]
+
+
+def _insert(table, documents):
+    if not documents:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {table} ({_id_column()}, terms) VALUES (%s, %s)', documents)
+
+
+def _write(table, documents):
+    """Replace the documents of the given (id, terms) rows"""
+    documents = list(documents)
+    if not documents or not is_supported():
+        return
+    _delete(table, [pk for pk, _ in documents])
+    _insert(table, documents)
+
+
+def _delete(table, ids):
+    ids = list(ids)
+    if not ids or not is_supported():
+        return
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {table} WHERE {_id_column()} IN ({placeholders})', chunk)
+
+
+def index_patients(patients):
+    """Index Patient instances"""
+    _write(PATIENT_TABLE, [(p.pk, patient_document(p.name, p.contact_number)) for p in patients])
+
+
+def index_reports(reports):
+    """Index MedicalReport instances, looking up their patients' names in one query"""
+    from .models import Patient
+
+    reports = list(reports)
+    if not reports or not is_supported():
+        return
+    names = dict(Patient.objects.filter(id__in={r.patient_id for r in reports}).values_list('id', 'name'))
+    _write(REPORT_TABLE, [(r.pk, report_document(r.report_id, names.get(r.patient_id))) for r in reports])
+
+
+def index_patient_reports(patient):
+    """Reindex the reports of a patient, whose name is part of their documents"""
+    rows = patient.reports.values_list('id', 'report_id')
+    _write(REPORT_TABLE, [(pk, report_document(report_id, patient.name)) for pk, report_id in rows])
+
+
+def remove_patients(ids):
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending[PATIENT_TABLE].update(ids)
+    else:
+        _delete(PATIENT_TABLE, ids)
+
+
+def remove_reports(ids):
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending[REPORT_TABLE].update(ids)
+    else:
+        _delete(REPORT_TABLE, ids)
+
+
+@contextmanager
+def batch():
+    """Collect document removals made inside the block and delete them together at the end"""
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+
+    _local.pending = {PATIENT_TABLE: set(), REPORT_TABLE: set()}
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+    for table, ids in pending.items():
+        _delete(table, ids)
+
+
+def rebuild(chunk_size=2000):
+    """Rebuild both indexes from the tables, returns the number of (patients, reports) indexed"""
+    from .models import Patient, MedicalReport
+
+    if not is_supported():
+        return 0, 0
+    patients = Patient.objects
+    reports = MedicalReport.objects
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {PATIENT_TABLE}')
+            cursor.execute(f'DELETE FROM {REPORT_TABLE}')
+        return _fill(patients, reports, chunk_size)
+
+
+def _fill(patients, reports, chunk_size):
+    sources = (
+        (PATIENT_TABLE, (
+            (pk, patient_document(name, contact))
+            for pk, name, contact in patients.values_list('id', 'name', 'contact_number')
+            .order_by().iterator(chunk_size=chunk_size)
+        )),
+        (REPORT_TABLE, (
+            (pk, report_document(report_id, name))
+            for pk, report_id, name in reports.values_list('id', 'report_id', 'patient__name')
+            .order_by().iterator(chunk_size=chunk_size)
+        )),
+    )
+    counts = []
+    for table, documents in sources:
+        total = 0
+        chunk = []
+        for document in documents:
+            chunk.append(document)
+            if len(chunk) >= chunk_size:
+                _insert(table, chunk)
+                total += len(chunk)
+                chunk = []
+        _insert(table, chunk)
+        counts.append(total + len(chunk))
+    return tuple(counts)
@@ -0,0 +1,81 @@
+"""
+Race-free ID allocation for reports, tests and test groups.
+
+Each sequence is a single IdSequence row. Reserving a block of IDs is one
+atomic UPDATE ... SET last_value = last_value + n, so concurrent workers can
+never hand out the same number and a bulk insert of any size costs a single
+round trip instead of one lookup per row.
+"""
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+REPORT = 'report'
+TEST = 'test'
+TEST_GROUP = 'test_group'
+
+# Sequence name -> (prefix, zero padding)
+FORMATS = {
+    REPORT: ('REP', 3),
+    TEST: ('TEST', 4),
+    TEST_GROUP: ('GRP', 4),
+}
+
+
+def format_id(name, number):
+    """Format a sequence number the way the IDs have always looked, e.g. TEST-0042"""
+    prefix, width = FORMATS[name]
+    return f'{prefix}-{str(number).zfill(width)}'
+
+
+def current_max(name):
+    """Highest number already used by existing rows of a sequence"""
+    from .models import MedicalReport, PatientTest
+
+    if name == REPORT:
+        values = MedicalReport.objects.values_list('report_id', flat=True)
+    elif name == TEST:
+        values = PatientTest.objects.values_list('test_id', flat=True)
+    else:
+        values = PatientTest.objects.values_list('test_group', flat=True).distinct()
+
+    pattern = re.compile(rf'^{FORMATS[name][0]}-(\d+)$')
+    highest = 0
+    for value in values.iterator():
+        match = pattern.match(value or '')
+        if match:
+            highest = max(highest, int(match.group(1)))
+    return highest
+
+
+def reserve(name, count=1):
+    """Reserve `count` consecutive numbers and return them as a range"""
+    from .models import IdSequence
+
+    if count < 1:
+        return range(0)
+
+    with transaction.atomic():
+        updated = IdSequence.objects.filter(name=name).update(last_value=F('last_value') + count)
+        if not updated:
+            # First use of this sequence: seed it from the existing rows
+            try:
+                with transaction.atomic():
+                    IdSequence.objects.create(name=name, last_value=current_max(name) + count)
+            except IntegrityError:
+                # Another worker seeded it first
+                IdSequence.objects.filter(name=name).update(last_value=F('last_value') + count)
+        last_value = IdSequence.objects.filter(name=name).values_list('last_value', flat=True).get()
+
+    return range(last_value - count + 1, last_value + 1)
+
+
+def next_ids(name, count):
+    """Reserve `count` formatted IDs in a single block"""
+    return [format_id(name, number) for number in reserve(name, count)]
+
+
+def next_id(name):
+    """Reserve one formatted ID"""
+    return format_id(name, reserve(name, 1)[0])
@@ -0,0 +1,268 @@
+"""
+Set-based write paths for patient tests and reports.
+
+Views call these instead of looping over rows, so the number of queries a
+request costs stays constant no matter how many analytes it touches.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Case, When, Value
+from django.utils import timezone
+
+from . import caching, classification, counters, groups, search, sequences
+from .models import Patient, MedicalReport, TestType, PatientTest, TestGroup
+
+# Groups linked per CASE update, keeps the statement under SQLite's parameter limit
+PUBLISH_BATCH_SIZE = 500
+
+# Rows deleted per transaction, so large purges don't hold the write lock for minutes
+DELETE_CHUNK_SIZE = 500
+
+
+def create_test_group(patient, test_type_ids, result_value=0, created_by=None):
+    """Create a draft test group with one PatientTest per test type.
+
+    Test types are loaded in one query, IDs are reserved in one block and all
+    rows are written with a single bulk_create. Returns (test_group, tests).
+    """
+    if not test_type_ids:
+        raise ValueError('Select at least one test')
+    result_value = float(result_value)
+    test_types = TestType.objects.in_bulk(set(int(pk) for pk in test_type_ids))
+    for test_type_id in test_type_ids:
+        if int(test_type_id) not in test_types:
+            raise TestType.DoesNotExist('TestType matching query does not exist.')
+
+    with transaction.atomic():
+        test_group = sequences.next_id(sequences.TEST_GROUP)
+        test_ids = sequences.next_ids(sequences.TEST, len(test_type_ids))
+
+        tests = []
+        for test_id, test_type_id in zip(test_ids, test_type_ids):
+            test = PatientTest(
+                test_id=test_id,
+                patient=patient,
+                report=None,  # No report until published
+                test_type=test_types[int(test_type_id)],
+                test_group=test_group,  # Assign same group ID
+                result_value=result_value,
+                is_published=False,
+                created_by=created_by
+            )
+            tests.append(test)
+
+        classification.classify_tests(tests)
+        PatientTest.objects.bulk_create(tests)
+        groups.build(test_group, tests).save()
+        caching.invalidate()
+
+    return test_group, tests
+
+
+def update_test_results(tests, results):
+    """Apply result values and notes to tests, reclassify and write them in one bulk_update.
+
+    `results` maps test_id to a dict with `result_value` and optional `notes`.
+    """
+    tests = list(tests)
+    for test in tests:
+        result = results[test.test_id]
+        test.result_value = float(result['result_value'])
+        test.notes = result.get('notes', '')
+
+    classification.classify_tests(tests)
+    with transaction.atomic():
+        PatientTest.objects.bulk_update(tests, ['result_value', 'notes', 'status'])
+        groups.refresh({test.test_group for test in tests})
+        MedicalReport.touch(test.report_id for test in tests)
+    caching.invalidate()
+    return tests
+
+
+def update_test_group(test_group, tests_data):
+    """Update the posted tests of one group with a single fetch and a single bulk_update.
+
+    Raises ValueError if any posted test_id does not belong to `test_group`.
+    """
+    results = {test_data['test_id']: test_data for test_data in tests_data}
+
+    with transaction.atomic():
+        tests = list(
+            PatientTest.objects.filter(test_group=test_group, test_id__in=results)
+            .select_related('test_type')
+        )
+        missing = set(results) - {test.test_id for test in tests}
+        if missing:
+            raise ValueError(f"Tests not in group {test_group}: {', '.join(sorted(missing))}")
+
+        return update_test_results(tests, results)
+
+
+def overall_status(statuses):
+    """Report status for a set of test statuses"""
+    statuses = set(statuses)
+    if classification.CRITICAL in statuses:
+        return 'critical'
+    if classification.ABNORMAL in statuses:
+        return 'at_risk'
+    return 'normal'
+
+
+def fill_pks(objects, key):
+    """Set the primary keys of bulk-created objects, looking them up by the unique field `key` if needed"""
+    if not any(obj.pk is None for obj in objects):
+        return
+    # Backends without RETURNING (MySQL) don't set primary keys on bulk_create
+    model = type(objects[0])
+    pks = dict(model.objects.filter(**{f'{key}__in': [getattr(obj, key) for obj in objects]}).values_list(key, 'id'))
+    for obj in objects:
+        obj.pk = pks[getattr(obj, key)]
+
+
+def build_report(report_id, test_group, tests, created_by=None):
+    """Unsaved report publishing the tests (with test_type loaded) of one group"""
+    # Collect test summary for report content
+    test_summary = [
+        f"{test.test_type.name}: {test.result_value} {test.test_type.unit} ({test.status})"
+        for test in tests
+    ]
+    status = overall_status(test.status for test in tests)
+    return MedicalReport(
+        report_id=report_id,
+        patient_id=tests[0].patient_id,
+        content="Laboratory Test Report\\n\\n" + "\\n".join(test_summary),
+        diagnosis=f"Test Group {test_group} - {status.upper()}",
+        recommendations="Please review test results with a healthcare provider.",
+        status=status,
+        ai_generated=False,
+        created_by=created_by
+    )
+
+
+def publish_test_groups(test_groups, created_by=None):
+    """Publish test groups, creating one report per group.
+
+    Every selected group is loaded with its test types in one query, the
+    reports are built in memory and written with one bulk_create, and all
+    tests are linked to their report with a single CASE update, atomically.
+    Groups without tests are skipped. Returns the created reports.
+    """
+    tests = PatientTest.objects.filter(test_group__in=test_groups).select_related('test_type')
+
+    with transaction.atomic():
+        by_group = defaultdict(list)
+        for test in tests:
+            by_group[test.test_group].append(test)
+        if not by_group:
+            return []
+
+        report_ids = sequences.next_ids(sequences.REPORT, len(by_group))
+        reports = [
+            build_report(report_id, test_group, group_tests, created_by)
+            for report_id, (test_group, group_tests) in zip(report_ids, by_group.items())
+        ]
+
+        MedicalReport.objects.bulk_create(reports)
+        counters.adjust(counters.report_deltas((report.status, report.ai_generated) for report in reports))
+        fill_pks(reports, 'report_id')
+        search.index_reports(reports)
+
+        # Link every test to its group's report and publish them, one CASE update per batch
+        published_date = timezone.now()
+        links = list(zip(by_group, reports))
+        for start in range(0, len(links), PUBLISH_BATCH_SIZE):
+            batch = links[start:start + PUBLISH_BATCH_SIZE]
+            PatientTest.objects.filter(test_group__in=[test_group for test_group, _ in batch]).update(
+                report_id=Case(*[When(test_group=test_group, then=Value(report.pk)) for test_group, report in batch]),
+                is_published=True,
+                published_date=published_date
+            )
+        groups.refresh(by_group)
+        caching.invalidate()
+
+    return reports
+
+
+@contextmanager
+def _bulk_write():
+    """Transaction whose counter, page cache and search index updates are applied once at the end"""
+    with transaction.atomic(), counters.batch(), caching.batch(), search.batch():
+        yield
+
+
+def _chunks(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _count_deleted(counts, deleted):
+    labels = {
+        Patient._meta.label: 'patients',
+        MedicalReport._meta.label: 'reports',
+        PatientTest._meta.label: 'tests',
+        User._meta.label: 'users',
+    }
+    for label, count in deleted.items():
+        if label in labels:
+            counts[labels[label]] += count
+
+
+def _empty_counts():
+    return {'patients': 0, 'reports': 0, 'tests': 0, 'users': 0}
+
+
+def delete_patients(patient_ids, chunk_size=DELETE_CHUNK_SIZE):
+    """Delete patients with their reports, tests and portal login accounts.
+
+    The graph is collected with set-based __in queries and deleted one chunk
+    of patients per transaction. Returns the number of deleted rows per kind.
+    """
+    counts = _empty_counts()
+    for chunk in _chunks(patient_ids, chunk_size):
+        with _bulk_write():
+            patients = Patient.objects.filter(id__in=chunk)
+            user_ids = list(patients.exclude(user=None).values_list('user_id', flat=True))
+
+            tests = PatientTest.objects.filter(patient_id__in=chunk)
+            codes = set(tests.values_list('test_group', flat=True))
+
+            _count_deleted(counts, tests.delete()[1])
+            _count_deleted(counts, MedicalReport.objects.filter(patient_id__in=chunk).delete()[1])
+            _count_deleted(counts, patients.delete()[1])
+            groups.refresh(codes)
+            if user_ids:
+                _count_deleted(counts, User.objects.filter(id__in=user_ids).delete()[1])
+    return counts
+
+
+def delete_reports(report_ids, chunk_size=DELETE_CHUNK_SIZE):
+    """Delete reports by report_id together with their tests"""
+    counts = _empty_counts()
+    for chunk in _chunks(report_ids, chunk_size):
+        with _bulk_write():
+            tests = PatientTest.objects.filter(report__report_id__in=chunk)
+            codes = set(tests.values_list('test_group', flat=True))
+
+            _count_deleted(counts, tests.delete()[1])
+            _count_deleted(counts, MedicalReport.objects.filter(report_id__in=chunk).delete()[1])
+            groups.refresh(codes)
+    return counts
+
+
+def delete_test_groups(test_groups, chunk_size=DELETE_CHUNK_SIZE):
+    """Delete every test in the given groups"""
+    counts = _empty_counts()
+    for chunk in _chunks(test_groups, chunk_size):
+        with transaction.atomic():
+            tests = PatientTest.objects.filter(test_group__in=chunk)
+            report_ids = set(tests.exclude(report=None).values_list('report_id', flat=True))
+
+            _count_deleted(counts, tests.delete()[1])
+            TestGroup.objects.filter(code__in=chunk).delete()
+            MedicalReport.touch(report_ids)
+            caching.invalidate()
+    return counts
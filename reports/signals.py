@@ -0,0 +1,106 @@
+"""
+Signal handlers keeping the dashboard counters, the cached page data, the
+search index, the test group summaries and the cached lab settings in sync
+with single-row writes
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import caching, counters, groups, search
+from .models import Patient, MedicalReport, PatientTest, LabSettings, TestCategory, TestType
+
+
+@receiver(post_save, sender=Patient)
+def count_created_patient(sender, instance, created, **kwargs):
+    if created:
+        counters.adjust({counters.PATIENTS: 1})
+
+
+@receiver(post_delete, sender=Patient)
+def count_deleted_patient(sender, instance, **kwargs):
+    counters.adjust({counters.PATIENTS: -1})
+
+
+@receiver(pre_save, sender=MedicalReport)
+def remember_report_state(sender, instance, **kwargs):
+    """Keep the stored status so post_save can move the report between status counters"""
+    instance._counted_state = None
+    if not instance._state.adding:
+        instance._counted_state = (
+            MedicalReport.objects.filter(pk=instance.pk).values_list('status', 'ai_generated').first()
+        )
+
+
+@receiver(post_save, sender=MedicalReport)
+def count_saved_report(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_counted_state', None)
+    deltas = counters.report_deltas([(instance.status, instance.ai_generated)])
+    if previous:
+        deltas.subtract(counters.report_deltas([previous]))
+    elif not created:
+        return
+    counters.adjust(deltas)
+
+
+@receiver(post_delete, sender=MedicalReport)
+def count_deleted_report(sender, instance, **kwargs):
+    counters.adjust(counters.report_deltas([(instance.status, instance.ai_generated)], sign=-1))
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+@receiver(post_save, sender=MedicalReport)
+@receiver(post_delete, sender=MedicalReport)
+@receiver(post_save, sender=PatientTest)
+def invalidate_cached_pages(sender, **kwargs):
+    # Test deletions go through reports.services, which invalidates once per
+    # batch; a post_delete receiver here would turn them into per-row deletes
+    caching.invalidate()
+
+
+@receiver(post_save, sender=Patient)
+def index_patient(sender, instance, created, **kwargs):
+    search.index_patients([instance])
+    if not created:
+        # The patient's name is part of their reports' documents
+        search.index_patient_reports(instance)
+
+
+@receiver(post_delete, sender=Patient)
+def unindex_patient(sender, instance, **kwargs):
+    search.remove_patients([instance.pk])
+
+
+@receiver(post_save, sender=MedicalReport)
+def index_report(sender, instance, **kwargs):
+    search.index_reports([instance])
+
+
+@receiver(post_delete, sender=MedicalReport)
+def unindex_report(sender, instance, **kwargs):
+    search.remove_reports([instance.pk])
+
+
+@receiver(post_save, sender=PatientTest)
+def summarize_test_group(sender, instance, **kwargs):
+    groups.refresh([instance.test_group])
+
+
+@receiver(post_save, sender=LabSettings)
+@receiver(post_delete, sender=LabSettings)
+@receiver(post_save, sender=TestCategory)
+@receiver(post_save, sender=TestType)
+def invalidate_lab_settings(sender, **kwargs):
+    # Test type names, units and ranges are part of every rendered report
+    caching.invalidate_settings()
+
+
+@receiver(post_save, sender=Patient)
+def touch_patient_reports(sender, instance, created, **kwargs):
+    if not created:
+        MedicalReport.touch(instance.reports.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=PatientTest)
+def touch_test_report(sender, instance, **kwargs):
+    MedicalReport.touch([instance.report_id])
@@ -0,0 +1,104 @@
+"""
+Rule-based clinical summaries.
+
+Builds the "Clinical Assessment" and "Medical Recommendations" sections
+directly from the tests' statuses and their TestType ranges and
+categories, without calling a model. It answers all-normal panels by
+default (AI_RULES_FOR_NORMAL) and stands in when the model fails or is too
+slow to start answering (AI_RULES_FALLBACK), so abnormal panels are the
+only ones that wait on the model.
+"""
+from django.utils.html import escape
+
+from .classification import ABNORMAL, CRITICAL, NORMAL
+
+SEVERITY = {CRITICAL: 0, ABNORMAL: 1, NORMAL: 2}
+
+FOOTNOTE = '<p><em>Summary generated automatically from the laboratory reference ranges.</em></p>'
+
+
+def reference_range(test_type):
+    """Reference range of a test type as text, e.g. '13.5-17.5 g/dL'"""
+    low, high = test_type.normal_range_min, test_type.normal_range_max
+    if low is not None and high is not None:
+        text = f'{low:g}-{high:g}'
+    elif low is not None:
+        text = f'at least {low:g}'
+    elif high is not None:
+        text = f'at most {high:g}'
+    else:
+        return 'no reference range'
+    return f'{text} {test_type.unit}' if test_type.unit else text
+
+
+def direction(test):
+    """'below' or 'above' the reference range, or None inside it"""
+    low, high = test.test_type.normal_range_min, test.test_type.normal_range_max
+    if low is not None and test.result_value < low:
+        return 'below'
+    if high is not None and test.result_value > high:
+        return 'above'
+    return None
+
+
+def finding(test):
+    test_type = test.test_type
+    value = f'{test.result_value:g} {test_type.unit or ""}'.strip()
+    side = direction(test)
+    where = f'{side} the reference range' if side else 'reference range'
+    return (
+        f'<li><strong>{escape(test_type.name)}</strong> ({escape(test_type.category.name)}): '
+        f'{escape(value)}, {where} {escape(reference_range(test_type))}</li>'
+    )
+
+
+def names(tests):
+    return ', '.join(escape(test.test_type.name) for test in tests)
+
+
+def build(tests):
+    """(diagnosis, recommendations) HTML for a report's tests (with test_type and category loaded)"""
+    tests = sorted(tests, key=lambda test: (SEVERITY.get(test.status, 2), test.test_type.category.name,
+                                            test.test_type.name))
+    critical = [test for test in tests if test.status == CRITICAL]
+    abnormal = [test for test in tests if test.status == ABNORMAL]
+    flagged = critical + abnormal
+    categories = sorted({test.test_type.category.name for test in tests})
+
+    diagnosis = [
+        '<h4>Clinical Assessment</h4>',
+        f'<p>{len(tests)} result(s) reviewed across {len(categories)} categor{"y" if len(categories) == 1 else "ies"}'
+        + (f': {escape(", ".join(categories))}.</p>' if categories else '.</p>'),
+    ]
+    if critical:
+        diagnosis.append('<p><strong>Critical findings</strong></p>')
+        diagnosis.append('<ol>' + ''.join(finding(test) for test in critical) + '</ol>')
+    if abnormal:
+        diagnosis.append('<p><strong>Abnormal findings</strong></p>')
+        diagnosis.append('<ol>' + ''.join(finding(test) for test in abnormal) + '</ol>')
+    if not flagged:
+        diagnosis.append('<p>All results are within their reference ranges.</p>')
+    elif len(tests) > len(flagged):
+        diagnosis.append(f'<p>The other {len(tests) - len(flagged)} result(s) are within their reference ranges.</p>')
+
+    advice = []
+    if critical:
+        advice.append(
+            f'<li><strong>Urgent:</strong> notify the treating physician today about {names(critical)} '
+            'and confirm the result(s) on a fresh sample.</li>'
+        )
+    by_category = {}
+    for test in abnormal:
+        by_category.setdefault(test.test_type.category.name, []).append(test)
+    for category, category_tests in by_category.items():
+        advice.append(
+            f'<li>Review the {escape(category)} results ({names(category_tests)}) with the patient '
+            'and repeat them in 4-6 weeks.</li>'
+        )
+    if flagged:
+        advice.append('<li>Correlate with symptoms, history and medication before starting treatment.</li>')
+    else:
+        advice.append('<li>No follow-up needed beyond routine screening.</li>')
+    recommendations = '<h4>Medical Recommendations</h4><ol>' + ''.join(advice) + '</ol>' + FOOTNOTE
+
+    return ''.join(diagnosis), recommendations
@@ -1 +1,1804 @@
 # Test file for models
+import asyncio
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from openai import OpenAIError
+
+from . import ai, ai_cache, bulk_ai, caching, classification, counters, exports, groups, importer, jobs, llm, loadgen, pagination, pdf, search, sequences, services, summary
+from .models import Patient, MedicalReport, TestCategory, TestType, PatientTest, TestGroup, IdSequence, LabSettings, AIJob, AIAnalysisCache
+
+
+def data_queries(context):
+    """Captured SQL without the SAVEPOINT bookkeeping of nested atomic blocks"""
+    return [q['sql'] for q in context.captured_queries if 'SAVEPOINT' not in q['sql']]
+
+
+class SequenceTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210')
+        category = TestCategory.objects.create(name='Blood Count')
+        self.test_type = TestType.objects.create(
+            name='Hemoglobin', category=category, unit='g/dL',
+            normal_range_min=13.5, normal_range_max=17.5
+        )
+
+    def test_ids_keep_their_format(self):
+        report = MedicalReport.objects.create(patient=self.patient)
+        test = PatientTest.objects.create(patient=self.patient, test_type=self.test_type, result_value=14)
+        self.assertEqual(report.report_id, 'REP-001')
+        self.assertEqual(test.test_id, 'TEST-0001')
+        self.assertEqual(sequences.next_id(sequences.TEST_GROUP), 'GRP-0001')
+
+    def test_block_is_reserved_with_one_update(self):
+        sequences.reserve(sequences.TEST)
+        with CaptureQueriesContext(connection) as context:
+            ids = sequences.next_ids(sequences.TEST, 50)
+        queries = data_queries(context)
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(queries[0].startswith('UPDATE'))
+        self.assertEqual(ids[0], 'TEST-0002')
+        self.assertEqual(ids[-1], 'TEST-0051')
+
+    def test_missing_sequence_is_seeded_from_existing_rows(self):
+        MedicalReport.objects.create(patient=self.patient, report_id='REP-041')
+        IdSequence.objects.filter(name=sequences.REPORT).delete()
+        report = MedicalReport.objects.create(patient=self.patient)
+        self.assertEqual(report.report_id, 'REP-042')
+
+
+class SequenceConcurrencyTests(TransactionTestCase):
+    WORKERS = 8
+    ROUNDS = 25
+
+    def test_parallel_writers_never_collide(self):
+        patient = Patient.objects.create(name='Jane Doe', age=30, gender='female', contact_number='9876543211')
+        reserved = []
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.WORKERS)
+
+        def writer():
+            try:
+                barrier.wait()
+                for _ in range(self.ROUNDS):
+                    block = sequences.next_ids(sequences.TEST, 3)
+                    report = MedicalReport.objects.create(patient=patient)
+                    with lock:
+                        reserved.extend(block)
+                        reserved.append(report.report_id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(reserved), self.WORKERS * self.ROUNDS * 4)
+        self.assertEqual(len(set(reserved)), len(reserved))
+        self.assertEqual(MedicalReport.objects.count(), self.WORKERS * self.ROUNDS)
+
+
+class AddTestViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='labtech', password='secret')
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210')
+        category = TestCategory.objects.create(name='Blood Count')
+        self.test_types = [
+            TestType.objects.create(
+                name=f'Analyte {i}', category=category, unit='mg/dL',
+                normal_range_min=10, normal_range_max=20
+            )
+            for i in range(30)
+        ]
+
+    def post_panel(self, test_types, result_value=15):
+        return self.client.post(reverse('add_test'), {
+            'patient_id': self.patient.id,
+            'test_type_ids[]': [t.id for t in test_types],
+            'result_value': result_value,
+        })
+
+    def test_response_lists_group_and_test_ids(self):
+        response = self.post_panel(self.test_types[:3])
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['test_group'], 'GRP-0001')
+        self.assertEqual(data['test_ids'], ['TEST-0001', 'TEST-0002', 'TEST-0003'])
+        tests = PatientTest.objects.filter(test_group='GRP-0001')
+        self.assertEqual(tests.count(), 3)
+        self.assertFalse(tests.filter(is_published=True).exists())
+
+    def test_query_count_does_not_grow_with_panel_size(self):
+        with CaptureQueriesContext(connection) as single:
+            self.post_panel(self.test_types[:1])
+        with CaptureQueriesContext(connection) as panel:
+            self.post_panel(self.test_types)
+        self.assertEqual(len(data_queries(panel)), len(data_queries(single)))
+        self.assertEqual(PatientTest.objects.count(), 31)
+
+    def test_service_writes_panel_with_single_insert(self):
+        with CaptureQueriesContext(connection) as context:
+            services.create_test_group(self.patient, [t.id for t in self.test_types], 4, created_by=self.user)
+        queries = data_queries(context)
+        # test type fetch + two ID blocks (update + read each) + one test insert + one group insert
+        self.assertEqual(len(queries), 7)
+        self.assertEqual(sum(q.startswith('INSERT') for q in queries), 2)
+        self.assertEqual(set(PatientTest.objects.values_list('status', flat=True)), {'critical'})
+
+    def test_unknown_test_type_creates_nothing(self):
+        response = self.client.post(reverse('add_test'), {
+            'patient_id': self.patient.id,
+            'test_type_ids[]': [self.test_types[0].id, 99999],
+        })
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(PatientTest.objects.count(), 0)
+
+    def test_empty_selection_is_rejected(self):
+        data = self.post_panel([]).json()
+        self.assertEqual((data['success'], data['error']), (False, 'Select at least one test'))
+        self.assertEqual((PatientTest.objects.count(), TestGroup.objects.count()), (0, 0))
+
+
+class ClassificationTests(TestCase):
+    def test_batch_classification(self):
+        statuses = classification.classify(
+            [15, 25, 35, 4, 12, 250, 5],
+            [10, 10, 10, 10, None, 0, None],
+            [20, 20, 20, 20, None, 200, 3],
+        )
+        self.assertEqual(statuses, ['normal', 'abnormal', 'critical', 'critical', None, 'abnormal', 'critical'])
+
+    def test_zero_minimum_is_a_real_bound(self):
+        self.assertEqual(classification.classify([150, 210, 301, -1], [0] * 4, [200] * 4),
+                         ['normal', 'abnormal', 'critical', 'critical'])
+
+    def test_save_uses_engine(self):
+        patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210')
+        category = TestCategory.objects.create(name='Lipid Panel')
+        cholesterol = TestType.objects.create(
+            name='Total Cholesterol', category=category, unit='mg/dL',
+            normal_range_min=0, normal_range_max=200
+        )
+        test = PatientTest.objects.create(patient=patient, test_type=cholesterol, result_value=240)
+        self.assertEqual(test.status, 'abnormal')
+
+
+class UpdateTestViewTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210')
+        category = TestCategory.objects.create(name='Lipid Panel')
+        test_types = [
+            TestType.objects.create(name=name, category=category, unit='mg/dL', normal_range_min=0, normal_range_max=200)
+            for name in ('Total Cholesterol', 'Triglycerides')
+        ]
+        self.test_group, self.tests = services.create_test_group(patient, [t.id for t in test_types])
+
+    def test_update_test_group_reclassifies(self):
+        response = self.client.post(reverse('update_test_group'), data={
+            'test_group': self.test_group,
+            'tests': [
+                {'test_id': self.tests[0].test_id, 'result_value': 250, 'notes': 'fasting'},
+                {'test_id': self.tests[1].test_id, 'result_value': 120},
+            ],
+        }, content_type='application/json')
+        self.assertEqual(response.json(), {'success': True, 'count': 2})
+        first, second = PatientTest.objects.filter(test_group=self.test_group).order_by('test_id')
+        self.assertEqual((first.result_value, first.status, first.notes), (250, 'abnormal', 'fasting'))
+        self.assertEqual((second.result_value, second.status), (120, 'normal'))
+
+    def test_update_test_group_uses_one_fetch_and_one_update(self):
+        payload = [{'test_id': test.test_id, 'result_value': 50} for test in self.tests]
+        with CaptureQueriesContext(connection) as context:
+            services.update_test_group(self.test_group, payload)
+        queries = data_queries(context)
+        # One fetch and one update of the tests, then the group summary refresh
+        self.assertEqual([q.split()[0] for q in queries], ['SELECT', 'UPDATE', 'SELECT', 'SELECT', 'UPDATE'])
+
+    def test_update_test_group_rejects_foreign_tests(self):
+        patient = Patient.objects.get()
+        other_group, other_tests = services.create_test_group(patient, [self.tests[0].test_type_id])
+        response = self.client.post(reverse('update_test_group'), data={
+            'test_group': self.test_group,
+            'tests': [
+                {'test_id': self.tests[0].test_id, 'result_value': 250},
+                {'test_id': other_tests[0].test_id, 'result_value': 250},
+            ],
+        }, content_type='application/json')
+        data = response.json()
+        self.assertFalse(data['success'])
+        self.assertIn(other_tests[0].test_id, data['error'])
+        self.assertFalse(PatientTest.objects.filter(result_value=250).exists())
+
+    def test_update_test_returns_new_status(self):
+        response = self.client.post(reverse('update_test'), {
+            'test_id': self.tests[0].test_id, 'result_value': 400, 'notes': '',
+        })
+        self.assertEqual(response.json()['status'], 'critical')
+        self.assertEqual(PatientTest.objects.get(test_id=self.tests[0].test_id).status, 'critical')
+
+
+class PublishTestsViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='labtech', password='secret')
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210')
+        category = TestCategory.objects.create(name='Blood Count')
+        self.test_types = [
+            TestType.objects.create(name=f'Analyte {i}', category=category, unit='mg/dL',
+                                    normal_range_min=10, normal_range_max=20)
+            for i in range(3)
+        ]
+
+    def make_groups(self, count, result_value=15):
+        return [
+            services.create_test_group(self.patient, [t.id for t in self.test_types], result_value)[0]
+            for _ in range(count)
+        ]
+
+    def test_publish_creates_one_report_per_group(self):
+        normal = self.make_groups(2)
+        critical = self.make_groups(1, result_value=40)
+        response = self.client.post(reverse('publish_tests'), {'test_groups[]': normal + critical})
+        self.assertEqual(response.json(), {'success': True, 'count': 3})
+
+        self.assertEqual(MedicalReport.objects.count(), 3)
+        for test_group in normal + critical:
+            tests = PatientTest.objects.filter(test_group=test_group)
+            report = tests[0].report
+            self.assertTrue(all(t.is_published and t.report_id == report.id for t in tests))
+            self.assertEqual(report.diagnosis, f'Test Group {test_group} - {report.status.upper()}')
+            self.assertEqual(report.created_by, self.user)
+        self.assertEqual(PatientTest.objects.get(test_group=critical[0], test_type=self.test_types[0]).report.status,
+                         'critical')
+
+    def test_publish_query_count_is_constant(self):
+        few = self.make_groups(2)
+        many = self.make_groups(40)
+        with CaptureQueriesContext(connection) as small:
+            services.publish_test_groups(few)
+        with CaptureQueriesContext(connection) as large:
+            services.publish_test_groups(many)
+        self.assertEqual(len(data_queries(large)), len(data_queries(small)))
+        self.assertEqual(MedicalReport.objects.count(), 42)
+        self.assertEqual(len(set(MedicalReport.objects.values_list('report_id', flat=True))), 42)
+
+    def test_unknown_groups_are_skipped(self):
+        self.assertEqual(services.publish_test_groups(['GRP-9999']), [])
+        self.assertEqual(MedicalReport.objects.count(), 0)
+
+
+class DeletionTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        category = TestCategory.objects.create(name='Blood Count')
+        self.test_type = TestType.objects.create(name='Hemoglobin', category=category, unit='g/dL',
+                                                 normal_range_min=13.5, normal_range_max=17.5)
+
+    def make_patients(self, count):
+        patients = []
+        for i in range(count):
+            contact = f'9{len(Patient.objects.all()):09d}'
+            user = User.objects.create_user(username=contact, password='secret')
+            patient = Patient.objects.create(name=f'Patient {contact}', age=40, gender='male',
+                                             contact_number=contact, user=user)
+            test_group, _ = services.create_test_group(patient, [self.test_type.id, self.test_type.id], 15)
+            services.publish_test_groups([test_group])
+            services.create_test_group(patient, [self.test_type.id], 15)
+            patients.append(patient)
+        return patients
+
+    def test_bulk_delete_patients_removes_whole_graph(self):
+        patients = self.make_patients(3)
+        keep = self.make_patients(1)[0]
+        response = self.client.post(reverse('bulk_delete_patients'), {'patient_ids[]': [p.id for p in patients]})
+        self.assertEqual(response.json(), {'success': True, 'count': 3})
+
+        self.assertEqual(list(Patient.objects.all()), [keep])
+        self.assertEqual(MedicalReport.objects.exclude(patient=keep).count(), 0)
+        self.assertEqual(PatientTest.objects.exclude(patient=keep).count(), 0)
+        self.assertFalse(User.objects.filter(id__in=[p.user_id for p in patients]).exists())
+        self.assertTrue(User.objects.filter(id=keep.user_id).exists())
+
+    def test_delete_query_count_is_constant_per_chunk(self):
+        few = self.make_patients(2)
+        many = self.make_patients(12)
+        with CaptureQueriesContext(connection) as small:
+            services.delete_patients([p.id for p in few])
+        with CaptureQueriesContext(connection) as large:
+            counts = services.delete_patients([p.id for p in many])
+        self.assertEqual(len(data_queries(large)), len(data_queries(small)))
+        self.assertEqual(counts, {'patients': 12, 'reports': 12, 'tests': 36, 'users': 12})
+
+    def test_large_selections_are_deleted_in_chunks(self):
+        patients = self.make_patients(5)
+        counts = services.delete_patients([p.id for p in patients], chunk_size=2)
+        self.assertEqual(counts['patients'], 5)
+        self.assertFalse(Patient.objects.exists())
+
+    def test_delete_patient_not_found(self):
+        response = self.client.post(reverse('delete_patient', args=[9999]))
+        self.assertEqual(response.json(), {'success': False, 'error': 'Patient not found'})
+
+    def test_bulk_delete_reports_removes_tests(self):
+        patients = self.make_patients(2)
+        report_ids = list(MedicalReport.objects.values_list('report_id', flat=True))
+        response = self.client.post(reverse('bulk_delete_reports'), {'report_ids[]': report_ids})
+        self.assertEqual(response.json(), {'success': True, 'count': 2})
+        self.assertFalse(MedicalReport.objects.exists())
+        # Unpublished drafts are not part of any report and stay
+        self.assertEqual(PatientTest.objects.count(), len(patients))
+
+
+class TestGroupSummaryTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        self.patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210')
+        category = TestCategory.objects.create(name='Blood Count')
+        self.test_types = [
+            TestType.objects.create(name=f'Analyte {i}', category=category, unit='mg/dL',
+                                    normal_range_min=10, normal_range_max=20)
+            for i in range(3)
+        ]
+
+    def make_group(self, result_value=15):
+        return services.create_test_group(self.patient, [t.id for t in self.test_types], result_value)
+
+    def test_create_writes_summary(self):
+        code, tests = self.make_group(result_value=25)
+        group = TestGroup.objects.get(code=code)
+        self.assertEqual((group.patient, group.report, group.is_published), (self.patient, None, False))
+        self.assertEqual((group.analyte_count, group.abnormal_count, group.critical_count), (3, 3, 0))
+        self.assertEqual(group.worst_status, 'abnormal')
+        self.assertEqual(group.test_date, max(test.test_date for test in tests))
+
+    def test_updates_and_publish_keep_summary_in_sync(self):
+        code, tests = self.make_group()
+        services.update_test_group(code, [{'test_id': tests[0].test_id, 'result_value': 40}])
+        group = TestGroup.objects.get(code=code)
+        self.assertEqual((group.worst_status, group.critical_count), ('critical', 1))
+
+        report, = services.publish_test_groups([code])
+        group.refresh_from_db()
+        self.assertTrue(group.is_published)
+        self.assertEqual(group.report, report)
+        self.assertIsNotNone(group.published_date)
+
+    def test_deletes_remove_summary(self):
+        drafts = [self.make_group()[0] for _ in range(2)]
+        published, _ = self.make_group()
+        report, = services.publish_test_groups([published])
+        services.delete_test_groups(drafts[:1])
+        services.delete_reports([report.report_id])
+        self.assertEqual(list(TestGroup.objects.values_list('code', flat=True)), drafts[1:])
+        services.delete_patients([self.patient.id])
+        self.assertFalse(TestGroup.objects.exists())
+
+    def test_single_test_save_refreshes_summary(self):
+        code, tests = self.make_group()
+        test = PatientTest.objects.get(test_id=tests[0].test_id)
+        test.result_value = 2
+        test.save()
+        self.assertEqual(TestGroup.objects.get(code=code).worst_status, 'critical')
+
+    def test_rebuild_matches_incremental_summaries(self):
+        self.make_group(25)
+        code, _ = self.make_group()
+        services.publish_test_groups([code])
+        fields = ['code'] + groups.SUMMARY_FIELDS
+        expected = list(TestGroup.objects.order_by('code').values(*fields))
+        groups.rebuild()
+        self.assertEqual(list(TestGroup.objects.order_by('code').values(*fields)), expected)
+
+    def test_tests_view_statistics_count_groups(self):
+        self.make_group()
+        abnormal, _ = self.make_group(25)
+        critical, _ = self.make_group(40)
+        services.publish_test_groups([abnormal, critical])
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('tests'))
+        self.assertEqual(
+            {key: response.context[key] for key in
+             ('total_tests', 'draft_count', 'published_count', 'abnormal_tests', 'critical_tests')},
+            {'total_tests': 3, 'draft_count': 1, 'published_count': 2, 'abnormal_tests': 1, 'critical_tests': 1}
+        )
+        self.assertEqual([g.worst_status for g in response.context['published_test_groups']],
+                         ['critical', 'abnormal'])
+        self.assertFalse(any('reports_patienttest' in q and 'COUNT(' in q for q in data_queries(context)))
+        # The patient picker searches on demand instead of listing every patient
+        self.assertFalse(any('FROM "reports_patient"' in q and 'WHERE' not in q for q in data_queries(context)))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        Patient.objects.bulk_create([
+            Patient(name=f'Patient {i}', age=40, gender='male', contact_number=f'9{i:09d}')
+            for i in range(23)
+        ])
+        # Several rows share a timestamp so the id tie-breaker matters
+        now = timezone.now()
+        for i, patient in enumerate(Patient.objects.order_by('id')):
+            Patient.objects.filter(id=patient.id).update(created_at=now - timedelta(minutes=i // 3))
+
+    def walk(self, queryset, field, page_size):
+        seen, cursor = [], None
+        while True:
+            page = pagination.paginate(queryset, field, cursor, page_size)
+            seen.extend(row.id for row in page)
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_row_once_in_order(self):
+        seen = self.walk(Patient.objects.all(), 'created_at', 5)
+        expected = list(Patient.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_cursor_is_stable_while_rows_arrive(self):
+        first = pagination.paginate(Patient.objects.all(), 'created_at', None, 5)
+        second = pagination.paginate(Patient.objects.all(), 'created_at', first.next_cursor, 5)
+        Patient.objects.create(name='Newcomer', age=30, gender='female', contact_number='8000000000')
+        again = pagination.paginate(Patient.objects.all(), 'created_at', first.next_cursor, 5)
+        self.assertEqual([p.id for p in again], [p.id for p in second])
+
+    def test_previous_cursor_returns_to_prior_page(self):
+        first = pagination.paginate(Patient.objects.all(), 'created_at', None, 5)
+        second = pagination.paginate(Patient.objects.all(), 'created_at', first.next_cursor, 5)
+        third = pagination.paginate(Patient.objects.all(), 'created_at', second.next_cursor, 5)
+        back = pagination.paginate(Patient.objects.all(), 'created_at', third.previous_cursor, 5)
+        self.assertEqual([p.id for p in back], [p.id for p in second])
+        self.assertEqual([p.id for p in pagination.paginate(Patient.objects.all(), 'created_at',
+                                                            second.previous_cursor, 5)], [p.id for p in first])
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        page = pagination.paginate(Patient.objects.all(), 'created_at', 'not-a-cursor', 5)
+        self.assertFalse(page.has_previous)
+        self.assertEqual(len(page), 5)
+
+    def test_patients_view_links_keep_search(self):
+        Patient.objects.bulk_create(
+            [Patient(name=f'Patient Extra {i}', age=40, gender='male', contact_number=f'7{i:09d}')
+             for i in range(pagination.PAGE_SIZE)] +
+            [Patient(name=f'Other {i}', age=40, gender='male', contact_number=f'6{i:09d}') for i in range(5)]
+        )
+        # bulk_create bypasses the signals that keep the search index in sync
+        search.rebuild()
+        response = self.client.get(reverse('patients'), {'search': 'Patient'})
+        self.assertEqual(len(response.context['patients']), pagination.PAGE_SIZE)
+        self.assertIn('search=Patient', response.context['next_page_query'])
+
+        response = self.client.get(reverse('patients') + '?' + response.context['next_page_query'])
+        self.assertEqual(len(response.context['patients']), 23)
+        self.assertTrue(all(p.name.startswith('Patient') for p in response.context['patients']))
+        self.assertNotIn('next_page_query', response.context)
+
+    def test_reports_view_pages_with_status_filter(self):
+        patient = Patient.objects.first()
+        MedicalReport.objects.bulk_create([
+            MedicalReport(report_id=f'REP-{i:03d}', patient=patient, status='critical' if i % 2 else 'normal')
+            for i in range(1, 2 * pagination.PAGE_SIZE + 10)
+        ])
+        seen = []
+        query = 'status=critical'
+        while query:
+            response = self.client.get(reverse('reports') + '?' + query)
+            seen.extend(r.report_id for r in response.context['reports'])
+            query = response.context.get('next_page_query')
+        self.assertEqual(sorted(seen), sorted(MedicalReport.objects.filter(status='critical')
+                                              .values_list('report_id', flat=True)))
+
+    def test_tests_view_keeps_groups_whole(self):
+        category = TestCategory.objects.create(name='Blood Count')
+        test_types = [TestType.objects.create(name=f'Analyte {i}', category=category) for i in range(7)]
+        patient = Patient.objects.first()
+        for _ in range(pagination.PAGE_SIZE + 5):
+            services.create_test_group(patient, [t.id for t in test_types])
+        seen, query = [], ''
+        while True:
+            response = self.client.get(reverse('tests') + '?' + query)
+            groups = response.context['draft_test_groups']
+            self.assertTrue(all(len(group.analytes) == 7 for group in groups))
+            seen.extend(group.code for group in groups)
+            query = response.context.get('next_page_query')
+            if not query:
+                break
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), PatientTest.objects.values('test_group').distinct().count())
+
+
+class PatientsViewQueryTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+
+    def seed(self, count):
+        start = Patient.objects.count()
+        patients = Patient.objects.bulk_create([
+            Patient(name=f'Patient {i}', age=40, gender='male', contact_number=f'9{i:09d}')
+            for i in range(start, start + count)
+        ])
+        MedicalReport.objects.bulk_create([
+            MedicalReport(report_id=f'REP-{patient.id:06d}-{n}', patient=patient,
+                          status='critical' if n else 'normal',
+                          date_created=timezone.now() - timedelta(days=2 - n))
+            for patient in patients for n in range(2)
+        ])
+
+    def test_query_count_is_constant_at_1000_patients(self):
+        self.seed(10)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('patients'))
+        self.seed(990)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('patients'))
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+
+        patient = response.context['patients'].items[0]
+        self.assertEqual(patient.report_count, 2)
+        self.assertEqual(patient.latest_report_status, 'critical')
+        self.assertContains(response, 'badge-critical')
+
+
+class DashboardCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        category = TestCategory.objects.create(name='Blood Count')
+        self.test_type = TestType.objects.create(name='Hemoglobin', category=category,
+                                                 normal_range_min=13.5, normal_range_max=17.5)
+
+    def assertInSync(self):
+        self.assertEqual(counters.snapshot(), counters.compute())
+
+    def test_single_row_writes_keep_counters_in_sync(self):
+        patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210')
+        report = MedicalReport.objects.create(patient=patient, status='at_risk')
+        self.assertInSync()
+
+        report.status = 'critical'
+        report.ai_generated = True
+        report.save()
+        self.assertInSync()
+        self.assertEqual(counters.snapshot()[counters.status_counter('critical')], 1)
+
+        report.delete()
+        patient.delete()
+        self.assertInSync()
+
+    def test_bulk_paths_keep_counters_in_sync(self):
+        patients = [
+            Patient.objects.create(name=f'Patient {i}', age=40, gender='male', contact_number=f'9{i:09d}')
+            for i in range(4)
+        ]
+        groups = [services.create_test_group(p, [self.test_type.id], value)[0]
+                  for p, value in zip(patients, (15, 12, 30, 16))]
+        services.publish_test_groups(groups)
+        self.assertInSync()
+        self.assertEqual(counters.snapshot()[counters.REPORTS], 4)
+
+        services.delete_reports([MedicalReport.objects.first().report_id])
+        self.assertInSync()
+        services.delete_patients([p.id for p in patients[:2]])
+        self.assertInSync()
+
+    def test_batch_applies_one_update(self):
+        patients = [
+            Patient.objects.create(name=f'Patient {i}', age=40, gender='male', contact_number=f'9{i:09d}')
+            for i in range(5)
+        ]
+        with CaptureQueriesContext(connection) as context:
+            services.delete_patients([p.id for p in patients])
+        updates = [q for q in data_queries(context) if 'reports_dashboardcounter' in q]
+        self.assertEqual(len(updates), 1)
+        self.assertInSync()
+
+    def test_dashboard_reads_counters(self):
+        patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210')
+        MedicalReport.objects.create(patient=patient, status='critical', ai_generated=True)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['total_patients'], 1)
+        self.assertEqual(response.context['ai_generated'], 1)
+        self.assertEqual(response.context['analysis_data'], {'normal': 0, 'at_risk': 0, 'critical': 1})
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('dashboard'))
+        self.assertFalse(any('COUNT' in q['sql'] for q in context.captured_queries))
+
+    def test_reconcile_command_fixes_drift(self):
+        Patient.objects.bulk_create([Patient(name='Bulk', age=40, gender='male', contact_number='9000000001')])
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('patients: 0 -> 1', out.getvalue())
+        self.assertInSync()
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        self.patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210')
+
+    def test_dashboard_is_served_from_cache_until_a_write(self):
+        self.client.get(reverse('dashboard'))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('dashboard'))
+        tables = ('reports_medicalreport', 'reports_dashboardcounter')
+        self.assertFalse(any(table in q['sql'] for q in context.captured_queries for table in tables))
+        self.assertEqual(response.context['total_reports'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MedicalReport.objects.create(patient=self.patient, status='critical')
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['total_reports'], 1)
+        self.assertEqual(caching.stats(['dashboard'])['dashboard'], {'hits': 1, 'misses': 2})
+
+    def test_ai_analysis_context_is_cached(self):
+        MedicalReport.objects.create(patient=self.patient, status='normal', ai_generated=True)
+        response = self.client.get(reverse('ai_analysis'))
+        self.assertEqual(response.context['ai_report_count'], 1)
+        self.assertEqual(len(response.context['reports']), 1)
+        self.client.get(reverse('ai_analysis'))
+        self.assertEqual(caching.stats(['ai_analysis'])['ai_analysis'], {'hits': 1, 'misses': 1})
+
+    def test_bulk_delete_bumps_version_once(self):
+        patients = [
+            Patient.objects.create(name=f'Patient {i}', age=40, gender='male', contact_number=f'9{i:09d}')
+            for i in range(3)
+        ]
+        version = caching.data_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            services.delete_patients([p.id for p in patients])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(caching.data_version(), version + 1)
+
+    def test_rolled_back_write_does_not_bump_version(self):
+        version = caching.data_version()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            try:
+                with transaction.atomic():
+                    Patient.objects.create(name='Temp', age=40, gender='male', contact_number='9000000009')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(caching.data_version(), version)
+
+    def test_stats_command_needs_a_shared_cache(self):
+        # The default locmem cache of the command's own process would only ever show zeros
+        with self.assertRaisesMessage(CommandError, 'is private to each process'):
+            call_command('cache_stats', stdout=StringIO())
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}}
+        with override_settings(CACHES=shared):
+            caching.record('dashboard', hit=True)
+            out = StringIO()
+            call_command('cache_stats', stdout=out)
+        self.assertIn('dashboard: 1 hits, 0 misses (100.0% hit rate)', out.getvalue())
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        self.john = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210')
+        self.jane = Patient.objects.create(name='Jane Johnson', age=30, gender='female', contact_number='9123456789')
+        self.report = MedicalReport.objects.create(patient=self.john, report_id='REP-042')
+
+    def search_patients(self, query):
+        return set(search.filter_patients(Patient.objects.all(), query).values_list('name', flat=True))
+
+    def test_prefix_and_phone_fragment_matching(self):
+        self.assertEqual(self.search_patients('do'), {'John Doe'})
+        self.assertEqual(self.search_patients('joh'), {'John Doe', 'Jane Johnson'})
+        self.assertEqual(self.search_patients('jane joh'), {'Jane Johnson'})
+        self.assertEqual(self.search_patients('54321'), {'John Doe'})
+        self.assertEqual(self.search_patients('4567'), {'Jane Johnson'})
+        # A query without terms matches nothing instead of everything
+        for query in ('"*', '+++', '-', '"'):
+            self.assertEqual(self.search_patients(query), set())
+        self.assertEqual(search.filter_reports(MedicalReport.objects.all(), '+++').count(), 0)
+
+    def test_index_follows_writes(self):
+        self.john.name = 'Jonathan Doe'
+        self.john.save()
+        self.assertEqual(self.search_patients('jonathan'), {'Jonathan Doe'})
+        self.assertEqual(list(search.filter_reports(MedicalReport.objects.all(), 'jonathan')), [self.report])
+
+        services.delete_patients([self.john.id])
+        self.assertEqual(self.search_patients('doe'), set())
+        self.assertEqual(list(search.filter_reports(MedicalReport.objects.all(), '042')), [])
+
+    def test_published_reports_are_indexed(self):
+        category = TestCategory.objects.create(name='Blood Count')
+        test_type = TestType.objects.create(name='Hemoglobin', category=category)
+        test_group, _ = services.create_test_group(self.jane, [test_type.id], 14)
+        report = services.publish_test_groups([test_group])[0]
+        self.assertEqual(list(search.filter_reports(MedicalReport.objects.all(), 'jane')), [report])
+
+    def test_ranked_search_endpoint(self):
+        response = self.client.get(reverse('search'), {'q': 'john'})
+        data = response.json()
+        self.assertEqual([p['name'] for p in data['patients']], ['John Doe', 'Jane Johnson'])
+        self.assertEqual((data['patients'][0]['age'], data['patients'][0]['gender']), (45, 'male'))
+        self.assertEqual([r['report_id'] for r in data['reports']], ['REP-042'])
+
+    def test_views_use_index(self):
+        response = self.client.get(reverse('reports'), {'search': 'rep-04'})
+        self.assertEqual([r.report_id for r in response.context['reports']], ['REP-042'])
+        response = self.client.get(reverse('patients'), {'search': '3456'})
+        self.assertEqual([p.name for p in response.context['patients']], ['Jane Johnson'])
+
+    def test_rebuild_command(self):
+        Patient.objects.bulk_create([Patient(name='Bulk Patient', age=40, gender='male', contact_number='9000000001')])
+        self.assertEqual(self.search_patients('bulk'), set())
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search_patients('bulk'), {'Bulk Patient'})
+
+
+
+class LabSettingsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+
+    def test_settings_are_loaded_once_per_version(self):
+        self.assertEqual(LabSettings.get_settings().lab_name, 'MediGen Laboratory')
+        with CaptureQueriesContext(connection) as context:
+            settings = LabSettings.get_settings()
+        self.assertEqual(data_queries(context), [])
+        settings.lab_name = 'Changed but not saved'
+        self.assertEqual(LabSettings.get_settings().lab_name, 'MediGen Laboratory')
+
+    def test_settings_view_save_invalidates(self):
+        LabSettings.get_settings()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('settings'), {'lab_name': 'City Lab', 'lab_address': 'Main St'})
+        self.assertEqual(LabSettings.get_settings().lab_name, 'City Lab')
+
+    def test_version_bump_from_another_worker_reloads(self):
+        LabSettings.get_settings()
+        # A save in another process only reaches this one through the shared version key
+        LabSettings.objects.filter(id=1).update(lab_name='Updated Elsewhere')
+        self.assertEqual(LabSettings.get_settings().lab_name, 'MediGen Laboratory')
+        caching.bump_settings_version()
+        self.assertEqual(LabSettings.get_settings().lab_name, 'Updated Elsewhere')
+
+
+class ReportRenderCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        category = TestCategory.objects.create(name='Blood Count')
+        test_type = TestType.objects.create(name='Hemoglobin', category=category, unit='g/dL',
+                                            normal_range_min=13.5, normal_range_max=17.5)
+        self.patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210',
+                                              user=User.objects.create_user(username='9876543210', password='x'))
+        code, self.tests = services.create_test_group(self.patient, [test_type.id], 15)
+        self.report, = services.publish_test_groups([code])
+        self.url = reverse('report_detail', args=[self.report.report_id])
+
+    def test_body_is_rendered_once_per_revision(self):
+        self.assertContains(self.client.get(self.url), 'Hemoglobin')
+        with CaptureQueriesContext(connection) as context:
+            self.assertContains(self.client.get(self.url), 'Hemoglobin')
+        self.assertFalse(any('reports_patienttest' in q for q in data_queries(context)))
+
+        # The patient portal shares the cached body, only the navigation differs
+        portal = self.client_class()
+        portal.force_login(self.patient.user)
+        response = portal.get(reverse('patient_report_detail', args=[self.report.report_id]))
+        self.assertContains(response, 'Back to My Reports')
+        self.assertEqual(caching.stats([caching.REPORT_BODY])[caching.REPORT_BODY], {'hits': 2, 'misses': 1})
+
+    def test_repeat_view_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        repeat = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_catalog_edit_changes_etag(self):
+        response = self.client.get(self.url)
+        test_type = self.tests[0].test_type
+        test_type.unit = 'mmol/L'
+        with self.captureOnCommitCallbacks(execute=True):
+            test_type.save()
+        # A date-only revalidation must not get a 304 for the stale body
+        repeat = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertContains(repeat, 'mmol/L')
+        repeat = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(repeat, 'mmol/L')
+
+    def test_test_edit_starts_new_revision(self):
+        etag = self.client.get(self.url)['ETag']
+        services.update_test_group(self.tests[0].test_group, [{'test_id': self.tests[0].test_id, 'result_value': 42}])
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.revision, 2)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '42')
+
+    def test_report_and_settings_saves_change_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.report.diagnosis = 'Reviewed'
+        self.report.save()
+        self.assertEqual(self.report.revision, 2)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Reviewed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('settings'), {'lab_name': 'City Lab', 'lab_address': 'Main St'})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(response, 'City Lab')
+
+
+class ReportPdfTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        category = TestCategory.objects.create(name='Blood Count')
+        test_type = TestType.objects.create(name='Hemoglobin', category=category, unit='g/dL',
+                                            normal_range_min=13.5, normal_range_max=17.5)
+        self.patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210',
+                                              user=User.objects.create_user(username='9876543210', password='x'))
+        code, _ = services.create_test_group(self.patient, [test_type.id], 15)
+        self.report, = services.publish_test_groups([code])
+        self.url = reverse('report_pdf', args=[self.report.report_id])
+
+    def download(self, url=None, client=None):
+        response = (client or self.client).get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        return b''.join(response.streaming_content)
+
+    def stored_files(self):
+        return sorted(path.name for path in (pdf.Path(self.media_root) / pdf.PDF_DIR).glob('*.pdf'))
+
+    def test_download_renders_once_and_is_served_from_disk(self):
+        first = self.download()
+        self.assertTrue(first.startswith(b'%PDF'))
+        self.assertEqual(self.stored_files(), [pdf.pdf_path(self.report, caching.settings_version()).name])
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.download(), first)
+        self.assertFalse(any('reports_patienttest' in q for q in data_queries(context)))
+
+    def test_new_revision_replaces_file(self):
+        self.download()
+        self.report.diagnosis = 'Reviewed'
+        self.report.save()
+        self.download()
+        self.assertEqual(self.stored_files(), [f'{self.report.report_id}-r2-s{caching.settings_version()}.pdf'])
+
+    def test_patient_downloads_only_own_reports(self):
+        portal = self.client_class()
+        portal.force_login(self.patient.user)
+        self.assertTrue(self.download(reverse('patient_report_pdf', args=[self.report.report_id]), portal)
+                        .startswith(b'%PDF'))
+
+        other = Patient.objects.create(name='Jane Roe', age=30, gender='female', contact_number='9000000001',
+                                       user=User.objects.create_user(username='9000000001', password='x'))
+        portal.force_login(other.user)
+        response = portal.get(reverse('patient_report_pdf', args=[self.report.report_id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_slow_conversion_answers_accepted(self):
+        with override_settings(PDF_WAIT_TIMEOUT=0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'success': True, 'status': 'pending'})
+        self.assertEqual(response['Retry-After'], '2')
+        # The report page's download button polls on 202 instead of showing the JSON body
+        self.assertContains(self.client.get(reverse('report_detail', args=[self.report.report_id])),
+                            'onclick="downloadPdf(event, this)"')
+        # The retry joins the conversion still running in the pool
+        self.assertTrue(self.download().startswith(b'%PDF'))
+
+    def test_html_is_rendered_without_the_lock(self):
+        render_html = pdf.render_html
+
+        def render_unlocked(*args):
+            self.assertFalse(pdf._lock.locked())
+            return render_html(*args)
+
+        with mock.patch.object(pdf, 'render_html', side_effect=render_unlocked) as render:
+            self.assertTrue(self.download().startswith(b'%PDF'))
+        self.assertEqual(render.call_count, 1)
+
+    def test_dead_worker_is_replaced(self):
+        self.download()
+        self.report.diagnosis = 'Reviewed'
+        self.report.save()
+        # Killing a worker breaks the whole pool, the next download starts a fresh one
+        broken = pdf._pool()
+        for process in list(broken._processes.values()):
+            process.kill()
+        self.assertTrue(self.download().startswith(b'%PDF'))
+        self.assertIsNot(pdf._executor, broken)
+
+
+RESULTS_CSV = """contact_number,test,value,test_date,sample,notes
+9000000001,Hemoglobin,12.1,2024-03-01T08:30:00,S1,
+9000000001,cholesterol,180,2024-03-01T08:30:00,S1,fasting
+9000000002,Hemoglobin,15,2024-03-02,S2,
+9000000002,Cholesterol,320,2024-03-02,S2,
+9999999999,Hemoglobin,14,,S3,
+9000000002,Hemoglobin,high,,S4,
+9000000002,Ferritin,40,,S4,
+"""
+
+RESULTS_HL7 = "\r".join([
+    "MSH|^~\\&|ANALYZER|LAB|MEDIGENAI|LAB|20240301083000||ORU^R01|MSG001|P|2.5",
+    "PID|1||P1||Doe^John||19790101|M|||||9000000001",
+    "OBR|1|||PANEL|||20240301083000",
+    "OBX|1|NM|718-7^Hemoglobin||5.5|g/dL|13.5-17.5|LL|||F",
+    "OBX|2|NM|2093-3^Cholesterol||150|mg/dL|0-200|N|||F",
+    "OBX|3|ST|NOTE^Comment||hemolysed||||||F",
+    "MSH|^~\\&|ANALYZER|LAB|MEDIGENAI|LAB|20240302090000||ORU^R01|MSG002|P|2.5",
+    "PID|1||P2||Roe^Jane||19850101|F|||||9000000002",
+    "OBR|1|||PANEL|||20240302090000",
+    "OBX|1|NM|718-7^Hemoglobin||14|g/dL|13.5-17.5|N|||F",
+]) + "\r"
+
+
+class ResultsImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        blood = TestCategory.objects.create(name='Blood Count')
+        lipids = TestCategory.objects.create(name='Lipid Profile')
+        TestType.objects.create(name='Hemoglobin', category=blood, unit='g/dL', normal_range_min=13.5, normal_range_max=17.5)
+        TestType.objects.create(name='Cholesterol', category=lipids, unit='mg/dL', normal_range_min=0, normal_range_max=200)
+        self.first = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9000000001')
+        self.second = Patient.objects.create(name='Jane Roe', age=39, gender='female', contact_number='9000000002')
+
+    def test_csv_rows_become_classified_draft_groups(self):
+        with CaptureQueriesContext(connection) as context:
+            stats = importer.import_results(RESULTS_CSV.splitlines(keepends=True), chunk_size=2)
+        self.assertEqual((stats.rows, stats.imported, stats.groups, stats.skipped), (7, 4, 2, 3))
+        self.assertEqual(stats.errors, [
+            "Line 6: No patient with contact number '9999999999'",
+            "Line 7: Invalid value 'high'",
+            "Line 8: Unknown test 'Ferritin'",
+        ])
+        # One insert of tests and one of group summaries per chunk with results
+        inserts = [sql for sql in data_queries(context) if sql.startswith('INSERT INTO "reports_patienttest"')]
+        self.assertEqual(len(inserts), 2)
+
+        tests = PatientTest.objects.filter(patient=self.first).order_by('test_id')
+        self.assertEqual([(t.status, t.is_published, t.notes) for t in tests],
+                         [('abnormal', False, ''), ('normal', False, 'fasting')])
+        self.assertEqual(tests[0].test_date.isoformat(), '2024-03-01T08:30:00+00:00')
+        self.assertEqual(len({t.test_group for t in tests}), 1)
+        group = TestGroup.objects.get(code=tests[0].test_group)
+        self.assertEqual((group.analyte_count, group.worst_status, group.abnormal_count), (2, 'abnormal', 1))
+
+    def test_hl7_messages_are_imported_and_published(self):
+        before = counters.snapshot()[counters.REPORTS]
+        stats = importer.import_results([RESULTS_HL7], importer.HL7, publish=True)
+        self.assertEqual((stats.imported, stats.groups, stats.published, stats.skipped), (3, 2, 2, 0))
+        report = MedicalReport.objects.get(patient=self.first)
+        self.assertEqual(report.status, 'critical')
+        self.assertEqual(report.tests.get(test_type__name='Hemoglobin').test_date.isoformat(),
+                         '2024-03-01T08:30:00+00:00')
+        self.assertEqual(counters.snapshot()[counters.REPORTS], before + 2)
+        self.assertEqual(counters.snapshot(), counters.compute())
+
+    def test_hl7_timestamps_keep_their_offset(self):
+        self.assertEqual(importer.parse_timestamp('20240101120000+0100').isoformat(), '2024-01-01T12:00:00+01:00')
+        self.assertEqual(importer.parse_timestamp('202401011200-0530').isoformat(), '2024-01-01T12:00:00-05:30')
+        self.assertEqual(importer.parse_timestamp('20240101120000.1234+0000').isoformat(), '2024-01-01T12:00:00+00:00')
+        self.assertEqual(importer.parse_timestamp('20240101').isoformat(), '2024-01-01T00:00:00+00:00')
+        with self.assertRaises(ValueError):
+            importer.parse_timestamp('20241301120000+0100')
+
+    def test_malformed_csv_is_a_file_error(self):
+        oversized = 'contact_number,test,value\n9000000001,Hemoglobin,"' + 'x' * (csv.field_size_limit() + 1) + '"\n'
+        upload = SimpleUploadedFile('results.csv', oversized.encode())
+        data = self.client.post(reverse('import_results'), {'file': upload}).json()
+        self.assertFalse(data['success'])
+        self.assertEqual(data['error'],
+                         f'Invalid CSV after line 1: field larger than field limit ({csv.field_size_limit()})')
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'results.csv')
+        with open(path, 'w') as f:
+            f.write(oversized)
+        with self.assertRaises(CommandError):
+            call_command('import_results', path, stdout=StringIO())
+        self.assertEqual(PatientTest.objects.count(), 0)
+
+    def test_lines_are_split_across_blocks(self):
+        blocks = [b'\xef\xbb\xbfa,b\r', b'\nc\xc3', b'\xa9\r', b'\nlast']
+        self.assertEqual(list(importer.read_lines(blocks)), ['a,b\r\n', 'c\u00e9\r\n', 'last'])
+
+    def test_upload_endpoint(self):
+        upload = SimpleUploadedFile('results.csv', RESULTS_CSV.encode())
+        data = self.client.post(reverse('import_results'), {'file': upload}).json()
+        self.assertTrue(data['success'])
+        self.assertEqual((data['imported'], data['groups'], data['skipped']), (4, 2, 3))
+        self.assertIn('rows_per_second', data)
+        self.assertEqual(PatientTest.objects.filter(created_by__username='labtech').count(), 4)
+
+        upload = SimpleUploadedFile('results.csv', b'name,value\nHemoglobin,1\n')
+        data = self.client.post(reverse('import_results'), {'file': upload}).json()
+        self.assertEqual(data, {'success': False, 'error': 'CSV is missing the column(s): contact_number, test'})
+
+    def test_command_reports_throughput(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'results.hl7')
+        with open(path, 'w', newline='') as f:
+            f.write(RESULTS_HL7)
+        out, err = StringIO(), StringIO()
+        call_command('import_results', path, stdout=out, stderr=err)
+        self.assertIn('Imported 3 of 3 rows into 2 test group(s)', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('import_results', os.path.join(directory, 'missing.csv'), stdout=out)
+
+
+AI_ANSWER = '<h4>Clinical Assessment</h4><p>Mild anemia.</p><h4>Medical Recommendations</h4><p>Repeat in 3 months.</p>'
+
+
+def make_published_report(hemoglobin=15, contact_number='9876543210'):
+    category, _ = TestCategory.objects.get_or_create(name='Blood Count')
+    test_type, _ = TestType.objects.get_or_create(name='Hemoglobin', category=category, unit='g/dL',
+                                                  normal_range_min=13.5, normal_range_max=17.5)
+    patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number=contact_number)
+    code, _ = services.create_test_group(patient, [test_type.id], hemoglobin)
+    return services.publish_test_groups([code])[0]
+
+
+class RuleSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.blood = TestCategory.objects.create(name='Blood Count')
+        self.lipids = TestCategory.objects.create(name='Lipid Profile')
+        self.hemoglobin = TestType.objects.create(name='Hemoglobin', category=self.blood, unit='g/dL',
+                                                  normal_range_min=13.5, normal_range_max=17.5)
+        self.platelets = TestType.objects.create(name='Platelets <PLT>', category=self.blood, unit='10^3/uL',
+                                                 normal_range_min=150, normal_range_max=400)
+        self.cholesterol = TestType.objects.create(name='Cholesterol', category=self.lipids, unit='mg/dL',
+                                                   normal_range_min=0, normal_range_max=200)
+
+    def tests(self, *values):
+        tests = [PatientTest(test_type=test_type, result_value=value) for test_type, value in values]
+        return classification.classify_tests(tests)
+
+    def test_findings_are_ordered_by_severity_with_their_ranges(self):
+        diagnosis, recommendations = summary.build(self.tests(
+            (self.cholesterol, 240), (self.hemoglobin, 6), (self.platelets, 250),
+        ))
+        self.assertTrue(diagnosis.startswith('<h4>Clinical Assessment</h4><p>3 result(s) reviewed across 2 categories'))
+        self.assertLess(diagnosis.index('Critical findings'), diagnosis.index('Abnormal findings'))
+        self.assertIn('<strong>Hemoglobin</strong> (Blood Count): 6 g/dL, below the reference range 13.5-17.5 g/dL',
+                      diagnosis)
+        self.assertIn('Cholesterol</strong> (Lipid Profile): 240 mg/dL, above the reference range 0-200 mg/dL',
+                      diagnosis)
+        self.assertIn('The other 1 result(s) are within their reference ranges.', diagnosis)
+        self.assertIn('<strong>Urgent:</strong> notify the treating physician today about Hemoglobin', recommendations)
+        self.assertIn('Review the Lipid Profile results (Cholesterol)', recommendations)
+
+    def test_normal_panel_needs_no_follow_up(self):
+        diagnosis, recommendations = summary.build(self.tests((self.hemoglobin, 15), (self.platelets, 200)))
+        self.assertIn('All results are within their reference ranges.', diagnosis)
+        self.assertIn('No follow-up needed', recommendations)
+        # Test names are escaped
+        self.assertIn('Platelets &lt;PLT&gt;', summary.build(self.tests((self.platelets, 20)))[0])
+
+    def test_normal_panels_skip_the_model(self):
+        report = make_published_report(hemoglobin=15)
+        job = jobs.enqueue(report)
+        with mock.patch.object(ai, 'complete', side_effect=AssertionError('model called')):
+            jobs.run(jobs.claim())
+        job.refresh_from_db()
+        report.refresh_from_db()
+        self.assertEqual((job.status, report.status, report.ai_generated), ('succeeded', 'normal', True))
+        self.assertIn('All results are within their reference ranges.', report.diagnosis)
+
+        with override_settings(AI_RULES_FOR_NORMAL=False), mock.patch.object(ai, 'complete', return_value=AI_ANSWER):
+            ai.generate(report)
+        self.assertEqual(report.recommendations, ai.split_response(AI_ANSWER)[1])
+
+    def test_report_without_results_is_not_analysed(self):
+        self.assertFalse(ai.uses_rules([]))
+        report = make_published_report(hemoglobin=15)
+        report.tests.update(is_published=False)
+        with self.assertRaises(ai.NoResultsError):
+            ai.generate(report)
+
+        job = jobs.enqueue(report)
+        with mock.patch.object(ai, 'complete', side_effect=AssertionError('model called')):
+            jobs.run(jobs.claim())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), ('failed', 1, ai.NO_RESULTS))
+        self.assertEqual(jobs.enqueue_many(MedicalReport.objects.all()), 0)
+
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        response = self.client.post(reverse('generate_ai_report', args=[report.report_id]))
+        self.assertEqual((response.status_code, response.json()['error']), (400, ai.NO_RESULTS))
+        response = self.client.post(reverse('stream_ai_report', args=[report.report_id]))
+        self.assertEqual((response.status_code, response.json()['error']), (400, ai.NO_RESULTS))
+
+        stats, failed = bulk_ai.generate_batch([report.pk], 1, None, None)
+        self.assertEqual((stats['generated'], failed), (0, {report.report_id: ai.NO_RESULTS}))
+        report.refresh_from_db()
+        self.assertEqual((report.ai_generated, report.revision), (False, 1))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        self.async_client.force_login(User.objects.get(username='labtech'))
+        self.at_risk = make_published_report(hemoglobin=12, contact_number='9000000001')
+        self.critical = make_published_report(hemoglobin=5, contact_number='9000000002')
+        self.normal = make_published_report(hemoglobin=15, contact_number='9000000003')
+        self.draft_group, _ = services.create_test_group(self.normal.patient, [TestType.objects.get().id], 30)
+
+    def read(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_reports_csv_uses_the_list_filters(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('export_data', args=['reports']), {'status': 'critical'})
+            body = self.read(response)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertRegex(response['Content-Disposition'], r'attachment; filename="reports-\d{8}\.csv"')
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual([row['report_id'] for row in rows], [self.critical.report_id])
+        self.assertEqual((rows[0]['contact_number'], rows[0]['patient_name']), ('9000000002', 'John Doe'))
+        # Rows and their patients come from one query
+        selects = [sql for sql in data_queries(context) if 'FROM "reports_medicalreport"' in sql]
+        self.assertEqual(len(selects), 1)
+
+        body = self.read(self.client.get(reverse('export_data', args=['reports']), {'search': self.normal.report_id}))
+        self.assertEqual(len(list(csv.DictReader(StringIO(body)))), 1)
+
+    def test_tests_jsonl_in_chunks(self):
+        chunks = list(exports.stream('tests', {'published': 'true'}, exports.JSONL, chunk_size=2))
+        self.assertEqual(len(chunks), 2)
+        rows = [json.loads(line) for line in ''.join(chunks).splitlines()]
+        self.assertEqual([row['report_id'] for row in rows],
+                         [self.at_risk.report_id, self.critical.report_id, self.normal.report_id])
+        self.assertEqual(rows[1]['result_value'], 5.0)
+        self.assertEqual((rows[1]['status'], rows[1]['test'], rows[1]['category']),
+                         ('critical', 'Hemoglobin', 'Blood Count'))
+
+        drafts = list(exports.stream('tests', {'group': self.draft_group}, exports.CSV))
+        self.assertEqual(len(list(csv.DictReader(StringIO(''.join(drafts))))), 1)
+        response = self.client.get(reverse('export_data', args=['patients']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_csv_quotes_text_that_would_be_a_formula(self):
+        MedicalReport.objects.filter(pk=self.critical.pk).update(diagnosis='=HYPERLINK("http://x")',
+                                                                 recommendations='-2+3')
+        Patient.objects.filter(pk=self.critical.patient_id).update(name='@SUM(A1)')
+        rows = list(csv.DictReader(StringIO(''.join(exports.stream('reports', {'status': 'critical'}, exports.CSV)))))
+        self.assertEqual((rows[0]['diagnosis'], rows[0]['recommendations'], rows[0]['patient_name']),
+                         ('\'=HYPERLINK("http://x")', "'-2+3", "'@SUM(A1)"))
+        # Numbers and JSON Lines are written as they are
+        self.assertEqual(exports.cell(-1.5, quote_formulas=True), -1.5)
+        rows = [json.loads(line) for line in exports.stream('reports', {'status': 'critical'}, exports.JSONL)]
+        self.assertEqual(rows[0]['diagnosis'], '=HYPERLINK("http://x")')
+
+    async def test_asgi_export_streams_asynchronously(self):
+        response = await self.async_client.get(reverse('export_data', args=['tests']), {'format': 'jsonl'})
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(len(body.splitlines()), 4)
+
+    def test_command_writes_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'tests.csv')
+        out = StringIO()
+        call_command('export_data', 'tests', '--published', 'false', '--output', path, stdout=out)
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([row['test_group'] for row in rows], [self.draft_group])
+        self.assertIn('Wrote', out.getvalue())
+
+        out = StringIO()
+        call_command('export_data', 'reports', '--format', 'jsonl', '--status', 'normal', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['report_id'], self.normal.report_id)
+
+
+class LoadDataTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        blood = TestCategory.objects.create(name='Blood Count')
+        lipids = TestCategory.objects.create(name='Lipid Profile')
+        TestType.objects.create(name='Hemoglobin', category=blood, unit='g/dL', normal_range_min=13.5, normal_range_max=17.5)
+        TestType.objects.create(name='Platelets', category=blood, unit='10^3/uL', normal_range_min=150, normal_range_max=400)
+        TestType.objects.create(name='Cholesterol', category=lipids, unit='mg/dL', normal_range_min=0, normal_range_max=200)
+
+    def test_bulk_data_matches_the_save_path(self):
+        with CaptureQueriesContext(connection) as context:
+            stats = loadgen.generate(20, reports=2, groups=3, analytes=2, days=30, seed=7, batch_size=30)
+        self.assertEqual((stats.patients, stats.groups, stats.reports, stats.tests), (20, 60, 40, 120))
+        # Five patients per batch, one insert per table and batch
+        inserts = [sql for sql in data_queries(context) if 'INSERT INTO "reports_patienttest"' in sql]
+        self.assertEqual(len(inserts), 4)
+        inserts = [sql for sql in data_queries(context) if 'INSERT INTO "reports_testgroup"' in sql]
+        self.assertEqual(len(inserts), 4)
+
+        tests = list(PatientTest.objects.select_related('test_type'))
+        expected = classification.classify_tests(
+            [PatientTest(test_type=t.test_type, result_value=t.result_value) for t in tests]
+        )
+        self.assertEqual([t.status for t in tests], [t.status for t in expected])
+        self.assertEqual({t.status for t in tests}, {'normal', 'abnormal', 'critical'})
+        self.assertEqual(PatientTest.objects.filter(is_published=True, report=None).count(), 0)
+        self.assertEqual(PatientTest.objects.filter(is_published=False).count(), 40)
+        for report in MedicalReport.objects.prefetch_related('tests'):
+            self.assertEqual(report.status, services.overall_status(t.status for t in report.tests.all()))
+
+        stored = list(TestGroup.objects.order_by('code').values())
+        groups.rebuild()
+        self.assertEqual([{**g, 'id': None} for g in stored],
+                         [{**g, 'id': None} for g in TestGroup.objects.order_by('code').values()])
+        self.assertEqual(counters.reconcile(), {})
+        report = MedicalReport.objects.first()
+        self.assertEqual(search.rank_reports(report.report_id), [report])
+
+        # The sequences continue after the generated IDs
+        patient = Patient.objects.first()
+        self.assertEqual(services.create_test_group(patient, [TestType.objects.first().id])[0], 'GRP-0061')
+        self.assertEqual(MedicalReport.objects.create(patient=patient).report_id, 'REP-041')
+
+    def test_seed_and_command(self):
+        loadgen.generate(3, seed=1, analytes=2)
+        first = list(PatientTest.objects.order_by('test_id').values_list('test_type', 'result_value'))
+        PatientTest.objects.all().delete()
+        Patient.objects.all().delete()
+        loadgen.generate(3, seed=1, analytes=2)
+        self.assertEqual(list(PatientTest.objects.order_by('test_id').values_list('test_type', 'result_value')), first)
+
+        out = StringIO()
+        call_command('generate_load_data', patients=4, analytes=1, status_mix='0:0:1', stdout=out)
+        self.assertIn('Created 4 patients, 8 test groups, 4 reports and 8 tests', out.getvalue())
+        # Numbered after the patients generated before
+        self.assertEqual(Patient.objects.order_by('-contact_number').first().contact_number, 'LOAD-0000000007')
+        self.assertFalse(PatientTest.objects.filter(patient__contact_number__gt='LOAD-0000000003', status='normal').exists())
+        with self.assertRaises(CommandError):
+            call_command('generate_load_data', patients=1, analytes=4, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('generate_load_data', patients=1, status_mix='1:2', stdout=StringIO())
+
+
+class AIJobTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        self.report = make_published_report(hemoglobin=12)
+
+    def test_request_only_queues_a_job(self):
+        with mock.patch.object(ai, 'complete', side_effect=AssertionError('called in the request')):
+            response = self.client.post(reverse('generate_ai_report', args=[self.report.report_id]))
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        job = AIJob.objects.get()
+        self.assertEqual((data['job_id'], data['status']), (job.pk, 'queued'))
+        self.assertEqual(data['status_url'], reverse('ai_job_status', args=[job.pk]))
+
+        # A second click while the job is pending doesn't queue another one
+        self.client.post(reverse('generate_ai_report', args=[self.report.report_id]))
+        self.assertEqual(AIJob.objects.count(), 1)
+
+    def test_worker_runs_job_and_status_reports_result(self):
+        job = jobs.enqueue(self.report)
+        with mock.patch.object(ai, 'complete', return_value=AI_ANSWER) as complete:
+            claimed = jobs.claim('test-worker')
+            self.assertIsNone(jobs.claim('other-worker'))
+            jobs.run(claimed)
+        self.assertIn('Hemoglobin: 12.0 g/dL', complete.call_args[0][0])
+
+        data = self.client.get(reverse('ai_job_status', args=[job.pk])).json()
+        self.assertEqual((data['status'], data['attempts'], data['report_status']), ('succeeded', 1, 'at_risk'))
+        self.assertEqual(data['diagnosis'], '<h4></h4><p>Mild anemia.</p><h4>')
+        self.report.refresh_from_db()
+        self.assertTrue(self.report.ai_generated)
+        self.assertTrue(self.report.recommendations.startswith('<h4>Medical Recommendations</h4>'))
+
+    @override_settings(AI_RULES_FALLBACK=False)
+    def test_failures_are_retried_with_backoff_then_fail(self):
+        job = jobs.enqueue(self.report)
+        with mock.patch.object(ai, 'complete', side_effect=RuntimeError('rate limited')):
+            before = timezone.now()
+            jobs.run(jobs.claim())
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.last_error), ('queued', 1, 'rate limited'))
+            self.assertGreaterEqual(job.run_after, before + timedelta(seconds=jobs.RETRY_DELAY))
+            self.assertIsNone(jobs.claim())
+
+            for attempt in (2, 3):
+                AIJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+                jobs.run(jobs.claim())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        self.assertEqual([jobs.retry_delay(n).seconds for n in (1, 2, 3, 10)], [5, 10, 20, jobs.RETRY_MAX_DELAY])
+
+    def test_last_failure_falls_back_to_rules(self):
+        job = jobs.enqueue(self.report)
+        with mock.patch.object(ai, 'complete', side_effect=RuntimeError('service unavailable')):
+            for attempt in range(job.max_attempts):
+                AIJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+                jobs.run(jobs.claim())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.last_error, 'Model unavailable, used the rule-based summary: service unavailable')
+        self.report.refresh_from_db()
+        self.assertTrue(self.report.ai_generated)
+        self.assertIn('Abnormal findings', self.report.diagnosis)
+
+    def test_abandoned_jobs_are_requeued(self):
+        job = jobs.enqueue(self.report)
+        jobs.claim()
+        AIJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.recover_stale(), (1, 0))
+        self.assertEqual(jobs.claim().pk, job.pk)
+
+
+class AIStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.async_client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        self.report = make_published_report(hemoglobin=12)
+        self.url = reverse('stream_ai_report', args=[self.report.report_id])
+
+    async def stream_events(self):
+        response = await self.async_client.post(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = []
+        for block in body.strip().split('\n\n'):
+            event, data = block.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    async def test_answer_streams_then_is_saved(self):
+        async def chunks(prompt):
+            for start in range(0, len(AI_ANSWER), 20):
+                yield AI_ANSWER[start:start + 20]
+
+        with mock.patch.object(ai, 'stream_complete', side_effect=chunks):
+            events = await self.stream_events()
+        names = [name for name, _ in events]
+        self.assertEqual((names[0], names[-1]), ('start', 'done'))
+        self.assertEqual(''.join(data for name, data in events if name == 'token'), AI_ANSWER)
+        self.assertEqual(events[-1][1]['report_status'], 'at_risk')
+
+        report = await MedicalReport.objects.aget(pk=self.report.pk)
+        self.assertTrue(report.ai_generated)
+        self.assertEqual((report.diagnosis, report.recommendations), ai.split_response(AI_ANSWER))
+
+        # The complete answer was cached, a repeat is sent in one piece without calling the model
+        with mock.patch.object(ai, 'stream_complete', side_effect=AssertionError('model called')):
+            events = await self.stream_events()
+        self.assertEqual([name for name, _ in events], ['start', 'token', 'done'])
+
+    async def test_failed_stream_reports_error_and_saves_nothing(self):
+        async def chunks(prompt):
+            yield AI_ANSWER[:20]
+            raise RuntimeError('connection reset')
+
+        with mock.patch.object(ai, 'stream_complete', side_effect=chunks):
+            events = await self.stream_events()
+        self.assertEqual(events[-1], ('error', {'error': 'AI generation failed: connection reset'}))
+        report = await MedicalReport.objects.aget(pk=self.report.pk)
+        self.assertFalse(report.ai_generated)
+        self.assertEqual(await AIAnalysisCache.objects.acount(), 0)
+
+    async def test_backend_errors_fall_back_but_bugs_are_raised(self):
+        async def failing(prompt):
+            raise OpenAIError('service unavailable')
+            yield
+
+        with mock.patch.object(ai, 'stream_complete', side_effect=failing):
+            events = await self.stream_events()
+        self.assertEqual(events[-1][1]['source'], 'rules')
+
+        await MedicalReport.objects.filter(pk=self.report.pk).aupdate(ai_generated=False)
+        with mock.patch.object(ai, 'stream_complete', side_effect=TypeError('bug')):
+            with self.assertRaises(TypeError):
+                await self.stream_events()
+
+    async def test_slow_model_falls_back_to_rules(self):
+        async def chunks(prompt):
+            await asyncio.sleep(5)
+            yield AI_ANSWER
+
+        with self.settings(AI_FIRST_TOKEN_TIMEOUT=0.05), mock.patch.object(ai, 'stream_complete', side_effect=chunks):
+            events = await self.stream_events()
+        self.assertEqual([name for name, _ in events], ['start', 'token', 'done'])
+        self.assertEqual(events[-1][1]['source'], 'rules')
+        report = await MedicalReport.objects.aget(pk=self.report.pk)
+        self.assertEqual(events[1][1], report.diagnosis + report.recommendations)
+        self.assertEqual(await AIAnalysisCache.objects.acount(), 0)
+
+    def test_requires_staff_login(self):
+        response = self.client.post(self.url)
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+
+class AIAnalysisCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_identical_panels_share_one_model_call(self):
+        first = make_published_report(hemoglobin=12)
+        second = make_published_report(hemoglobin=12, contact_number='9000000001')
+        other = make_published_report(hemoglobin=20, contact_number='9000000002')
+        with mock.patch.object(ai, 'complete', return_value=AI_ANSWER) as complete:
+            for report in (first, second, other):
+                ai.generate(report)
+        self.assertEqual(complete.call_count, 2)
+        second.refresh_from_db()
+        self.assertEqual(second.recommendations, ai.split_response(AI_ANSWER)[1])
+        self.assertEqual(ai_cache.stats(), {'hits': 1, 'misses': 2, 'entries': 2})
+        self.assertNotIn('9876543210', complete.call_args_list[0][0][0])
+
+    def test_key_covers_model_parameters(self):
+        messages = ai.messages_for('prompt')
+        self.assertEqual(ai_cache.cache_key(messages, model='gpt-4o', temperature=0.3),
+                         ai_cache.cache_key(messages, temperature=0.3, model='gpt-4o'))
+        self.assertNotEqual(ai_cache.cache_key(messages, model='gpt-4o', temperature=0.3),
+                            ai_cache.cache_key(messages, model='gpt-4o', temperature=0.7))
+
+    def test_expired_entries_are_not_used(self):
+        ai_cache.put('a' * 64, 'old answer', 'gpt-4o')
+        with override_settings(AI_CACHE_TTL=60):
+            AIAnalysisCache.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+            self.assertIsNone(ai_cache.get('a' * 64))
+            ai_cache.put('a' * 64, 'new answer', 'gpt-4o')
+            self.assertEqual(ai_cache.get('a' * 64), 'new answer')
+
+    def test_least_recently_used_entries_are_evicted(self):
+        with override_settings(AI_CACHE_MAX_ENTRIES=2):
+            ai_cache.put('a' * 64, 'a', 'gpt-4o')
+            ai_cache.put('b' * 64, 'b', 'gpt-4o')
+            AIAnalysisCache.objects.update(last_used_at=timezone.now() - timedelta(minutes=1))
+            ai_cache.get('a' * 64)
+            ai_cache.put('c' * 64, 'c', 'gpt-4o')
+        self.assertEqual(sorted(AIAnalysisCache.objects.values_list('answer', flat=True)), ['a', 'c'])
+        self.assertEqual(AIAnalysisCache.objects.get(answer='a').hits, 1)
+
+    def test_long_backend_identity_is_stored(self):
+        backend = llm.OpenAIBackend('key', 'meta-llama/Meta-Llama-3.1-70B-Instruct',
+                                    base_url='http://llm-gateway.internal.example.org:8000/v1')
+        self.assertGreater(len(backend.identity), 50)
+        ai_cache.put('a' * 64, 'answer', backend.identity)
+        self.assertEqual(AIAnalysisCache.objects.get().model, backend.identity)
+        ai_cache.put('b' * 64, 'answer', 'x' * 300)
+        self.assertEqual(len(AIAnalysisCache.objects.get(key='b' * 64).model), 255)
+
+class AIWorkerCommandTests(TransactionTestCase):
+    def test_worker_pool_drains_queue(self):
+        for i in range(6):
+            jobs.enqueue(make_published_report(contact_number=f'90000000{i:02d}'))
+        out = StringIO()
+        with mock.patch.object(ai, 'complete', return_value=AI_ANSWER):
+            call_command('run_ai_worker', threads=3, once=True, stdout=out)
+        self.assertEqual(set(AIJob.objects.values_list('status', flat=True)), {'succeeded'})
+        self.assertEqual(MedicalReport.objects.filter(ai_generated=True).count(), 6)
+        self.assertEqual(out.getvalue().count(': generated'), 6)
+
+    def test_running_worker_recovers_abandoned_jobs(self):
+        job = jobs.enqueue(make_published_report())
+        AIJob.objects.filter(pk=job.pk).update(status=AIJob.RUNNING, locked_by='dead-worker', attempts=1,
+                                               started_at=timezone.now() - timedelta(hours=1))
+        with mock.patch.object(ai, 'complete', return_value=AI_ANSWER):
+            jobs.work(threading.Event(), once=True, recover_interval=0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('succeeded', 2))
+
+
+class FakeOpenAIServer:
+    """OpenAI-compatible chat completions endpoint on localhost, recording the prompts it answers"""
+
+    def __init__(self, answer=AI_ANSWER, fail_when=None):
+        self.prompts = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                prompt = body['messages'][-1]['content']
+                server.prompts.append(prompt)
+                if body.get('stream'):
+                    return self.stream(body)
+                if fail_when and fail_when in prompt:
+                    status, payload = 400, {'error': {'message': 'rejected', 'type': 'invalid_request_error'}}
+                else:
+                    status, payload = 200, {
+                        'id': 'chatcmpl-test', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': answer}}],
+                        'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+                    }
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def stream(self, body):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                for start in range(0, len(answer), 20):
+                    chunk = {
+                        'id': 'chatcmpl-test', 'object': 'chat.completion.chunk', 'created': 0, 'model': body['model'],
+                        'choices': [{'index': 0, 'delta': {'content': answer[start:start + 20]}, 'finish_reason': None}],
+                    }
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+                self.wfile.write(b'data: [DONE]\n\n')
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f'http://127.0.0.1:{self.httpd.server_address[1]}/v1'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@override_settings(OPENAI_API_KEY='test-key')
+class BulkAIGenerationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reports = [
+            make_published_report(hemoglobin=12, contact_number='9000000001'),
+            make_published_report(hemoglobin=12, contact_number='9000000002'),
+            make_published_report(hemoglobin=20, contact_number='9000000003'),
+            make_published_report(hemoglobin=15, contact_number='9000000004'),
+        ]
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.checkpoint = os.path.join(directory, 'checkpoint.json')
+
+    def bulk_generate(self, server, *args, **options):
+        out = StringIO()
+        call_command('bulk_generate_ai', *args, base_url=server.base_url, checkpoint=self.checkpoint,
+                     stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def test_generates_filtered_reports_in_batches(self):
+        with FakeOpenAIServer() as server:
+            with CaptureQueriesContext(connection) as context:
+                out = self.bulk_generate(server, '--filter', 'status=at_risk', batch_size=10, concurrency=4)
+        # The two identical panels share one model call
+        self.assertEqual(len(server.prompts), 2)
+        self.assertIn('Generated 3 report(s)', out)
+        self.assertEqual(sum(1 for sql in data_queries(context) if sql.startswith('UPDATE "reports_medicalreport"')), 1)
+
+        generated = MedicalReport.objects.filter(pk__in=[r.pk for r in self.reports[:3]])
+        self.assertEqual(set(generated.values_list('ai_generated', 'revision')), {(True, 2)})
+        self.assertFalse(MedicalReport.objects.get(pk=self.reports[3].pk).ai_generated)
+        self.assertEqual(generated.get(pk=self.reports[0].pk).diagnosis, ai.split_response(AI_ANSWER)[0])
+        self.assertEqual(counters.snapshot(), counters.compute())
+
+    def test_failed_calls_are_recorded_and_left_unsaved(self):
+        with FakeOpenAIServer(fail_when='20.0') as server:
+            out = self.bulk_generate(server, batch_size=2)
+        self.assertIn('1 failed', out)
+        self.assertEqual(MedicalReport.objects.filter(ai_generated=True).count(), 3)
+        with open(self.checkpoint) as f:
+            progress = json.load(f)
+        self.assertEqual(list(progress['failed']), [self.reports[2].report_id])
+        self.assertEqual(progress['last_id'], self.reports[3].pk)
+
+    def test_resume_skips_finished_batches(self):
+        checkpoint = bulk_ai.Checkpoint(self.checkpoint, {'ai_generated': 'False'})
+        checkpoint.last_id = self.reports[1].pk
+        checkpoint.save()
+        with FakeOpenAIServer() as server:
+            out = self.bulk_generate(server, '--filter', 'ai_generated=False', batch_size=1, resume=True)
+            self.assertIn(f'Resuming after report pk {self.reports[1].pk}', out)
+            # The normal panel of the last report is summarised by the rules
+            self.assertEqual(len(server.prompts), 1)
+            with self.assertRaises(CommandError):
+                self.bulk_generate(server, '--filter', 'status=normal', resume=True)
+        self.assertEqual(list(MedicalReport.objects.filter(ai_generated=True).order_by('pk').values_list('pk', flat=True)),
+                         [r.pk for r in self.reports[2:]])
+
+    def test_rate_limiter_waits_for_both_buckets(self):
+        now = [0.0]
+        limiter = bulk_ai.RateLimiter(requests_per_minute=60, tokens_per_minute=600, clock=lambda: now[0])
+        self.assertEqual(limiter.requests.wait_time(1), 0)
+        limiter.requests.take(60)
+        limiter.tokens.take(300)
+        self.assertEqual(limiter.requests.wait_time(1), 1)
+        self.assertEqual(limiter.tokens.wait_time(400), 10)
+        now[0] = 5
+        self.assertEqual(limiter.requests.wait_time(1), 0)
+        self.assertEqual(limiter.tokens.wait_time(400), 5)
+        # A call larger than the whole budget waits for a full bucket instead of forever
+        self.assertEqual(limiter.tokens.wait_time(10000), 25)
+
+    def test_admin_action_queues_selected_reports(self):
+        admin_user = User.objects.create_superuser(username='admin', password='secret', email='admin@example.com')
+        self.client.force_login(admin_user)
+        jobs.enqueue(self.reports[0])
+        response = self.client.post(reverse('admin:reports_medicalreport_changelist'), {
+            'action': 'queue_ai_generation',
+            '_selected_action': [r.pk for r in self.reports],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(AIJob.objects.count(), 4)
+        self.assertEqual(set(AIJob.objects.values_list('created_by', flat=True)), {None, admin_user.pk})
+
+
+class LLMBackendTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def collect(self, chunks):
+        async def read():
+            return [chunk async for chunk in chunks]
+        return asyncio.run(read())
+
+    def test_compatible_backend_reuses_one_client(self):
+        with FakeOpenAIServer() as server, override_settings(AI_BACKEND='openai_compatible', AI_BASE_URL=server.base_url):
+            backend = llm.backend()
+            self.assertEqual(ai.complete('first'), AI_ANSWER)
+            client = backend.client
+            self.assertEqual(ai.complete('second'), AI_ANSWER)
+            self.assertIs(llm.backend(), backend)
+            self.assertIs(backend.client, client)
+            self.assertEqual(server.prompts, ['first', 'second'])
+
+            chunks = self.collect(ai.stream_complete('third'))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), AI_ANSWER)
+
+    @override_settings(AI_BACKEND='local', AI_LOCAL_LATENCY=0, AI_LOCAL_CHUNK_DELAY=0)
+    def test_local_backend_answers_deterministically(self):
+        report = make_published_report(hemoglobin=12)
+        ai.generate(report)
+        self.assertIn('<strong>Blood Count - Hemoglobin</strong>: 12.0 g/dL (abnormal)', report.diagnosis)
+        self.assertIn('repeat them in 4-6 weeks', report.recommendations)
+        self.assertEqual(report.status, 'at_risk')
+
+        prompt = ai.build_prompt(report, ai.report_tests(report))
+        self.assertEqual(ai.complete(prompt), ai.complete(prompt))
+        self.assertEqual(''.join(self.collect(ai.stream_complete(prompt))), ai.complete(prompt))
+        # Answers of the local backend are cached apart from the real model's
+        self.assertEqual(AIAnalysisCache.objects.get().model, 'local')
+
+    def test_local_backend_simulates_latency(self):
+        backend = llm.LocalBackend(latency=0.05)
+        start = time.perf_counter()
+        backend.complete(ai.messages_for('prompt'), ai.TEMPERATURE, ai.MAX_TOKENS)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+
+    def test_incomplete_backend_fails_at_construction(self):
+        class CompleteOnly(llm.Backend):
+            def complete(self, messages, temperature, max_tokens):
+                return ''
+
+        with self.assertRaisesRegex(TypeError, 'acomplete'):
+            CompleteOnly()
+
+    def test_misconfigured_backend_is_rejected(self):
+        with override_settings(AI_BACKEND='other'), self.assertRaises(ImproperlyConfigured):
+            llm.backend()
+        with override_settings(AI_BACKEND='openai_compatible', AI_BASE_URL=''), self.assertRaises(ImproperlyConfigured):
+            llm.backend()
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans are checked with SQLite EXPLAIN QUERY PLAN')
+class QueryPlanTests(TestCase):
+    """Fail when a hot page query falls back to a full scan of one of the large tables"""
+
+    LARGE_TABLES = ('reports_patient', 'reports_medicalreport', 'reports_patienttest', 'reports_testgroup')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username='labtech', password='secret'))
+        category = TestCategory.objects.create(name='Blood Count')
+        test_type = TestType.objects.create(name='Hemoglobin', category=category, unit='g/dL',
+                                            normal_range_min=13.5, normal_range_max=17.5)
+        self.patient = Patient.objects.create(name='John Doe', age=45, gender='male', contact_number='9876543210',
+                                              user=User.objects.create_user(username='9876543210', password='x'))
+        code, _ = services.create_test_group(self.patient, [test_type.id], 15)
+        self.report, = services.publish_test_groups([code])
+        services.create_test_group(self.patient, [test_type.id], 15)
+
+    def full_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        return [line for line in plan
+                if line.startswith('SCAN ') and line.split()[1] in self.LARGE_TABLES and 'USING' not in line]
+
+    def assertIndexed(self, url, client=None):
+        with CaptureQueriesContext(connection) as context:
+            response = (client or self.client).get(url)
+        self.assertEqual(response.status_code, 200)
+        for sql in data_queries(context):
+            if sql.startswith('SELECT'):
+                self.assertEqual(self.full_scans(sql), [], sql)
+        return response
+
+    def test_dashboard(self):
+        self.assertIndexed(reverse('dashboard'))
+
+    def test_patients_list(self):
+        self.assertIndexed(reverse('patients'))
+        with CaptureQueriesContext(connection) as context:
+            response = self.assertIndexed(reverse('patients') + '?search=john')
+        self.assertTrue(any('reports_patient_search MATCH' in sql for sql in data_queries(context)))
+        self.assertEqual(list(response.context['patients']), [self.patient])
+        response = self.assertIndexed(reverse('patients') + '?search=nobody')
+        self.assertEqual(list(response.context['patients']), [])
+
+    def test_reports_list(self):
+        self.assertIndexed(reverse('reports'))
+        self.assertIndexed(reverse('reports') + '?status=normal')
+        with CaptureQueriesContext(connection) as context:
+            response = self.assertIndexed(reverse('reports') + '?search=john')
+        self.assertTrue(any('reports_report_search MATCH' in sql for sql in data_queries(context)))
+        self.assertEqual(list(response.context['reports']), [self.report])
+        response = self.assertIndexed(reverse('reports') + '?search=nobody')
+        self.assertEqual(list(response.context['reports']), [])
+
+    def test_tests_list(self):
+        self.assertIndexed(reverse('tests'))
+
+    def test_ai_analysis(self):
+        self.assertIndexed(reverse('ai_analysis'))
+
+    def test_report_detail(self):
+        self.assertIndexed(reverse('report_detail', args=[self.report.report_id]))
+
+    def test_test_group_lookup(self):
+        self.assertIndexed(reverse('get_test_group') + f'?test_group={self.report.test_groups.get().code}')
+
+    def test_patient_portal(self):
+        self.client.force_login(self.patient.user)
+        self.assertIndexed(reverse('patient_portal'))
+        self.assertIndexed(reverse('patient_report_detail', args=[self.report.report_id]))
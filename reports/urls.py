@@ -9,11 +9,15 @@ urlpatterns = [
     path('add-patient/', views.add_patient, name='add_patient'),
     path('edit-patient/', views.edit_patient, name='edit_patient'),
     path('reports/', views.reports_view, name='reports'),
+    path('search/', views.search_view, name='search'),
     path('add-report/', views.add_report, name='add_report'),
     path('reports/<str:report_id>/', views.report_detail, name='report_detail'),
+    path('reports/<str:report_id>/pdf/', views.report_pdf, name='report_pdf'),
     path('ai-analysis/', views.ai_analysis_view, name='ai_analysis'),
+    path('export/<str:dataset>/', views.export_data, name='export_data'),
     path('tests/', views.tests_view, name='tests'),
     path('add-test/', views.add_test, name='add_test'),
+    path('import-results/', views.import_results, name='import_results'),
     path('get-test-group/', views.get_test_group, name='get_test_group'),
     path('update-test-group/', views.update_test_group, name='update_test_group'),
     path('update-test/', views.update_test, name='update_test'),
@@ -25,10 +29,13 @@ urlpatterns = [
     path('delete-patient/<int:patient_id>/', views.delete_patient, name='delete_patient'),
     path('bulk-delete-patients/', views.bulk_delete_patients, name='bulk_delete_patients'),
     path('generate-ai-report/<str:report_id>/', views.generate_ai_report, name='generate_ai_report'),
+    path('generate-ai-report/<str:report_id>/stream/', views.stream_ai_report, name='stream_ai_report'),
+    path('ai-jobs/<int:job_id>/', views.ai_job_status, name='ai_job_status'),
     path('settings/', views.settings_view, name='settings'),
     
     # Patient Portal URLs
     path('patient/logout/', views.patient_logout_view, name='patient_logout'),
     path('patient/portal/', views.patient_portal, name='patient_portal'),
     path('patient/reports/<str:report_id>/', views.patient_report_detail, name='patient_report_detail'),
+    path('patient/reports/<str:report_id>/pdf/', views.patient_report_pdf, name='patient_report_pdf'),
 ]
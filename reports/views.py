@@ -1,20 +1,29 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Count, Q
-from django.http import JsonResponse, HttpResponse
-from django.utils import timezone
-from .models import Patient, MedicalReport, TestCategory, TestType, PatientTest, LabSettings
-from .forms import PatientForm, MedicalReportForm
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.utils.safestring import mark_safe
+from .models import Patient, MedicalReport, TestCategory, PatientTest, TestGroup, LabSettings, AIJob
+from .forms import PatientForm
+from . import ai, caching, counters, exports, filters, importer, jobs, llm, pagination, pdf, search, services
 from django.conf import settings as django_settings
 from django.contrib.auth.models import User
+from asgiref.sync import sync_to_async
+import asyncio
+import hashlib
+import json
 import random
-import os
-import re
 import string
+from collections import defaultdict
 from functools import wraps
-from openai import OpenAI
 
 
 def admin_required(view_func):
@@ -30,6 +39,19 @@ def admin_required(view_func):
         return view_func(request, *args, **kwargs)
     return wrapper
 
+
+def async_admin_required(view_func):
+    """admin_required for async views, checking the user off the event loop"""
+    check = sync_to_async(admin_required(lambda request, *args, **kwargs: None))
+
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        denied = await check(request, *args, **kwargs)
+        if denied is not None:
+            return denied
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
 def login_view(request):
     if request.user.is_authenticated:
         # Check if user is a patient and redirect to patient portal
@@ -60,26 +82,27 @@ def logout_view(request):
 @login_required
 @admin_required
 def dashboard(request):
-    total_patients = Patient.objects.count()
-    total_reports = MedicalReport.objects.count()
-    pending_requests = MedicalReport.objects.filter(status='at_risk').count()
-    ai_generated = MedicalReport.objects.filter(ai_generated=True).count()
+    # The page data only changes on writes, so it is cached per data version
+    context = caching.cached_context('dashboard', dashboard_context)
+    return render(request, 'dashboard.html', context)
+
+
+def dashboard_context():
+    """Data shown on the dashboard"""
+    # Totals come from the materialized counters, one query for all of them
+    totals = counters.snapshot()
+    total_patients = totals[counters.PATIENTS]
+    total_reports = totals[counters.REPORTS]
+    pending_requests = totals[counters.status_counter('at_risk')]
+    ai_generated = totals[counters.AI_GENERATED]
     
     # Recent patients with their latest report
-    recent_reports = MedicalReport.objects.select_related('patient').order_by('-date_created')[:5]
+    recent_reports = list(MedicalReport.objects.select_related('patient').order_by('-date_created')[:5])
     
     # AI Analysis data
-    status_counts = MedicalReport.objects.values('status').annotate(count=Count('id'))
-    analysis_data = {
-        'normal': 0,
-        'at_risk': 0,
-        'critical': 0
-    }
-    for item in status_counts:
-        if item['status'] in analysis_data:
-            analysis_data[item['status']] = item['count']
+    analysis_data = {status: totals[counters.status_counter(status)] for status in counters.STATUSES}
     
-    context = {
+    return {
         'total_patients': total_patients,
         'total_reports': total_reports,
         'pending_requests': pending_requests,
@@ -87,24 +110,32 @@ def dashboard(request):
         'recent_reports': recent_reports,
         'analysis_data': analysis_data,
     }
-    return render(request, 'dashboard.html', context)
+
 
 @login_required
 @admin_required
 def patients_view(request):
-    patients = Patient.objects.all()
+    # Report summary per patient is computed in the list query, not one COUNT per row
+    latest_report = MedicalReport.objects.filter(patient=OuterRef('pk')).order_by('-date_created', '-id')
+    patients = Patient.objects.annotate(
+        report_count=Count('reports'),
+        latest_report_date=Subquery(latest_report.values('date_created')[:1]),
+        latest_report_status=Subquery(latest_report.values('status')[:1]),
+    )
     
     # Search functionality
     search_query = request.GET.get('search', '')
     if search_query:
-        patients = patients.filter(
-            Q(name__icontains=search_query) | 
-            Q(contact_number__icontains=search_query)
-        )
+        patients = search.filter_patients(patients, search_query)
+    
+    # Keyset pagination, newest first
+    page = pagination.paginate(patients, 'created_at', request.GET.get('cursor'))
     
     context = {
-        'patients': patients,
+        'patients': page,
+        'page': page,
         'search_query': search_query,
+        **pagination.page_links(request, page),
     }
     return render(request, 'patients.html', context)
 
@@ -179,56 +210,142 @@ def add_patient(request):
 @login_required
 @admin_required
 def reports_view(request):
-    reports = MedicalReport.objects.select_related('patient').all()
-    
-    # Filter by status
+    # Status and search filters, shared with the export
     status_filter = request.GET.get('status', '')
-    if status_filter:
-        reports = reports.filter(status=status_filter)
-    
-    # Search functionality
     search_query = request.GET.get('search', '')
-    if search_query:
-        reports = reports.filter(
-            Q(report_id__icontains=search_query) | 
-            Q(patient__name__icontains=search_query)
-        )
+    reports = filters.reports(MedicalReport.objects.select_related('patient'), request.GET)
     
-    # Get all patients for the add report modal
-    all_patients = Patient.objects.all()
+    # Keyset pagination, newest first
+    page = pagination.paginate(reports, 'date_created', request.GET.get('cursor'))
     
     context = {
-        'reports': reports,
+        'reports': page,
+        'page': page,
         'status_filter': status_filter,
         'search_query': search_query,
-        'all_patients': all_patients,
+        **pagination.page_links(request, page),
     }
     return render(request, 'reports.html', context)
 
 @login_required
 @admin_required
-def report_detail(request, report_id):
-    report = get_object_or_404(MedicalReport, report_id=report_id)
-    lab_settings = LabSettings.get_settings()
+def export_data(request, dataset):
+    """Stream reports or test results as CSV or JSON Lines, filtered like their list pages"""
+    fmt = request.GET.get('format', exports.CSV)
+    if dataset not in exports.DATASETS or fmt not in exports.FORMATS:
+        return JsonResponse({'success': False, 'error': 'Unknown export'}, status=404)
     
-    # Get published test groups for THIS SPECIFIC REPORT
-    from collections import defaultdict
-    all_tests = PatientTest.objects.filter(
-        report=report,
-        is_published=True
-    ).select_related('test_type', 'test_type__category').order_by('-test_date', 'test_group')
+    content = exports.stream(dataset, request.GET, fmt)
+    if isinstance(request, ASGIRequest):
+        content = exports.aiterate(content)
+    response = StreamingHttpResponse(content, content_type=f'{exports.FORMATS[fmt]}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{exports.filename(dataset, fmt)}"'
+    return response
+
+
+@login_required
+@admin_required
+def search_view(request):
+    """Ranked patient and report matches for a search box"""
+    query = request.GET.get('q', '')
+    
+    patients = [{
+        'id': patient.id,
+        'name': patient.name,
+        'age': patient.age,
+        'gender': patient.gender,
+        'contact_number': patient.contact_number,
+    } for patient in search.rank_patients(query)]
+    
+    reports = [{
+        'report_id': report.report_id,
+        'patient_name': report.patient.name,
+        'status': report.status,
+        'url': reverse('report_detail', args=[report.report_id]),
+    } for report in search.rank_reports(query)]
+    
+    return JsonResponse({'success': True, 'query': query, 'patients': patients, 'reports': reports})
+
+def render_report_detail(request, report, is_patient_view=False):
+    """Report page whose body is cached per report revision and lab settings version.
+    
+    The response carries an ETag, so repeat views are answered with 304 Not
+    Modified until the report, the lab settings or the test catalog change.
+    There is no Last-Modified: catalog edits change the body but have no
+    timestamp, so a date-only revalidation could get a stale 304.
+    """
+    lab_settings = LabSettings.get_settings()
+    settings_version = caching.settings_version()
+    
+    # The page embeds the CSRF token, so a rotated CSRF secret must not match an old ETag
+    get_token(request)
+    csrf_hash = hashlib.sha256(request.META['CSRF_COOKIE'].encode()).hexdigest()[:16]
+    etag = quote_etag(
+        f"{report.pk}-{report.revision}-{settings_version}-{'patient' if is_patient_view else 'staff'}-{csrf_hash}"
+    )
+    
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        def build_body():
+            # Get published test groups for THIS SPECIFIC REPORT
+            all_tests = PatientTest.objects.filter(
+                report=report,
+                is_published=True
+            ).select_related('test_type', 'test_type__category').order_by('-test_date', 'test_group')
+            
+            # Group tests by test_group
+            test_groups = defaultdict(list)
+            for test in all_tests:
+                test_groups[test.test_group].append(test)
+            
+            return render_to_string('report_body.html', {
+                'report': report,
+                'test_groups': list(test_groups.values()),
+                'lab_settings': lab_settings,
+            })
+        
+        context = {
+            'report': report,
+            'report_body': mark_safe(caching.cached_report_body(report, settings_version, build_body)),
+            'is_patient_view': is_patient_view,
+        }
+        response = render(request, 'report_detail.html', context)
     
-    # Group tests by test_group
-    test_groups = defaultdict(list)
-    for test in all_tests:
-        test_groups[test.test_group].append(test)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+@admin_required
+def report_detail(request, report_id):
+    report = get_object_or_404(MedicalReport.objects.select_related('patient', 'created_by'), report_id=report_id)
+    return render_report_detail(request, report)
+
+
+def serve_report_pdf(report):
+    """Report PDF from the on-disk cache, converting it in the PDF worker pool on first download"""
+    lab_settings = LabSettings.get_settings()
+    try:
+        path = pdf.get_pdf(report, lab_settings, caching.settings_version(),
+                           timeout=getattr(django_settings, 'PDF_WAIT_TIMEOUT', 20))
+    except pdf.PdfError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
     
-    context = {
-        'report': report,
-        'test_groups': list(test_groups.values()),
-        'lab_settings': lab_settings,
-    }
-    return render(request, 'report_detail.html', context)
+    if path is None:
+        # Still converting, the client retries and gets the finished file from disk
+        response = JsonResponse({'success': True, 'status': 'pending'}, status=202)
+        response['Retry-After'] = '2'
+        return response
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{report.report_id}.pdf',
+                        content_type='application/pdf')
+
+
+@login_required
+@admin_required
+def report_pdf(request, report_id):
+    report = get_object_or_404(MedicalReport.objects.select_related('patient'), report_id=report_id)
+    return serve_report_pdf(report)
 
 
 @login_required
@@ -266,25 +383,24 @@ def add_report(request):
 @login_required
 @admin_required
 def ai_analysis_view(request):
-    # Get all reports with analysis
-    reports = MedicalReport.objects.select_related('patient').filter(ai_generated=True)
+    context = caching.cached_context('ai_analysis', ai_analysis_context)
+    return render(request, 'ai_analysis.html', context)
+
+
+def ai_analysis_context():
+    """Data shown on the AI analysis page"""
+    # Latest reports with analysis, the page lists ten of them
+    reports = list(MedicalReport.objects.select_related('patient').filter(ai_generated=True)[:10])
     
     # Status distribution
-    status_counts = MedicalReport.objects.values('status').annotate(count=Count('id'))
-    analysis_data = {
-        'normal': 0,
-        'at_risk': 0,
-        'critical': 0
-    }
-    for item in status_counts:
-        if item['status'] in analysis_data:
-            analysis_data[item['status']] = item['count']
+    totals = counters.snapshot()
+    analysis_data = {status: totals[counters.status_counter(status)] for status in counters.STATUSES}
     
-    context = {
+    return {
         'reports': reports,
+        'ai_report_count': totals[counters.AI_GENERATED],
         'analysis_data': analysis_data,
     }
-    return render(request, 'ai_analysis.html', context)
 
 
 @login_required
@@ -293,40 +409,35 @@ def tests_view(request):
     # Get all test categories with their test types
     categories = TestCategory.objects.prefetch_related('test_types').all()
     
-    # Get all patients for the dropdown
-    patients = Patient.objects.all()
-    
-    # Get all patient tests grouped by test_group
-    all_tests = PatientTest.objects.select_related('patient', 'test_type', 'test_type__category', 'report').order_by('-test_date', 'test_group')
-    
-    # Group tests by test_group
-    from collections import defaultdict
-    draft_groups = defaultdict(list)
-    published_groups = defaultdict(list)
-    
-    for test in all_tests:
-        if test.is_published:
-            published_groups[test.test_group].append(test)
-        else:
-            draft_groups[test.test_group].append(test)
-    
-    # Convert to list of groups (each group is a list of tests)
-    draft_test_groups = list(draft_groups.values())
-    published_test_groups = list(published_groups.values())
-    
-    # Test statistics
-    total_tests = len(draft_groups) + len(published_groups)  # Count test groups, not individual tests
-    draft_count = len(draft_groups)
-    published_count = len(published_groups)
-    
-    # Count status from published tests
-    published_tests = PatientTest.objects.filter(is_published=True)
-    abnormal_tests = published_tests.filter(status='abnormal').values('test_group').distinct().count()
-    critical_tests = published_tests.filter(status='critical').values('test_group').distinct().count()
+    # One keyset page of test groups, newest first
+    test_groups = TestGroup.objects.select_related('patient', 'report')
+    page = pagination.paginate(test_groups, 'test_date', request.GET.get('cursor'))
+    
+    # Analyte names of the groups on this page, in one query
+    analytes = defaultdict(list)
+    for test in PatientTest.objects.filter(test_group__in=[group.code for group in page]).select_related('test_type'):
+        analytes[test.test_group].append(test)
+    for group in page:
+        group.analytes = analytes[group.code]
+    
+    draft_test_groups = [group for group in page if not group.is_published]
+    published_test_groups = [group for group in page if group.is_published]
+    
+    # Test statistics, one row per group
+    stats = TestGroup.objects.aggregate(
+        draft_count=Count('id', filter=Q(is_published=False)),
+        published_count=Count('id', filter=Q(is_published=True)),
+        abnormal_tests=Count('id', filter=Q(is_published=True, abnormal_count__gt=0)),
+        critical_tests=Count('id', filter=Q(is_published=True, critical_count__gt=0)),
+    )
+    draft_count = stats['draft_count']
+    published_count = stats['published_count']
+    total_tests = draft_count + published_count  # Count test groups, not individual tests
+    abnormal_tests = stats['abnormal_tests']
+    critical_tests = stats['critical_tests']
     
     context = {
         'categories': categories,
-        'patients': patients,
         'draft_test_groups': draft_test_groups,
         'published_test_groups': published_test_groups,
         'total_tests': total_tests,
@@ -334,6 +445,8 @@ def tests_view(request):
         'published_count': published_count,
         'abnormal_tests': abnormal_tests,
         'critical_tests': critical_tests,
+        'page': page,
+        **pagination.page_links(request, page),
     }
     return render(request, 'tests.html', context)
 
@@ -349,28 +462,11 @@ def add_test(request):
         try:
             patient = Patient.objects.get(id=patient_id)
             
-            # Generate a unique test group ID for this batch of tests
-            last_test = PatientTest.objects.all().order_by('id').last()
-            if last_test:
-                last_num = int(last_test.test_id.split('-')[1])
-                test_group = f'GRP-{str(last_num + 1).zfill(4)}'
-            else:
-                test_group = 'GRP-0001'
-            
-            created_tests = []
-            for test_type_id in test_type_ids:
-                test_type = TestType.objects.get(id=test_type_id)
-                
-                test = PatientTest.objects.create(
-                    patient=patient,
-                    report=None,  # No report until published
-                    test_type=test_type,
-                    test_group=test_group,  # Assign same group ID
-                    result_value=float(result_value),
-                    is_published=False,
-                    created_by=request.user
-                )
-                created_tests.append(test.test_id)
+            # Create the whole group in one transaction with a single bulk insert
+            test_group, tests = services.create_test_group(
+                patient, test_type_ids, result_value, created_by=request.user
+            )
+            created_tests = [test.test_id for test in tests]
             
             messages.success(request, f'Test group created with {len(created_tests)} test type(s)!')
             return JsonResponse({'success': True, 'test_group': test_group, 'test_ids': created_tests})
@@ -380,6 +476,25 @@ def add_test(request):
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
 
+@login_required
+@admin_required
+def import_results(request):
+    """Import analyzer results from an uploaded CSV or HL7 file, read in fixed-size chunks"""
+    if request.method != 'POST' or 'file' not in request.FILES:
+        return JsonResponse({'success': False, 'error': 'Upload a CSV or HL7 file'})
+    
+    upload = request.FILES['file']
+    fmt = request.POST.get('format') or importer.detect_format(upload.name)
+    try:
+        stats = importer.import_results(
+            importer.read_lines(upload.chunks(importer.READ_SIZE)), fmt,
+            created_by=request.user, publish=request.POST.get('publish') == 'true'
+        )
+    except (importer.ResultsFileError, UnicodeDecodeError) as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+    return JsonResponse({'success': True, **stats.as_dict()})
+
+
 @login_required
 @admin_required
 def get_test_group(request):
@@ -426,13 +541,8 @@ def update_test_group(request):
         tests_data = data.get('tests', [])
         
         try:
-            updated_count = 0
-            for test_data in tests_data:
-                test = PatientTest.objects.get(test_id=test_data['test_id'])
-                test.result_value = float(test_data['result_value'])
-                test.notes = test_data.get('notes', '')
-                test.save()
-                updated_count += 1
+            # One fetch, one reclassification pass and one bulk_update for the whole group
+            updated_count = len(services.update_test_group(test_group, tests_data))
             
             messages.success(request, f'Updated {updated_count} test(s) successfully!')
             return JsonResponse({'success': True, 'count': updated_count})
@@ -451,10 +561,8 @@ def update_test(request):
         notes = request.POST.get('notes', '')
         
         try:
-            test = PatientTest.objects.get(test_id=test_id)
-            test.result_value = float(result_value)
-            test.notes = notes
-            test.save()
+            test = PatientTest.objects.select_related('test_type').get(test_id=test_id)
+            services.update_test_results([test], {test_id: {'result_value': result_value, 'notes': notes}})
             
             return JsonResponse({
                 'success': True, 
@@ -475,55 +583,8 @@ def publish_tests(request):
         test_groups = request.POST.getlist('test_groups[]')
         
         try:
-            for test_group in test_groups:
-                tests = PatientTest.objects.filter(test_group=test_group)
-                
-                if tests.exists():
-                    # Get the patient from the first test
-                    first_test = tests.first()
-                    patient = first_test.patient
-                    
-                    # Generate report ID
-                    last_report = MedicalReport.objects.all().order_by('id').last()
-                    if last_report:
-                        last_num = int(last_report.report_id.split('-')[1])
-                        report_id = f'REP-{str(last_num + 1).zfill(3)}'
-                    else:
-                        report_id = 'REP-001'
-                    
-                    # Collect test summary for report content
-                    test_summary = []
-                    for test in tests:
-                        test_summary.append(f"{test.test_type.name}: {test.result_value} {test.test_type.unit} ({test.status})")
-                    
-                    content = "Laboratory Test Report\\n\\n" + "\\n".join(test_summary)
-                    
-                    # Determine overall status based on test statuses
-                    if any(t.status == 'critical' for t in tests):
-                        overall_status = 'critical'
-                    elif any(t.status == 'abnormal' for t in tests):
-                        overall_status = 'at_risk'
-                    else:
-                        overall_status = 'normal'
-                    
-                    # Create new report
-                    report = MedicalReport.objects.create(
-                        report_id=report_id,
-                        patient=patient,
-                        content=content,
-                        diagnosis=f"Test Group {test_group} - {overall_status.upper()}",
-                        recommendations="Please review test results with a healthcare provider.",
-                        status=overall_status,
-                        ai_generated=False,
-                        created_by=request.user
-                    )
-                    
-                    # Link tests to the new report and publish them
-                    tests.update(
-                        report=report,
-                        is_published=True,
-                        published_date=timezone.now()
-                    )
+            # Load, build and link every selected group in one transaction
+            services.publish_test_groups(test_groups, created_by=request.user)
             
             messages.success(request, f'{len(test_groups)} test group(s) published with new report(s)!')
             return JsonResponse({'success': True, 'count': len(test_groups)})
@@ -540,9 +601,7 @@ def delete_test(request):
         test_group = request.POST.get('test_group')
         
         try:
-            tests = PatientTest.objects.filter(test_group=test_group)
-            count = tests.count()
-            tests.delete()
+            count = services.delete_test_groups([test_group])['tests']
             
             messages.success(request, f'Test group with {count} test(s) deleted successfully!')
             return JsonResponse({'success': True})
@@ -559,9 +618,7 @@ def bulk_delete_tests(request):
         test_groups = request.POST.getlist('test_groups[]')
         
         try:
-            tests = PatientTest.objects.filter(test_group__in=test_groups)
-            total_count = tests.count()
-            tests.delete()
+            total_count = services.delete_test_groups(test_groups)['tests']
             
             messages.success(request, f'{len(test_groups)} test group(s) ({total_count} tests) deleted successfully!')
             return JsonResponse({'success': True, 'count': len(test_groups)})
@@ -576,11 +633,9 @@ def bulk_delete_tests(request):
 def delete_report(request, report_id):
     if request.method == 'POST':
         try:
-            report = MedicalReport.objects.get(report_id=report_id)
-            # Delete associated tests first (cascade should handle this, but being explicit)
-            PatientTest.objects.filter(report=report).delete()
-            # Delete the report
-            report.delete()
+            # Delete the report together with its tests
+            if not services.delete_reports([report_id])['reports']:
+                raise MedicalReport.DoesNotExist
             messages.success(request, f'Report {report_id} deleted successfully!')
             return JsonResponse({'success': True})
         except MedicalReport.DoesNotExist:
@@ -598,11 +653,8 @@ def bulk_delete_reports(request):
         report_ids = request.POST.getlist('report_ids[]')
         
         try:
-            # Delete all associated tests first
-            for report_id in report_ids:
-                report = MedicalReport.objects.get(report_id=report_id)
-                PatientTest.objects.filter(report=report).delete()
-                report.delete()
+            # Delete all selected reports and their tests with set-based queries
+            services.delete_reports(report_ids)
             
             messages.success(request, f'{len(report_ids)} report(s) deleted successfully!')
             return JsonResponse({'success': True, 'count': len(report_ids)})
@@ -617,14 +669,9 @@ def bulk_delete_reports(request):
 def delete_patient(request, patient_id):
     if request.method == 'POST':
         try:
-            patient = Patient.objects.get(id=patient_id)
-            # Delete all reports and tests associated with this patient
-            reports = MedicalReport.objects.filter(patient=patient)
-            for report in reports:
-                PatientTest.objects.filter(report=report).delete()
-            reports.delete()
-            # Delete the patient
-            patient.delete()
+            # Delete the patient with all reports, tests and the portal login
+            if not services.delete_patients([patient_id])['patients']:
+                raise Patient.DoesNotExist
             messages.success(request, f'Patient deleted successfully!')
             return JsonResponse({'success': True})
         except Patient.DoesNotExist:
@@ -642,14 +689,8 @@ def bulk_delete_patients(request):
         patient_ids = request.POST.getlist('patient_ids[]')
         
         try:
-            for patient_id in patient_ids:
-                patient = Patient.objects.get(id=patient_id)
-                # Delete all reports and tests associated with this patient
-                reports = MedicalReport.objects.filter(patient=patient)
-                for report in reports:
-                    PatientTest.objects.filter(report=report).delete()
-                reports.delete()
-                patient.delete()
+            # Delete all selected patients with their reports, tests and portal logins
+            services.delete_patients(patient_ids)
             
             messages.success(request, f'{len(patient_ids)} patient(s) deleted successfully!')
             return JsonResponse({'success': True, 'count': len(patient_ids)})
@@ -665,117 +706,17 @@ def generate_ai_report(request, report_id):
     if request.method == 'POST':
         try:
             report = MedicalReport.objects.get(report_id=report_id)
+            if not report.tests.filter(is_published=True).exists():
+                return JsonResponse({'success': False, 'error': ai.NO_RESULTS}, status=400)
             
-            # Get all test results for this report
-            tests = PatientTest.objects.filter(report=report, is_published=True).select_related('test_type', 'test_type__category')
-            
-            # Build test results data for AI
-            test_data = []
-            critical_tests = []
-            abnormal_tests = []
-            
-            for test in tests:
-                test_info = {
-                    'category': test.test_type.category.name,
-                    'name': test.test_type.name,
-                    'value': test.result_value,
-                    'unit': test.test_type.unit,
-                    'normal_min': test.test_type.normal_range_min,
-                    'normal_max': test.test_type.normal_range_max,
-                    'status': test.status
-                }
-                test_data.append(test_info)
-                
-                if test.status == 'critical':
-                    critical_tests.append(test.test_type.name)
-                elif test.status == 'abnormal':
-                    abnormal_tests.append(test.test_type.name)
-            
-            # Prepare patient context
-            patient = report.patient
-            patient_context = f"""Patient Information:
-- Age: {patient.age}
-- Gender: {patient.gender}
-- Contact: {patient.contact_number}"""
-            
-            # Format test results for AI
-            test_results_text = "\n".join([
-                f"- {t['category']} - {t['name']}: {t['value']} {t['unit']} "
-                f"(Normal: {t['normal_min']}-{t['normal_max']}, Status: {t['status'].upper()}"
-                for t in test_data
-            ])
-            
-            # Initialize OpenAI client
-            client = OpenAI(api_key=django_settings.OPENAI_API_KEY)
-            
-            # Create AI prompt
-            prompt = f"""You are a medical AI assistant analyzing laboratory test results. 
-Provide a professional medical report in HTML format.
-
-{patient_context}
-
-Laboratory Test Results:
-{test_results_text}
-
-Please provide:
-1. **Clinical Assessment** (diagnosis section): Analyze the test results, identify critical, abnormal, and normal findings. Provide medical interpretation.
-2. **Medical Recommendations**: Specific recommendations based on the findings, including urgency of follow-up, lifestyle changes, and further tests if needed.
-
-Format your response in clean HTML with <h4>, <p>, <strong>, <ol>, <li> tags. Be professional and medically accurate.
-
-Separate the two sections clearly with the headers "Clinical Assessment" and "Medical Recommendations"."""
-
-            # Call OpenAI ChatGPT API
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a professional medical AI assistant that analyzes laboratory test results and provides clinical assessments and recommendations."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=2000
-            )
-            
-            # Extract AI response
-            ai_response = response.choices[0].message.content
-            
-            # Split response into diagnosis and recommendations
-            # Try to split by common patterns
-            if "Medical Recommendations" in ai_response:
-                parts = ai_response.split("Medical Recommendations")
-                diagnosis = parts[0].replace("Clinical Assessment", "").strip()
-                recommendations = "<h4>Medical Recommendations</h4>" + parts[1].strip()
-            elif "**Medical Recommendations**" in ai_response:
-                parts = ai_response.split("**Medical Recommendations**")
-                diagnosis = parts[0].replace("**Clinical Assessment**", "").replace("Clinical Assessment", "").strip()
-                recommendations = "<h4>Medical Recommendations</h4>" + parts[1].strip()
-            else:
-                # Fallback if AI doesn't split properly
-                diagnosis = ai_response
-                recommendations = "<p>Please consult with your healthcare provider for personalized recommendations.</p>"
-            
-            # Determine overall status
-            if critical_tests:
-                overall_status = 'critical'
-            elif abnormal_tests:
-                overall_status = 'at_risk'
-            else:
-                overall_status = 'normal'
-            
-            # Update report
-            report.diagnosis = diagnosis
-            report.recommendations = recommendations
-            report.status = overall_status
-            report.ai_generated = True
-            report.save()
-            
-            messages.success(request, 'AI report generated successfully!')
+            # Queue the generation for the AI worker, the page polls the job status
+            job = jobs.enqueue(report, created_by=request.user)
             return JsonResponse({
                 'success': True,
-                'diagnosis': diagnosis,
-                'recommendations': recommendations,
-                'status': overall_status
-            })
+                'job_id': job.pk,
+                'status': job.status,
+                'status_url': reverse('ai_job_status', args=[job.pk]),
+            }, status=202)
             
         except MedicalReport.DoesNotExist:
             return JsonResponse({'success': False, 'error': 'Report not found'})
@@ -785,6 +726,116 @@ Separate the two sections clearly with the headers "Clinical Assessment" and "Me
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
 
+def sse_event(event, data):
+    """One Server-Sent Event with a JSON payload"""
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def ai_report_events(report, tests, prompt):
+    """SSE stream of an AI generation: start, the answer's chunks, then done (or error).
+
+    Normal panels get the rule-based summary straight away, and so does an
+    abnormal one when the model fails or sends nothing within
+    AI_FIRST_TOKEN_TIMEOUT seconds.
+    """
+    yield sse_event('start', {'report_id': report.report_id})
+    if ai.uses_rules(tests):
+        async for event in summary_events(report, tests):
+            yield event
+        return
+    
+    stream = ai.stream_answer(prompt)
+    timeout = getattr(django_settings, 'AI_FIRST_TOKEN_TIMEOUT', 10)
+    try:
+        chunks = [await asyncio.wait_for(stream.__anext__(), timeout)]
+    except StopAsyncIteration:
+        chunks = []
+    except (asyncio.TimeoutError, *llm.ERRORS) as e:
+        await stream.aclose()
+        if ai.rules_fallback():
+            async for event in summary_events(report, tests):
+                yield event
+        else:
+            yield sse_event('error', {'error': f'AI generation failed: {str(e) or type(e).__name__}'})
+        return
+    
+    try:
+        if chunks:
+            yield sse_event('token', chunks[0])
+        async for chunk in stream:
+            chunks.append(chunk)
+            yield sse_event('token', chunk)
+        await sync_to_async(jobs.save_answer)(report, tests, ''.join(chunks))
+    except Exception as e:
+        yield sse_event('error', {'error': f'AI generation failed: {str(e)}'})
+        return
+    yield done_event(report, 'model')
+
+
+async def summary_events(report, tests):
+    """The rule-based summary, saved and sent as one chunk"""
+    await sync_to_async(jobs.retry_locked)(ai.apply_summary, report, tests)
+    yield sse_event('token', report.diagnosis + report.recommendations)
+    yield done_event(report, 'rules')
+
+
+def done_event(report, source):
+    return sse_event('done', {
+        'source': source,
+        'report_status': report.status,
+        'diagnosis': report.diagnosis,
+        'recommendations': report.recommendations,
+    })
+
+
+@async_admin_required
+async def stream_ai_report(request, report_id):
+    """Generate a report's AI analysis in the request, streaming the answer to the page as it arrives"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method'})
+    try:
+        report = await MedicalReport.objects.select_related('patient').aget(report_id=report_id)
+    except MedicalReport.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Report not found'}, status=404)
+    
+    tests = await sync_to_async(ai.report_tests)(report)
+    if not tests:
+        return JsonResponse({'success': False, 'error': ai.NO_RESULTS}, status=400)
+    response = StreamingHttpResponse(
+        ai_report_events(report, tests, ai.build_prompt(report, tests)), content_type='text/event-stream'
+    )
+    # Keep proxies from buffering the stream
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@admin_required
+def ai_job_status(request, job_id):
+    """Progress of a queued AI generation, polled by the report page"""
+    try:
+        job = AIJob.objects.select_related('report').get(pk=job_id)
+    except AIJob.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Job not found'}, status=404)
+    
+    data = {
+        'success': True,
+        'job_id': job.pk,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.last_error,
+    }
+    if job.status == AIJob.SUCCEEDED:
+        data.update({
+            'diagnosis': job.report.diagnosis,
+            'recommendations': job.report.recommendations,
+            'report_status': job.report.status,
+        })
+    return JsonResponse(data)
+
+
 # Patient Portal Views
 def patient_portal(request):
     """Portal view for patients to see their reports"""
@@ -817,28 +868,25 @@ def patient_report_detail(request, report_id):
         return redirect('login')
     
     patient = request.user.patient_profile
-    report = get_object_or_404(MedicalReport, report_id=report_id, patient=patient)
-    lab_settings = LabSettings.get_settings()
-    
-    # Get published test groups for THIS SPECIFIC REPORT
-    from collections import defaultdict
-    all_tests = PatientTest.objects.filter(
-        report=report,
-        is_published=True
-    ).select_related('test_type', 'test_type__category').order_by('-test_date', 'test_group')
+    report = get_object_or_404(
+        MedicalReport.objects.select_related('patient', 'created_by'), report_id=report_id, patient=patient
+    )
+    return render_report_detail(request, report, is_patient_view=True)
+
+
+def patient_report_pdf(request, report_id):
+    """PDF download of a report for the patient it belongs to"""
+    if not request.user.is_authenticated:
+        return redirect('login')
     
-    # Group tests by test_group
-    test_groups = defaultdict(list)
-    for test in all_tests:
-        test_groups[test.test_group].append(test)
+    if not hasattr(request.user, 'patient_profile'):
+        messages.error(request, 'Access denied.')
+        return redirect('login')
     
-    context = {
-        'report': report,
-        'test_groups': list(test_groups.values()),
-        'lab_settings': lab_settings,
-        'is_patient_view': True,
-    }
-    return render(request, 'report_detail.html', context)
+    report = get_object_or_404(
+        MedicalReport.objects.select_related('patient'), report_id=report_id, patient=request.user.patient_profile
+    )
+    return serve_report_pdf(report)
 
 
 def patient_logout_view(request):